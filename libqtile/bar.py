@@ -157,7 +157,11 @@ class Bar(Gap, configurable.Configurable):
         self.widgets = widgets
         self.saved_focus = None
 
-        self.queued_draws = 0
+        # Widgets to repaint on the next draw (all of them if None), and the
+        # (offset, length) each widget was last painted at
+        self.damaged = None
+        self.painted = {}
+        self.painted_end = None
 
     def _configure(self, qtile, screen):
         Gap._configure(self, qtile, screen)
@@ -194,10 +198,16 @@ class Bar(Gap, configurable.Configurable):
         qtile.windowMap[self.window.window.wid] = self.window
         self.window.unhide()
 
+        self.damaged = None
+        self.painted = {}
+        self.painted_end = None
+
         for i in self.widgets:
             qtile.registerWidget(i)
             i._configure(qtile, self)
         self._resize(self.length, self.widgets)
+        for i in self.widgets:
+            i.drawer.resize(i.width, i.height)
 
     def finalize(self):
         self.drawer.finalize()
@@ -276,18 +286,36 @@ class Bar(Gap, configurable.Configurable):
         if self.saved_focus is not None:
             self.saved_focus.window.set_input_focus()
 
-    def draw(self):
-        if self.queued_draws == 0:
-            self.qtile.call_soon(self._actual_draw)
-        self.queued_draws += 1
+    def draw(self, widget=None, now=False):
+        """
+            Schedule a redraw of the bar in the next frame, or right away
+            with now (see Qtile.schedule_draw). A widget whose length may
+            have changed passes itself: then only that widget and the ones
+            that moved or changed length are repainted. Without a widget,
+            the whole bar is.
+        """
+        if widget is None:
+            self.damaged = None
+        elif self.damaged is not None:
+            self.damaged.add(widget)
+        self.qtile.schedule_draw(self._actual_draw, now)
 
     def _actual_draw(self):
-        self.queued_draws = 0
+        damaged = self.damaged
+        self.damaged = set()
         self._resize(self.length, self.widgets)
         for i in self.widgets:
-            i.draw()
+            geometry = (i.offset, i.length)
+            if damaged is None or i in damaged or \
+                    self.painted.get(i) != geometry:
+                i.drawer.resize(i.width, i.height)
+                i.draw()
+                self.painted[i] = geometry
         if self.widgets:
             end = i.offset + i.length
+            if end == self.painted_end and damaged is not None:
+                return
+            self.painted_end = end
             if end < self.length:
                 if self.horizontal:
                     self.drawer.draw(offsetx=end, width=self.length - end)
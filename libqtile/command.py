@@ -23,8 +23,12 @@ import traceback
 import textwrap
 import os
 
+import six
+from six.moves import asyncio
+
+from . import hook
 from . import ipc
-from .utils import get_cache_dir
+from .utils import QtileError, get_cache_dir
 
 
 class CommandError(Exception):
@@ -48,6 +52,9 @@ EXCEPTION = 2
 
 SOCKBASE = "qtilesocket.%s"
 
+# Upper bound on the number of events queued for a slow subscriber
+MAX_SUBSCRIPTION_QUEUE = 1000
+
 
 def formatSelector(lst):
     """
@@ -64,12 +71,68 @@ def formatSelector(lst):
     return "".join(expr)
 
 
+def _event_arg(arg):
+    """
+        Reduce a hook argument to something that can be sent to a client:
+        windows become a dict of their id and name, and other named objects
+        (groups, layouts, widgets) their name.
+    """
+    if arg is None or \
+            isinstance(arg, six.integer_types + six.string_types + (float,)):
+        return arg
+    if isinstance(arg, (list, tuple)):
+        return [_event_arg(i) for i in arg]
+    if isinstance(arg, dict):
+        return dict((k, _event_arg(v)) for k, v in arg.items())
+    if hasattr(arg, "window"):
+        return dict(id=arg.window.wid, name=arg.name)
+    return getattr(arg, "name", None)
+
+
+def chunked(func):
+    """
+        Mark a cmd_ method whose list result may be long, so that clients
+        get it in parts (see _ChunkedReply). Commands that return a
+        generator are always sent that way.
+    """
+    func.chunked = True
+    return func
+
+
+class _ChunkedReply(ipc.Chunked):
+    """
+        The reply to a command that returned a generator, or is marked with
+        chunked(): its items are sent to the client in parts of
+        ipc.PART_SIZE bytes, followed by a (state, value) tuple like that of
+        any other command. X is flushed once the items have been produced.
+    """
+    def __init__(self, parts, flush):
+        ipc.Chunked.__init__(self, parts)
+        self.flush = flush
+
+    def end(self):
+        self.flush()
+        return (SUCCESS, None)
+
+    def error(self, exc):
+        self.flush()
+        if isinstance(exc, CommandError):
+            return (ERROR, exc.args[0])
+        return (EXCEPTION, traceback.format_exc())
+
+
 class _Server(ipc.Server):
     def __init__(self, fname, qtile, conf, eventloop):
         if os.path.exists(fname):
             os.unlink(fname)
-        ipc.Server.__init__(self, fname, self.call, eventloop)
+        ipc.Server.__init__(
+            self, fname, lambda data: self.call(data, chunked=True),
+            eventloop, subscribe=self.subscribe,
+            error=lambda message: (ERROR, message)
+        )
         self.qtile = qtile
+        self.subscribers = {}
+        self.listeners = {}
         self.widgets = {}
         for i in conf.screens:
             for j in i.gaps:
@@ -78,7 +141,108 @@ class _Server(ipc.Server):
                         if w.name:
                             self.widgets[w.name] = w
 
-    def call(self, data):
+    def call(self, data, chunked=False):
+        """
+            Run a (selectors, name, args, kwargs) command and flush the X
+            connection afterwards.
+
+            Commands may return a generator to produce a long list of results
+            piecemeal. For clients, which set chunked, the results of
+            generators and of commands marked with chunked() are returned
+            wrapped in an ipc.Chunked, so that long lists are sent in parts,
+            and X is flushed after the last item; otherwise generators are
+            collected into a list.
+
+            A command named "batch" on the root object is special: its single
+            argument is a list of (selectors, name, args, kwargs) tuples,
+            which are all run in order before the connection is flushed
+            once. The result is a list of the (state, value) results of the
+            individual commands; a malformed tuple gets an ERROR result of
+            its own.
+        """
+        selectors, name, args, kwargs = data
+        if not selectors and name == "batch":
+            return self._batch(args)
+        result = self._call(data, chunked)
+        if not isinstance(result, _ChunkedReply):
+            self.qtile.conn.flush()
+        return result
+
+    def _batch(self, args):
+        if len(args) != 1 or not isinstance(args[0], (list, tuple)):
+            return (ERROR, "batch takes a single list of commands")
+        self.qtile.log.info("Command batch of %d" % len(args[0]))
+        results = []
+        try:
+            for i in args[0]:
+                if not ipc._valid_request(i):
+                    results.append((ERROR, "Invalid command %r" % (i,)))
+                    continue
+                try:
+                    results.append(self._call(i))
+                except Exception:
+                    results.append((EXCEPTION, traceback.format_exc()))
+        finally:
+            self.qtile.conn.flush()
+        return (SUCCESS, results)
+
+    def subscribe(self, data, subscription):
+        """
+            Handle a "subscribe" command: its single argument is a list of
+            hook names, and every time one of those hooks fires an (event,
+            args) tuple is pushed to the client. An optional maxlen keyword
+            bounds the number of events queued when the client falls behind.
+        """
+        selectors, name, args, kwargs = data
+        events = list(args[0]) if args else []
+        unknown = [i for i in events if i not in hook.subscribe.hooks]
+        if unknown:
+            subscription.close()
+            return (ERROR, "Unknown events: %s" % ", ".join(unknown))
+
+        subscription.maxlen = min(
+            kwargs.get("maxlen", subscription.maxlen),
+            MAX_SUBSCRIPTION_QUEUE
+        )
+        for event in events:
+            self.subscribers.setdefault(event, set()).add(subscription)
+            hook.subscribe._subscribe(event, self._listener(event))
+        subscription.add_close_callback(
+            lambda: self._unsubscribe(subscription, events)
+        )
+        self.qtile.log.info("Subscribed to %s" % ", ".join(events))
+        return (SUCCESS, None)
+
+    def _listener(self, event):
+        if event not in self.listeners:
+            def listener(*args, **kwargs):
+                args = [_event_arg(i) for i in args]
+                # Coalesce queued events about the same window; otherwise
+                # only identical events.
+                if args and isinstance(args[0], dict):
+                    key = (event, args[0]["id"])
+                else:
+                    key = (event, repr(args))
+                for subscription in list(self.subscribers.get(event, ())):
+                    subscription.push((event, args), key)
+            self.listeners[event] = listener
+        return self.listeners[event]
+
+    def _unsubscribe(self, subscription, events):
+        for event in events:
+            subscribers = self.subscribers.get(event)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[event]
+                try:
+                    hook.unsubscribe._subscribe(event, self.listeners[event])
+                except QtileError:
+                    # The hooks have been cleared since we subscribed
+                    pass
+
+    def _call(self, data, chunked=False):
         selectors, name, args, kwargs = data
         try:
             obj = self.qtile.select(selectors)
@@ -91,12 +255,17 @@ class _Server(ipc.Server):
             return (ERROR, "No such command.")
         self.qtile.log.info("Command: %s(%s, %s)" % (name, args, kwargs))
         try:
-            return (SUCCESS, cmd(*args, **kwargs))
+            result = cmd(*args, **kwargs)
+            generator = inspect.isgenerator(result)
+            if chunked and (generator or getattr(cmd, "chunked", False)):
+                return _ChunkedReply(result, self.qtile.conn.flush)
+            if generator:
+                result = list(result)
+            return (SUCCESS, result)
         except CommandError as v:
             return (ERROR, v.args[0])
         except Exception as v:
             return (EXCEPTION, traceback.format_exc())
-        self.qtile.conn.flush()
 
 
 class _Command(object):
@@ -235,13 +404,186 @@ class Client(_CommandRoot):
         _CommandRoot.__init__(self)
 
     def call(self, selectors, name, *args, **kwargs):
-        state, val = self.client.call((selectors, name, args, kwargs))
+        return _reply(self.client.call((selectors, name, args, kwargs)))
+
+    def iterate(self, call):
+        """
+            Run a single command that returns a list, returning an iterator
+            over its items. Long lists are sent in parts, so the first items
+            can be used before the rest have arrived, and the whole reply is
+            never decoded at once. Commands that return a generator send each
+            part as soon as its items have been produced.
+
+            call: a lazy call (e.g. lazy.windows()) or a (selectors, name,
+            args, kwargs) tuple.
+        """
+        parts, end = self.client.send_chunked(_batch_calls([call])[0])
+        for part in parts:
+            yield part
+        result = _result(*end.result())
+        # Chunked replies end with (SUCCESS, None)
+        if result is not None:
+            for i in result:
+                yield i
+
+    def batch(self, calls):
+        """
+            Run several commands in a single round trip. The commands are
+            executed one after another in the same turn of Qtile's event loop,
+            and X is only flushed once, after the last one.
+
+            calls: a list of lazy calls (e.g. lazy.window.kill()) or
+            (selectors, name, args, kwargs) tuples.
+
+            Returns a list of the commands' return values. If any command
+            failed, the first failure is raised once the whole batch has run.
+
+            Example:
+
+                c.batch([lazy.group["a"].toscreen(), lazy.window.kill()])
+        """
+        results = self.call([], "batch", _batch_calls(calls))
+        return [_result(state, val) for state, val in results]
+
+    def subscribe(self, events, maxlen=100):
+        """
+            Subscribe to hook events, returning an iterator over (event, args)
+            tuples that blocks until the next event fires. Windows in args
+            are given as dicts of their id and name, groups and layouts by
+            name.
+
+            events: a list of hook names, e.g. ["client_focus", "setgroup"].
+            maxlen: the number of events Qtile will queue if we fall behind;
+            beyond that, the oldest events are dropped.
+
+            The subscription lasts as long as the client's connection. Other
+            commands can still be issued through the same client; events that
+            arrive in the meantime are kept until they are iterated over.
+        """
+        stream = self.client.subscribe(
+            ([], "subscribe", (list(events),), dict(maxlen=maxlen))
+        )
+        try:
+            _result(*next(stream))
+        except Exception:
+            stream.close()
+            raise
+        return stream
+
+
+class AsyncClient(_CommandRoot):
+    """
+        Exposes the same command tree as Client, for use from within a
+        running asyncio event loop. Commands don't block; they return a
+        Future for their result, so many queries (to one or several Qtile
+        instances) can be outstanding at once.
+
+        Example:
+
+            c = AsyncClient()
+            info = yield From(c.window.info())  # or "await" on Python 3.5
+    """
+    def __init__(self, fname=None, loop=None):
+        if not fname:
+            fname = find_sockfile()
+        self.client = ipc.AsyncClient(fname, loop)
+        _CommandRoot.__init__(self)
+
+    def call(self, selectors, name, *args, **kwargs):
+        reply = self.client.call((selectors, name, args, kwargs))
+        return self._then(reply, _reply)
+
+    def batch(self, calls):
+        """
+            The asynchronous equivalent of Client.batch; returns a Future for
+            the list of results.
+        """
+        reply = self.client.call(([], "batch", (_batch_calls(calls),), {}))
+        return self._then(
+            reply,
+            lambda r: [_result(state, val) for state, val in _result(*r)]
+        )
+
+    def subscribe(self, events, maxlen=100):
+        """
+            The asynchronous equivalent of Client.subscribe; returns a Future
+            for an ipc.Stream, whose get() method returns a Future for the
+            next (event, args) tuple.
+        """
+        stream = self.client.subscribe(
+            ([], "subscribe", (list(events),), dict(maxlen=maxlen))
+        )
+
+        def subscribed(reply):
+            try:
+                _result(*reply)
+            except Exception:
+                stream.close()
+                raise
+            return stream
+        return self._then(stream.get(), subscribed)
+
+    def _then(self, future, func):
+        """
+            Return a Future for func applied to the result of future; any
+            exception, whether from future or func, is passed on.
+        """
+        result = asyncio.Future(loop=self.client.loop)
+
+        def done(future):
+            if result.cancelled():
+                return
+            if future.cancelled():
+                result.cancel()
+                return
+            try:
+                value = func(future.result())
+            except Exception as e:
+                result.set_exception(e)
+            else:
+                result.set_result(value)
+
+        future.add_done_callback(done)
+        return result
+
+
+def _batch_calls(calls):
+    """
+        Convert a list of lazy calls or (selectors, name, args, kwargs)
+        tuples to the form expected by the server's batch command.
+    """
+    return [
+        (i.selectors, i.name, i.args, i.kwargs)
+        if isinstance(i, _Call) else tuple(i)
+        for i in calls
+    ]
+
+
+def _reply(reply):
+    """
+        Turn the server's reply to a command into a return value. The items
+        of a chunked reply are collected into a list.
+    """
+    if isinstance(reply, ipc.Chunks):
+        state, val = reply.end
         if state == SUCCESS:
-            return val
-        elif state == ERROR:
-            raise CommandError(val)
-        else:
-            raise CommandException(val)
+            val = list(reply)
+    else:
+        state, val = reply
+    return _result(state, val)
+
+
+def _result(state, val):
+    """
+        Turn a (state, value) reply from the server into a return value,
+        raising the matching exception for failed commands.
+    """
+    if state == SUCCESS:
+        return val
+    elif state == ERROR:
+        raise CommandError(val)
+    else:
+        raise CommandException(val)
 
 
 class CommandRoot(_CommandRoot):
@@ -251,12 +593,7 @@ class CommandRoot(_CommandRoot):
 
     def call(self, selectors, name, *args, **kwargs):
         state, val = self.qtile.server.call((selectors, name, args, kwargs))
-        if state == SUCCESS:
-            return val
-        elif state == ERROR:
-            raise CommandError(val)
-        else:
-            raise CommandException(val)
+        return _result(state, val)
 
 
 class _Call(object):
@@ -360,15 +697,34 @@ class CommandObject(object):
         """
         raise NotImplementedError
 
+    @classmethod
+    def _command_table(cls):
+        """
+            Return a dict mapping the command names of this class to their
+            (unbound) cmd_ attributes, built on first use. Commands are
+            looked up once per class rather than with getattr() and dir() on
+            every call.
+        """
+        table = cls.__dict__.get("_commands")
+        if table is None:
+            table = {}
+            for klass in reversed(cls.__mro__):
+                for attr, value in vars(klass).items():
+                    if attr.startswith("cmd_"):
+                        table[attr[4:]] = value
+            cls._commands = table
+        return table
+
     def command(self, name):
-        return getattr(self, "cmd_" + name, None)
+        cmd = self._command_table().get(name)
+        if cmd is None:
+            # Commands may also be provided dynamically, as by
+            # layout.base.Delegate
+            return getattr(self, "cmd_" + name, None)
+        return cmd.__get__(self, type(self))
 
     def commands(self):
-        lst = []
-        for i in dir(self):
-            if i.startswith("cmd_"):
-                lst.append(i[4:])
-        return lst
+        return sorted(self._command_table())
 
     def cmd_commands(self):
         """
@@ -404,7 +760,7 @@ class CommandObject(object):
             Returns the documentation for a specified command name. Used by
             __qsh__ to provide online help.
         """
-        if name in self.commands():
+        if name in self._command_table():
             return self.doc(name)
         else:
             raise CommandError("No such command: %s" % name)
@@ -30,6 +30,9 @@ from . import hook
 from . import utils
 from . import xcbq
 
+import functools
+import operator
+import six
 from six import MAXSIZE
 
 
@@ -373,7 +376,7 @@ class Screen(command.CommandObject):
         for bar in [self.top, self.bottom, self.left, self.right]:
             if bar:
                 bar.draw()
-        self.qtile.call_soon(self.group.layoutAll())
+        self.group.layoutAll()
 
     def cmd_info(self):
         """
@@ -513,34 +516,19 @@ class Match(object):
         self._rules += [('wm_type', r) for r in wm_type]
         self._rules += [('wm_instance_class', w) for w in wm_instance_class]
         self._rules += [('net_wm_pid', w) for w in net_wm_pid]
+        self._compiled = [
+            (_type, _match_func(_type, rule)) for _type, rule in self._rules
+        ]
 
-    def compare(self, client):
-        for _type, rule in self._rules:
-            if _type == "net_wm_pid":
-                def match_func(value):
-                    return rule == value
-            else:
-                match_func = getattr(rule, 'match', None) or \
-                    getattr(rule, 'count')
-
-            if _type == 'title':
-                value = client.name
-            elif _type == 'wm_class':
-                value = None
-                _value = client.window.get_wm_class()
-                if _value and len(_value) > 1:
-                    value = _value[1]
-            elif _type == 'wm_instance_class':
-                value = client.window.get_wm_class()
-                if value:
-                    value = value[0]
-            elif _type == 'wm_type':
-                value = client.window.get_wm_type()
-            elif _type == 'net_wm_pid':
-                value = client.window.get_net_wm_pid()
-            else:
-                value = client.window.get_wm_window_role()
-
+    def compare(self, client, properties=None):
+        """
+            properties: a _ClientProperties of client, to share the property
+            values with other Matches.
+        """
+        if properties is None:
+            properties = _ClientProperties(client)
+        for _type, match_func in self._compiled:
+            value = properties[_type]
             if value and match_func(value):
                 return True
         return False
@@ -552,6 +540,130 @@ class Match(object):
                 callback(c)
 
 
+def _match_func(_type, rule):
+    """
+        Return the function testing a property value against a rule: pids
+        must be equal, regular expressions match at the start of the value,
+        and strings match values they contain.
+    """
+    if _type == "net_wm_pid":
+        return functools.partial(operator.eq, rule)
+    match = getattr(rule, 'match', None)
+    if match is not None:
+        return match
+    return rule.__contains__
+
+
+class _ClientProperties(object):
+    """
+        The values Match rules test on a client, each read from the window
+        only when first needed.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.values = {}
+
+    def __getitem__(self, _type):
+        try:
+            return self.values[_type]
+        except KeyError:
+            pass
+        window = self.client.window
+        if _type == 'title':
+            value = self.client.name
+        elif _type in ('wm_class', 'wm_instance_class'):
+            value = None
+            wm_class = window.get_wm_class()
+            if _type == 'wm_class':
+                if wm_class and len(wm_class) > 1:
+                    value = wm_class[1]
+            elif wm_class:
+                value = wm_class[0]
+        elif _type == 'wm_type':
+            value = window.get_wm_type()
+        elif _type == 'net_wm_pid':
+            value = window.get_net_wm_pid()
+        else:
+            value = window.get_wm_window_role()
+        self.values[_type] = value
+        return value
+
+
+class MatchIndex(object):
+    """
+        Finds which of a list of Matches match a client without trying them
+        one by one. Pids are looked up in a table of the pids of the rules.
+        String rules, which match the values they contain, are looked up in
+        a table per property that maps the substrings of the rules of up to
+        gram_length characters to the Matches that have them, so the tables
+        grow linearly with the length of the rules. A value that short is
+        looked up as it is; a longer one by its first gram_length
+        characters, and the few rules found are then checked against the
+        whole value. Only regular expressions are tried against every
+        client.
+    """
+    # The longest substrings of string rules that are indexed
+    gram_length = 3
+
+    def __init__(self, matches):
+        self.matches = list(matches)
+        # property -> pid -> indexes of Matches
+        self.pids = {}
+        # property -> substring -> (index of Match, rule) pairs
+        self.grams = {}
+        self.others = []
+        for i, match in enumerate(self.matches):
+            if six.get_unbound_function(type(match).compare) is not \
+                    six.get_unbound_function(Match.compare):
+                # It has its own idea of what matches
+                self.others.append((i, None, match.compare))
+                continue
+            for _type, rule in match._rules:
+                if _type == 'net_wm_pid':
+                    table = self.pids.setdefault(_type, {})
+                    table.setdefault(rule, set()).add(i)
+                elif isinstance(rule, six.string_types):
+                    table = self.grams.setdefault(_type, {})
+                    for start in range(len(rule)):
+                        stop = min(start + self.gram_length, len(rule))
+                        for end in range(start + 1, stop + 1):
+                            table.setdefault(
+                                rule[start:end], set()
+                            ).add((i, rule))
+                else:
+                    self.others.append((i, _type, _match_func(_type, rule)))
+
+    def matching(self, client):
+        """
+            Return the indexes of the Matches that match client, in order.
+        """
+        properties = _ClientProperties(client)
+        found = set()
+        for _type, table in self.pids.items():
+            value = properties[_type]
+            if value:
+                found.update(table.get(value, ()))
+        for _type, table in self.grams.items():
+            value = properties[_type]
+            if not value:
+                continue
+            short = len(value) <= self.gram_length
+            for i, rule in table.get(value[:self.gram_length], ()):
+                if short or value in rule:
+                    found.add(i)
+        for i, _type, match_func in self.others:
+            if i in found:
+                continue
+            if _type is None:
+                if match_func(client):
+                    found.add(i)
+            else:
+                value = properties[_type]
+                if value and match_func(value):
+                    found.add(i)
+        return sorted(found)
+
+
 class Rule(object):
     """
         A Rule contains a Match object, and a specification about what to do
@@ -89,6 +89,7 @@ class File(object):
             "widget_defaults",
             "bring_front_click",
             "wmname",
+            "frame_rate",
         ]
 
         for option in config_options:
@@ -34,6 +34,7 @@ from libqtile.command import lazy
 from libqtile.config import Group
 from libqtile.config import Rule
 from libqtile.config import Match
+from libqtile.config import MatchIndex
 
 def simple_key_binder(mod, keynames=None):
     """
@@ -83,6 +84,9 @@ class DGroups(object):
         self.rules = []
         self.rules_map = {}
         self.last_rule_id = 0
+        # MatchIndex of self.rules, rebuilt when they change
+        self._index = None
+        self._indexed = []
 
         for rule in getattr(qtile.config, 'dgroups_app_rules', []):
             self.add_rule(rule)
@@ -105,6 +109,7 @@ class DGroups(object):
             self.rules.append(rule)
         else:
             self.rules.insert(0, rule)
+        self._index = None
         self.last_rule_id += 1
         return rule_id
 
@@ -112,6 +117,7 @@ class DGroups(object):
         rule = self.rules_map.get(rule_id, None)
         if rule:
             self.rules.remove(rule)
+            self._index = None
             del self.rules_map[rule_id]
         else:
             self.qtile.log.warn('Rule "%s" not found' % rule_id)
@@ -120,6 +126,8 @@ class DGroups(object):
         self.groupMap[group.name] = group
         rules = [Rule(m, group=group.name) for m in group.matches]
         self.rules.extend(rules)
+        if rules:
+            self._index = None
         if start:
             self.qtile.addGroup(group.name, group.layout, group.layouts)
 
@@ -152,6 +160,15 @@ class DGroups(object):
         if group_name not in self.groupMap:
             self.add_dgroup(Group(group_name, persist=False))
 
+    def matching_rules(self, client):
+        """
+            Return the rules matching client, in order.
+        """
+        if self._index is None:
+            self._index = MatchIndex(rule.match for rule in self.rules)
+            self._indexed = list(self.rules)
+        return [self._indexed[i] for i in self._index.matching(client)]
+
     def _add(self, client):
         if client in self.timeout:
             self.qtile.log.info('Remove dgroup source')
@@ -169,43 +186,41 @@ class DGroups(object):
         group_set = False
         intrusive = False
 
-        for rule in self.rules:
-            # Matching Rules
-            if rule.matches(client):
-                if rule.group:
-                    try:
-                        layout = self.groupMap[rule.group].layout
-                    except KeyError:
-                        layout = None
-                    try:
-                        layouts = self.groupMap[rule.group].layouts
-                    except KeyError:
-                        layouts = None
-                    group_added = self.qtile.addGroup(rule.group, layout, layouts)
-                    client.togroup(rule.group)
-
-                    group_set = True
-
-                    group_obj = self.qtile.groupMap[rule.group]
-                    group = self.groupMap.get(rule.group)
-                    if group and group_added:
-                        for k, v in list(group.layout_opts.items()):
-                            if isinstance(v, collections.Callable):
-                                v(group_obj.layout)
-                            else:
-                                setattr(group_obj.layout, k, v)
-                        affinity = group.screen_affinity
-                        if affinity and len(self.qtile.screens) > affinity:
-                            self.qtile.screens[affinity].setGroup(group_obj)
-
-                if rule.float:
-                    client.enablefloating()
-
-                if rule.intrusive:
-                    intrusive = rule.intrusive
-
-                if rule.break_on_match:
-                    break
+        for rule in self.matching_rules(client):
+            if rule.group:
+                try:
+                    layout = self.groupMap[rule.group].layout
+                except KeyError:
+                    layout = None
+                try:
+                    layouts = self.groupMap[rule.group].layouts
+                except KeyError:
+                    layouts = None
+                group_added = self.qtile.addGroup(rule.group, layout, layouts)
+                client.togroup(rule.group)
+
+                group_set = True
+
+                group_obj = self.qtile.groupMap[rule.group]
+                group = self.groupMap.get(rule.group)
+                if group and group_added:
+                    for k, v in list(group.layout_opts.items()):
+                        if isinstance(v, collections.Callable):
+                            v(group_obj.layout)
+                        else:
+                            setattr(group_obj.layout, k, v)
+                    affinity = group.screen_affinity
+                    if affinity and len(self.qtile.screens) > affinity:
+                        self.qtile.screens[affinity].setGroup(group_obj)
+
+            if rule.float:
+                client.enablefloating()
+
+            if rule.intrusive:
+                intrusive = rule.intrusive
+
+            if rule.break_on_match:
+                break
 
         # If app doesn't have a group
         if not group_set:
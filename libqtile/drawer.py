@@ -40,6 +40,32 @@ from . import pangocffi
 from . import utils
 
 
+class TextSizeCache(object):
+    """
+        Pixel sizes of text layouts, keyed on everything that affects them,
+        so that measuring a string measured before doesn't need pango. The
+        least recently used entries are dropped past max_entries.
+    """
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        # key -> (width, height), least recently used first
+        self.sizes = collections.OrderedDict()
+
+    def get(self, key):
+        size = self.sizes.pop(key, None)
+        if size is not None:
+            self.sizes[key] = size
+        return size
+
+    def put(self, key, size):
+        self.sizes[key] = size
+        if len(self.sizes) > self.max_entries:
+            self.sizes.popitem(last=False)
+
+
+text_sizes = TextSizeCache()
+
+
 class TextLayout(object):
     def __init__(self, drawer, text, colour, font_family, font_size,
                  font_shadow, wrap=True, markup=False):
@@ -54,32 +80,58 @@ class TextLayout(object):
         self.font_shadow = font_shadow
         self.layout = layout
         self.markup = markup
-        self.text = text
+        # The font description, family set afterwards, and size, as part of
+        # the text_sizes key
+        self._font = (font_family, None, font_size)
+        self._wrap = wrap
+        # pango is only given the text when it's drawn, or measured and not
+        # in text_sizes
+        self._text = text
+        self._synced = False
         self._width = None
 
     def finalize(self):
         self.layout.finalize()
 
-    @property
-    def text(self):
-        return self.layout.get_text()
-
-    @text.setter
-    def text(self, value):
+    def _sync(self):
+        if self._synced:
+            return
+        self._synced = True
+        value = self._text
         if self.markup:
             # pangocffi doesn't like None here, so we use "".
             if value is None:
                 value = ''
             attrlist, value, accel_char = pangocffi.parse_markup(value)
             self.layout.set_attributes(attrlist)
-        return self.layout.set_text(utils.scrub_to_utf8(value))
+        self.layout.set_text(utils.scrub_to_utf8(value))
+
+    def _pixel_size(self):
+        key = (self._text, self.markup, self._font, self._width, self._wrap)
+        size = text_sizes.get(key)
+        if size is None:
+            self._sync()
+            size = self.layout.get_pixel_size()
+            text_sizes.put(key, size)
+        return size
+
+    @property
+    def text(self):
+        self._sync()
+        return self.layout.get_text()
+
+    @text.setter
+    def text(self, value):
+        if value != self._text:
+            self._text = value
+            self._synced = False
 
     @property
     def width(self):
         if self._width is not None:
             return self._width
         else:
-            return self.layout.get_pixel_size()[0]
+            return self._pixel_size()[0]
 
     @width.setter
     def width(self, value):
@@ -93,7 +145,7 @@ class TextLayout(object):
 
     @property
     def height(self):
-        return self.layout.get_pixel_size()[1]
+        return self._pixel_size()[1]
 
     def fontdescription(self):
         return self.layout.get_font_description()
@@ -108,6 +160,7 @@ class TextLayout(object):
         d = self.fontdescription()
         d.set_family(font)
         self.layout.set_font_description(d)
+        self._font = (self._font[0], font, self._font[2])
 
     @property
     def font_size(self):
@@ -120,8 +173,10 @@ class TextLayout(object):
         d.set_size(size)
         d.set_absolute_size(pangocffi.units_from_double(size))
         self.layout.set_font_description(d)
+        self._font = (self._font[0], self._font[1], size)
 
     def draw(self, x, y):
+        self._sync()
         if self.font_shadow is not None:
             self.drawer.set_source_rgb(self.font_shadow)
             self.drawer.ctx.move_to(x + 1, y + 1)
@@ -210,25 +265,19 @@ class Drawer(object):
         A helper class for drawing and text layout.
 
         We have a drawer object for each widget in the bar. The underlying
-        surface is a pixmap with the same size as the bar itself. We draw to
-        the pixmap starting at offset 0, 0, and when the time comes to display
-        to the window, we copy the appropriate portion of the pixmap onto the
-        window.
+        surface is a pixmap with the size of the widget, which the bar keeps
+        up to date with resize(). We draw to the pixmap starting at offset 0,
+        0, and when the time comes to display to the window, we copy the
+        appropriate portion of the pixmap onto the window.
     """
     def __init__(self, qtile, wid, width, height):
         self.qtile = qtile
-        self.wid, self.width, self.height = wid, width, height
+        self.wid = wid
 
-        self.pixmap = self.qtile.conn.conn.generate_id()
-        self.gc = self.qtile.conn.conn.generate_id()
+        # (font_family, font_size) -> TextLayout, for max_layout_size
+        self._size_layouts = {}
 
-        self.qtile.conn.conn.core.CreatePixmap(
-            self.qtile.conn.default_screen.root_depth,
-            self.pixmap,
-            self.wid,
-            self.width,
-            self.height
-        )
+        self.gc = self.qtile.conn.conn.generate_id()
         self.qtile.conn.conn.core.CreateGC(
             self.gc,
             self.wid,
@@ -238,8 +287,21 @@ class Drawer(object):
                 self.qtile.conn.default_screen.white_pixel
             ]
         )
+        self._create_pixmap(width, height)
+
+    def _create_pixmap(self, width, height):
+        # X doesn't allow empty pixmaps
+        self.width, self.height = max(width, 1), max(height, 1)
+        self.pixmap = self.qtile.conn.conn.generate_id()
+        self.qtile.conn.conn.core.CreatePixmap(
+            self.qtile.conn.default_screen.root_depth,
+            self.pixmap,
+            self.wid,
+            self.width,
+            self.height
+        )
         self.surface = cairocffi.XCBSurface(
-            qtile.conn.conn,
+            self.qtile.conn.conn,
             self.pixmap,
             self.find_root_visual(),
             self.width,
@@ -248,12 +310,32 @@ class Drawer(object):
         self.ctx = self.new_ctx()
         self.clear((0, 0, 1))
 
-    def finalize(self):
-        self.qtile.conn.conn.core.FreeGC(self.gc)
+    def _free_pixmap(self):
         self.qtile.conn.conn.core.FreePixmap(self.pixmap)
         self.ctx = None
         self.surface = None
 
+    def resize(self, width, height):
+        """
+            Make sure the pixmap can hold a width x height drawing. It is
+            replaced when it's too small, or more than twice too large, so a
+            widget whose length changes a little keeps its pixmap. The
+            contents are lost when it is replaced.
+        """
+        width, height = max(width, 1), max(height, 1)
+        if width <= self.width <= 2 * width and \
+                height <= self.height <= 2 * height:
+            return
+        self._free_pixmap()
+        self._create_pixmap(width, height)
+
+    def finalize(self):
+        for layout in self._size_layouts.values():
+            layout.finalize()
+        self._size_layouts = {}
+        self.qtile.conn.conn.core.FreeGC(self.gc)
+        self._free_pixmap()
+
     def _rounded_rect(self, x, y, width, height, linewidth):
         aspect = 1.0
         corner_radius = height / 10.0
@@ -310,6 +392,21 @@ class Drawer(object):
             self.height if height is None else height
         )
 
+    def scroll(self, x, y, width, height, dx, dy):
+        """
+            Move the width x height area of the pixmap at x, y by dx, dy.
+        """
+        self.surface.flush()
+        self.qtile.conn.conn.core.CopyArea(
+            self.pixmap,
+            self.pixmap,
+            self.gc,
+            x, y,
+            x + dx, y + dy,
+            width, height
+        )
+        self.surface.mark_dirty()
+
     def find_root_visual(self):
         for i in self.qtile.conn.default_screen.allowed_depths:
             for v in i.visuals:
@@ -355,8 +452,11 @@ class Drawer(object):
                           font_shadow, markup=markup, **kw)
 
     def max_layout_size(self, texts, font_family, font_size):
-        sizelayout = self.textlayout(
-            "", "ffffff", font_family, font_size, None)
+        sizelayout = self._size_layouts.get((font_family, font_size))
+        if sizelayout is None:
+            sizelayout = self.textlayout(
+                "", "ffffff", font_family, font_size, None)
+            self._size_layouts[(font_family, font_size)] = sizelayout
         widths, heights = [], []
         for i in texts:
             sizelayout.text = i
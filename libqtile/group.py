@@ -140,7 +140,14 @@ class _Group(command.CommandObject):
 
         If we have have a currentWindow give it focus, optionally
         moving warp to it.
+
+        This only marks the group as dirty; it is laid out on the next
+        iteration of the event loop, once however many times this was called
+        in the meantime. Use Qtile.flush_layout() to lay it out right away.
         """
+        self.qtile.schedule_layout(self, warp)
+
+    def _layoutAll(self, warp=False):
         if self.screen and len(self.windows):
             with self.disableMask(xcffib.xproto.EventMask.EnterWindow):
                 normal = [x for x in self.windows if not x.floating]
@@ -19,181 +19,1100 @@
 # SOFTWARE.
 
 """
-    A simple IPC mechanism for communicating between two local processes. We
-    use marshal to serialize data - this means that both client and server must
-    run the same Python version, and that clients must be trusted (as
-    un-marshalling untrusted data can result in arbitrary code execution).
+    A simple IPC mechanism for communicating between two local processes.
+
+    Connections are persistent. Every message is framed with its length and a
+    request id, so a client can keep one connection open and have any number
+    of requests in flight on it; each reply carries the id of the request it
+    answers. A long list may be sent in parts, each a list of items in a
+    frame of its own flagged as having more to follow, so that it doesn't
+    have to be built or decoded all at once. A subscription is a request
+    that is answered by a stream of messages pushed by the server, all
+    tagged with the subscribing request's id, until the connection is
+    closed.
+
+    Messages are serialized by a codec that is negotiated when the connection
+    is made: the client's first frame lists the codecs it can use in order of
+    preference, and the server answers with the first of those it supports.
+    By default a compact binary format which keeps Python's types is used;
+    clients may ask for JSON instead. Both are independent of the Python
+    version, and neither can run code when decoding untrusted input.
 """
-import marshal
+import collections
+import json
 import logging
 import os.path
 import socket
 import struct
 import fcntl
+import weakref
 
+import six
 from six.moves import asyncio
 
-HDRLEN = 4
+HDRFORMAT = "!LLB"
+HDRLEN = struct.calcsize(HDRFORMAT)
+
+# Frame flag: this frame is one part of a reply, and more parts follow
+FLAG_MORE = 0x01
+
+# The request id of the codec negotiation frames that open every connection
+HELLO_ID = 0xffffffff
+
+# How long a client waits for a reply before giving up on the server.
+TIMEOUT = 10
+
+# The encoded size up to which items of a chunked reply are sent together
+PART_SIZE = 64 * 1024
 
 
 class IPCError(Exception):
     pass
 
 
-class _IPC(object):
-    def _unpack(self, data):
+class Codec(object):
+    """
+        Base class for message serializers. The name identifies both the
+        format and its version during negotiation, so an incompatible change
+        to a format must come with a new name.
+    """
+    name = None
+
+    def encode(self, msg):
+        """
+            Return msg serialized as bytes. Raises TypeError if msg contains
+            something this codec can't represent.
+        """
+        raise NotImplementedError
+
+    def decode(self, data):
+        """
+            Return the message serialized in the bytes data. Raises
+            ValueError if data is malformed.
+        """
+        raise NotImplementedError
+
+    def join(self, items):
+        """
+            Return the serialization of a list, given those of its items.
+        """
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """
+        Plain JSON, for clients written in other languages. Tuples come back
+        as lists, and dict keys as strings.
+    """
+    name = "json/1"
+
+    def encode(self, msg):
+        return json.dumps(msg, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data.decode("utf-8"))
+
+    def join(self, items):
+        return b"[" + b",".join(items) + b"]"
+
+
+_LEN = struct.Struct("!L")
+_INT32 = struct.Struct("!i")
+_INT64 = struct.Struct("!q")
+_FLOAT = struct.Struct("!d")
+
+# Type tags. Strings, bytes and containers have a variant with a one byte
+# length for the common case of short values, and one with a four byte length.
+_NONE, _TRUE, _FALSE = 0x00, 0x01, 0x02
+_UINT8, _INT32_T, _INT64_T, _BIGINT, _FLOAT_T = 0x10, 0x11, 0x12, 0x13, 0x14
+_STR8, _STR32, _BYTES8, _BYTES32 = 0x20, 0x21, 0x22, 0x23
+_LIST8, _LIST32, _TUPLE8, _TUPLE32, _DICT8, _DICT32 = (
+    0x30, 0x31, 0x32, 0x33, 0x34, 0x35)
+
+_text = six.text_type
+_bytes = six.binary_type
+_ints = six.integer_types
+
+
+def _header(buf, tag8, tag32, n):
+    if n < 256:
+        buf.append(tag8)
+        buf.append(n)
+    else:
+        buf.append(tag32)
+        buf += _LEN.pack(n)
+
+
+def _encode(obj, buf):
+    t = type(obj)
+    if t is _text or (six.PY2 and t is _bytes):
+        if t is _text:
+            obj = obj.encode("utf-8")
+        _header(buf, _STR8, _STR32, len(obj))
+        buf += obj
+    elif t in _ints:
+        if 0 <= obj < 256:
+            buf.append(_UINT8)
+            buf.append(obj)
+        elif -0x80000000 <= obj <= 0x7fffffff:
+            buf.append(_INT32_T)
+            buf += _INT32.pack(obj)
+        elif -0x8000000000000000 <= obj <= 0x7fffffffffffffff:
+            buf.append(_INT64_T)
+            buf += _INT64.pack(obj)
+        else:
+            digits = str(obj).encode("ascii")
+            buf.append(_BIGINT)
+            buf += _LEN.pack(len(digits))
+            buf += digits
+    elif t is dict:
+        _header(buf, _DICT8, _DICT32, len(obj))
+        for k, v in obj.items():
+            _encode(k, buf)
+            _encode(v, buf)
+    elif t is list:
+        _header(buf, _LIST8, _LIST32, len(obj))
+        for i in obj:
+            _encode(i, buf)
+    elif t is tuple:
+        _header(buf, _TUPLE8, _TUPLE32, len(obj))
+        for i in obj:
+            _encode(i, buf)
+    elif obj is None:
+        buf.append(_NONE)
+    elif obj is True:
+        buf.append(_TRUE)
+    elif obj is False:
+        buf.append(_FALSE)
+    elif t is float:
+        buf.append(_FLOAT_T)
+        buf += _FLOAT.pack(obj)
+    elif t is _bytes:
+        _header(buf, _BYTES8, _BYTES32, len(obj))
+        buf += obj
+    else:
+        # Subclasses of the supported types (OrderedDict, IntEnum, ...)
+        for base in (bool, float, _text, _bytes, list, tuple, dict) + _ints:
+            if isinstance(obj, base):
+                return _encode(base(obj), buf)
+        raise TypeError("Can't encode %r" % (obj,))
+
+
+def _decode(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == _STR8 or tag == _STR32:
+        if tag == _STR8:
+            end = pos + 1 + data[pos]
+            pos += 1
+        else:
+            end = pos + 4 + _LEN.unpack_from(data, pos)[0]
+            pos += 4
+        if end > len(data):
+            raise ValueError("truncated string")
+        s = data[pos:end].decode("utf-8")
+        if six.PY2:
+            s = s.encode("utf-8")
+        return s, end
+    elif tag == _UINT8:
+        return data[pos], pos + 1
+    elif tag == _INT32_T:
+        return _INT32.unpack_from(data, pos)[0], pos + 4
+    elif tag == _DICT8 or tag == _DICT32:
+        if tag == _DICT8:
+            n = data[pos]
+            pos += 1
+        else:
+            n = _LEN.unpack_from(data, pos)[0]
+            pos += 4
+        d = {}
+        for _ in range(n):
+            k, pos = _decode(data, pos)
+            d[k], pos = _decode(data, pos)
+        return d, pos
+    elif _LIST8 <= tag <= _TUPLE32:
+        if tag == _LIST8 or tag == _TUPLE8:
+            n = data[pos]
+            pos += 1
+        else:
+            n = _LEN.unpack_from(data, pos)[0]
+            pos += 4
+        lst = []
+        append = lst.append
+        for _ in range(n):
+            obj, pos = _decode(data, pos)
+            append(obj)
+        if tag >= _TUPLE8:
+            return tuple(lst), pos
+        return lst, pos
+    elif tag == _NONE:
+        return None, pos
+    elif tag == _TRUE:
+        return True, pos
+    elif tag == _FALSE:
+        return False, pos
+    elif tag == _INT64_T:
+        return _INT64.unpack_from(data, pos)[0], pos + 8
+    elif tag == _FLOAT_T:
+        return _FLOAT.unpack_from(data, pos)[0], pos + 8
+    elif tag == _BIGINT or tag == _BYTES8 or tag == _BYTES32:
+        if tag == _BYTES8:
+            end = pos + 1 + data[pos]
+            pos += 1
+        else:
+            end = pos + 4 + _LEN.unpack_from(data, pos)[0]
+            pos += 4
+        if end > len(data):
+            raise ValueError("truncated bytes")
+        if tag == _BIGINT:
+            return int(bytes(data[pos:end])), end
+        return bytes(data[pos:end]), end
+    raise ValueError("unknown type tag 0x%02x" % tag)
+
+
+class BinaryCodec(Codec):
+    """
+        A compact, self-describing binary format covering the types commands
+        and their replies are made of: None, bools, ints, floats, strings,
+        bytes, lists, tuples and dicts. Every value is a one byte type tag
+        followed by fixed size big-endian numbers, or a length and the
+        contents for strings and containers.
+    """
+    name = "binary/1"
+
+    def encode(self, msg):
+        buf = bytearray()
+        _encode(msg, buf)
+        return bytes(buf)
+
+    def join(self, items):
+        buf = bytearray()
+        _header(buf, _LIST8, _LIST32, len(items))
+        for i in items:
+            buf += i
+        return bytes(buf)
+
+    def decode(self, data):
+        # Indexing a bytearray gives ints on both Python 2 and 3
+        data = bytearray(data)
         try:
-            assert len(data) >= HDRLEN
-            size = struct.unpack("!L", data[:HDRLEN])[0]
-            assert size >= len(data[HDRLEN:])
-            return self._unpack_body(data[HDRLEN:HDRLEN + size])
-        except AssertionError:
-            raise IPCError(
-                "error reading reply!"
-                " (probably the socket was disconnected)"
-            )
+            msg, pos = _decode(data, 0)
+        except (IndexError, TypeError, struct.error, RuntimeError) as e:
+            # TypeError covers unhashable dict keys, RuntimeError overly
+            # deep nesting
+            raise ValueError("malformed message: %r" % (e,))
+        if pos != len(data):
+            raise ValueError("trailing data after message")
+        return msg
+
+
+CODECS = {}
+
+# The codecs clients offer, in order of preference. JSON turns tuples into
+# lists and dict keys into strings, so it is only used by clients that ask
+# for it, such as ones not written in Python.
+DEFAULT_CODECS = ("binary/1",)
+
+
+def register_codec(codec):
+    """
+        Make a Codec instance available for negotiation by name.
+    """
+    CODECS[codec.name] = codec
+
+
+register_codec(BinaryCodec())
+register_codec(JSONCodec())
+
+
+def _valid_request(req):
+    """
+        Whether req has the (selectors, name, args, kwargs) shape of a
+        request. The codecs may turn tuples into lists.
+    """
+    return (
+        isinstance(req, (list, tuple)) and len(req) == 4 and
+        isinstance(req[0], (list, tuple)) and
+        isinstance(req[1], six.string_types) and
+        isinstance(req[2], (list, tuple)) and
+        isinstance(req[3], dict)
+    )
+
+
+def _frame(body, msgid, flags=0):
+    return struct.pack(HDRFORMAT, len(body), msgid, flags) + body
+
+
+class Chunked(object):
+    """
+        A handler result that is sent as a series of messages rather than as
+        a single one: the items of parts are sent in lists of up to
+        part_size encoded bytes. The client gets the first parts while later
+        items are still being produced, and neither end holds the whole
+        reply in memory. The parts are followed by the message returned by
+        end(), or by error() if iterating over parts, or encoding an item,
+        raises an exception.
+    """
+    part_size = PART_SIZE
+
+    def __init__(self, parts):
+        self.parts = iter(parts)
+
+    def end(self):
+        return None
+
+    def error(self, exc):
+        raise exc
+
+
+class Chunks(list):
+    """
+        The items of a chunked reply, as collected by a client that didn't
+        ask for its parts one by one. end is the message that ended the
+        reply.
+    """
+    end = None
+
+
+class _IPC(object):
+    codec = None
+
+    def _frames(self, buf):
+        """
+            Remove all complete frames from the front of the bytearray buf,
+            and return them as a list of (msgid, flags, body) tuples. Any
+            trailing partial frame is left in buf.
+        """
+        frames = []
+        while len(buf) >= HDRLEN:
+            size, msgid, flags = struct.unpack_from(HDRFORMAT, buf)
+            end = HDRLEN + size
+            if len(buf) < end:
+                break
+            frames.append((msgid, flags, bytes(buf[HDRLEN:end])))
+            del buf[:end]
+        return frames
 
     def _unpack_body(self, body):
-        return marshal.loads(body)
+        try:
+            return self.codec.decode(body)
+        except ValueError as e:
+            raise IPCError("error decoding message: %s" % e)
 
-    def _pack(self, msg):
-        msg = marshal.dumps(msg)
-        size = struct.pack("!L", len(msg))
-        return size + msg
+    def _pack(self, msg, msgid, flags=0):
+        return _frame(self.codec.encode(msg), msgid, flags)
 
 
 class _ClientProtocol(asyncio.Protocol, _IPC):
     """IPC Client Protocol
 
-    1. Once the connection is made, the client initializes a Future self.reply,
-    which will hold the response from the server.
+    1. Once the connection is made, the client initializes an empty table of
+    pending requests and offers the server its codecs. The negotiated Future
+    is resolved once the server has picked one.
 
-    2. The message is sent to the server with .send(msg), which closes the
-    connection once the message is sent.
+    2. Each message is sent to the server with .send(msg), which tags it with
+    a fresh request id and returns a Future that will hold the reply.
 
-    3. The client then recieves data from the server until the server closes
-    the connection, signalling that all the data has been sent.
+    3. As frames arrive from the server, they are matched to their pending
+    request by id and the corresponding Future is resolved. The parts of a
+    chunked reply, each a list of items, are decoded as they arrive, and
+    either passed to the callback given to .send() or collected into a Chunks
+    list of items that the Future resolves to.
 
-    4. When the server sends on EOF, the data is unpacked and stored to the
-    reply future.
+    4. If the server closes the connection, every request still pending fails
+    with an IPCError and the protocol is marked closed.
     """
+    def __init__(self, loop, codecs=DEFAULT_CODECS):
+        asyncio.Protocol.__init__(self)
+        self.loop = loop
+        self.codecs = codecs
+        self.closed = True
+
     def connection_made(self, transport):
         self.transport = transport
-        self.recv = b''
-        self.reply = asyncio.Future()
+        self.recv = bytearray()
+        self.pending = {}
+        self.chunks = {}
+        self.streams = {}
+        self.next_id = 0
+        self.closed = False
+        self.negotiated = asyncio.Future(loop=self.loop)
+        hello = " ".join(self.codecs).encode("ascii")
+        self.transport.write(_frame(hello, HELLO_ID))
 
-    def send(self, msg):
-        self.transport.write(self._pack(msg))
-        try:
-            self.transport.write_eof()
-        except AttributeError:
-            log = logging.getLogger('qtile')
-            log.exception('Swallowing AttributeError due to asyncio bug!')
+    def _write(self, msg):
+        msgid = self.next_id
+        self.next_id = (self.next_id + 1) & 0xffffffff
+        self.transport.write(self._pack(msg, msgid))
+        return msgid
 
-    def data_received(self, data):
-        self.recv += data
+    def send(self, msg, on_part=None):
+        """
+            Send msg, returning a Future for the reply. If the reply is
+            chunked, each part is passed to on_part as it arrives, and the
+            Future resolves to the message that ends the reply.
+        """
+        reply = asyncio.Future(loop=self.loop)
+        msgid = self._write(msg)
+        self.pending[msgid] = reply
+        if on_part is not None:
+            self.chunks[msgid] = on_part
+        return reply
 
-    def eof_received(self):
-        # The server sends EOF when there is data ready to be processed
+    def subscribe(self, msg, stream=None):
+        """
+            Send a subscription request, returning the Stream its messages
+            will be delivered to.
+        """
+        if stream is None:
+            stream = Stream(self.loop)
+        msgid = self._write(msg)
+        self.streams[msgid] = stream
+        stream.proto, stream.msgid = self, msgid
+        return stream
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.transport.close()
+
+    def data_received(self, data):
+        self.recv.extend(data)
         try:
-            data = self._unpack(self.recv)
+            for msgid, flags, body in self._frames(self.recv):
+                if self.codec is None:
+                    self._negotiate(msgid, body)
+                else:
+                    self._dispatch(msgid, flags, self._unpack_body(body))
         except IPCError as e:
-            self.reply.set_exception(e)
-        else:
-            self.reply.set_result(data)
+            self._fail_pending(e)
+            self.close()
+
+    def _negotiate(self, msgid, body):
+        name = body.decode("ascii", "replace")
+        if msgid != HELLO_ID or name not in CODECS:
+            raise IPCError("Could not agree on a codec with the server")
+        self.codec = CODECS[name]
+        self.negotiated.set_result(name)
+
+    def _dispatch(self, msgid, flags, msg):
+        if flags & FLAG_MORE:
+            if msgid not in self.pending:
+                return
+            parts = self.chunks.get(msgid)
+            if parts is None:
+                self.chunks[msgid] = parts = Chunks()
+            if isinstance(parts, Chunks):
+                parts.extend(msg)
+            else:
+                parts(msg)
+            return
+
+        reply = self.pending.pop(msgid, None)
+        if reply is None:
+            stream = self.streams.get(msgid)
+            if stream is not None:
+                stream.feed(msg)
+            return
+        parts = self.chunks.pop(msgid, None)
+        if isinstance(parts, Chunks):
+            parts.end = msg
+            msg = parts
+        # The caller may have given up on this request already
+        if not reply.done():
+            reply.set_result(msg)
+
+    def eof_received(self):
+        # The server only closes its end when it is going away (e.g. restart)
+        self.closed = True
+        self._fail_pending(IPCError("server closed the connection"))
 
     def connection_lost(self, exc):
-        # The client shouldn't just lose the connection without an EOF
-        if exc:
-            self.reply.set_exception(exc)
-        if not self.reply.done():
-            self.reply.set_exception(IPCError)
+        self.closed = True
+        self._fail_pending(exc or IPCError("connection lost"))
+
+    def _fail_pending(self, exc):
+        if not self.negotiated.done():
+            self.negotiated.set_exception(exc)
+        self.chunks = {}
+        pending, self.pending = self.pending, {}
+        for reply in pending.values():
+            if not reply.done():
+                reply.set_exception(exc)
+        streams, self.streams = self.streams, {}
+        for stream in streams.values():
+            stream.fail(exc)
+
+
+class Stream(object):
+    """
+        The client end of a subscription: the sequence of messages pushed by
+        the server in answer to one subscribe request.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.messages = collections.deque()
+        self.getters = collections.deque()
+        self.exc = None
+        # The protocol delivering the messages, and the id of the request
+        self.proto = None
+        self.msgid = None
+
+    def feed(self, msg):
+        while self.getters:
+            getter = self.getters.popleft()
+            if not getter.done():
+                getter.set_result(msg)
+                return
+        self.messages.append(msg)
+
+    def fail(self, exc):
+        self.exc = exc
+        getters, self.getters = self.getters, collections.deque()
+        for getter in getters:
+            if not getter.done():
+                getter.set_exception(exc)
+
+    def close(self):
+        """
+            Stop delivering messages to the stream, e.g. once the server has
+            refused the subscription.
+        """
+        if self.proto is not None:
+            self.proto.streams.pop(self.msgid, None)
+            self.proto = None
+
+    def get(self):
+        """
+            Return a Future for the next message. Once the connection is gone
+            and all messages received have been consumed, the Future fails
+            with the connection's error.
+        """
+        getter = asyncio.Future(loop=self.loop)
+        if self.messages:
+            getter.set_result(self.messages.popleft())
+        elif self.exc is not None:
+            getter.set_exception(self.exc)
+        else:
+            self.getters.append(getter)
+        return getter
 
 
 class Client(object):
-    def __init__(self, fname):
+    """
+        A synchronous IPC client. The connection to the server is opened on
+        first use and kept open across calls; it is transparently re-opened
+        if the server goes away, as it does when qtile restarts. Requests
+        that the server never got because it closed the connection are sent
+        once more on the new one.
+    """
+    def __init__(self, fname, codecs=DEFAULT_CODECS):
         self.fname = fname
+        self.codecs = codecs
         self.loop = asyncio.get_event_loop()
+        self.proto = None
+
+    def connect(self):
+        if self.proto is not None and not self.proto.closed:
+            # The loop only runs during calls, so let the protocol see
+            # whether the server closed the connection in the meantime
+            self.loop.run_until_complete(asyncio.sleep(0))
+        if self.proto is None or self.proto.closed:
+            client_coroutine = self.loop.create_unix_connection(
+                lambda: _ClientProtocol(self.loop, self.codecs),
+                path=self.fname
+            )
+            try:
+                _, proto = self.loop.run_until_complete(client_coroutine)
+            except OSError:
+                raise IPCError("Could not open %s" % self.fname)
+
+            try:
+                self.loop.run_until_complete(
+                    asyncio.wait_for(proto.negotiated, timeout=TIMEOUT)
+                )
+            except asyncio.TimeoutError:
+                proto.close()
+                raise RuntimeError("Server not responding")
+            self.proto = proto
+        return self.proto
+
+    def close(self):
+        if self.proto is not None:
+            self.proto.close()
+            self.proto = None
 
     def send(self, msg):
-        client_coroutine = self.loop.create_unix_connection(_ClientProtocol, path=self.fname)
+        return self.send_many([msg])[0]
 
-        try:
+    def send_many(self, msgs):
+        """
+            Pipeline several messages over the connection without waiting
+            for each reply in turn. Returns the replies in the order the
+            messages were given.
+        """
+        replies = self._send_many(msgs)
+        # The connection was reset, or its end closed, before these were
+        # delivered: the server went away just as they were sent
+        lost = [
+            i for i, reply in enumerate(replies)
+            if isinstance(reply.exception(), OSError)
+        ]
+        if lost:
+            self.close()
+            retried = self._send_many([msgs[i] for i in lost])
+            for i, reply in zip(lost, retried):
+                replies[i] = reply
+
+        results = []
+        for reply in replies:
+            if isinstance(reply.exception(), OSError):
+                self.close()
+                raise IPCError(
+                    "Lost the connection to %s: %s" %
+                    (self.fname, reply.exception())
+                )
+            results.append(reply.result())
+        return results
 
-            _, client_proto = self.loop.run_until_complete(client_coroutine)
-        except OSError:
-            raise IPCError("Could not open %s" % self.fname)
+    def _send_many(self, msgs):
+        """
+            Send msgs and wait for all of their replies, returning the
+            Futures of the replies.
+        """
+        proto = self.connect()
+        replies = [proto.send(msg) for msg in msgs]
+        if replies:
+            _, pending = self.loop.run_until_complete(
+                asyncio.wait(replies, timeout=TIMEOUT)
+            )
+            if pending:
+                # Drop the connection so late replies can't be confused
+                # with those of later requests.
+                self.close()
+                raise RuntimeError("Server not responding")
+        return replies
 
-        client_proto.send(msg)
+    def call(self, data):
+        return self.send(data)
 
+    def send_chunked(self, msg):
+        """
+            Send msg and return a (parts, end) tuple for the reply. parts is
+            an iterator over the items of a chunked reply, whose parts are
+            decoded as soon as they arrive; end is a Future for the message
+            that ends the reply, which is done once parts is exhausted. A
+            reply that isn't chunked has no parts, only the end.
+        """
+        stream = Stream(self.loop)
+        end = self.connect().send(msg, stream.feed)
+
+        def parts():
+            while True:
+                part = stream.get()
+                if not part.done():
+                    done, _ = self.loop.run_until_complete(asyncio.wait(
+                        [part, end],
+                        timeout=TIMEOUT,
+                        return_when=asyncio.FIRST_COMPLETED
+                    ))
+                    if not done:
+                        self.close()
+                        raise RuntimeError("Server not responding")
+                # The parts are all in before the reply ends
+                if not part.done():
+                    part.cancel()
+                    return
+                for item in part.result():
+                    yield item
+        return parts(), end
+
+    def subscribe(self, msg):
+        """
+            Send a subscription request and return an iterator over the
+            messages the server pushes in answer; each step blocks until the
+            next message arrives.
+        """
+        stream = self.connect().subscribe(msg)
+
+        def messages():
+            try:
+                while True:
+                    yield self.loop.run_until_complete(stream.get())
+            finally:
+                stream.close()
+        return messages()
+
+
+class AsyncClient(object):
+    """
+        An IPC client for use from inside a running asyncio event loop.
+        Instead of blocking, send() returns a Future for the reply, so any
+        number of requests can be in flight at once over the one connection.
+        The connection is opened on first use and re-opened if the server
+        goes away. Use asyncio.wait_for() on the returned Futures if a
+        timeout is needed.
+    """
+    def __init__(self, fname, loop=None, codecs=DEFAULT_CODECS):
+        self.fname = fname
+        self.codecs = codecs
+        self.loop = loop or asyncio.get_event_loop()
+        self.proto = None
+        self._connecting = None
+
+    def _connect(self):
+        """
+            Return a Future that resolves to a connected protocol. Concurrent
+            callers share a single connection attempt.
+        """
+        if self._connecting is None:
+            self._connecting = asyncio.Future(loop=self.loop)
+            task = self.loop.create_task(self.loop.create_unix_connection(
+                lambda: _ClientProtocol(self.loop, self.codecs),
+                path=self.fname
+            ))
+            task.add_done_callback(self._connection_made)
+        return self._connecting
+
+    def _connection_made(self, task):
+        if task.cancelled():
+            connecting, self._connecting = self._connecting, None
+            connecting.cancel()
+            return
         try:
-            self.loop.run_until_complete(asyncio.wait_for(client_proto.reply, timeout=10))
-        except asyncio.TimeoutError:
-            raise RuntimeError("Server not responding")
+            _, proto = task.result()
+        except Exception as e:
+            if isinstance(e, OSError):
+                e = IPCError("Could not open %s" % self.fname)
+            connecting, self._connecting = self._connecting, None
+            connecting.set_exception(e)
+            return
 
-        return client_proto.reply.result()
+        def negotiated(negotiated):
+            connecting, self._connecting = self._connecting, None
+            if negotiated.exception() is not None:
+                connecting.set_exception(negotiated.exception())
+            else:
+                self.proto = proto
+                connecting.set_result(proto)
+        proto.negotiated.add_done_callback(negotiated)
+
+    def close(self):
+        if self.proto is not None:
+            self.proto.close()
+            self.proto = None
+
+    def send(self, msg):
+        if self.proto is not None and not self.proto.closed:
+            return self.proto.send(msg)
+
+        reply = asyncio.Future(loop=self.loop)
+
+        def connected(connecting):
+            if reply.cancelled():
+                return
+            if connecting.exception() is not None:
+                reply.set_exception(connecting.exception())
+            else:
+                _chain(connecting.result().send(msg), reply)
+
+        self._connect().add_done_callback(connected)
+        return reply
 
     def call(self, data):
         return self.send(data)
 
+    def subscribe(self, msg):
+        """
+            Send a subscription request and return the Stream its messages
+            will be delivered to.
+        """
+        if self.proto is not None and not self.proto.closed:
+            return self.proto.subscribe(msg)
+
+        stream = Stream(self.loop)
+
+        def connected(connecting):
+            if connecting.exception() is not None:
+                stream.fail(connecting.exception())
+            else:
+                connecting.result().subscribe(msg, stream)
+
+        self._connect().add_done_callback(connected)
+        return stream
+
+
+def _chain(source, dest):
+    """
+        Copy the outcome of the Future source into the Future dest once it is
+        available, unless dest has been cancelled in the meantime.
+    """
+    def done(source):
+        if dest.cancelled():
+            return
+        if source.cancelled():
+            dest.cancel()
+        elif source.exception() is not None:
+            dest.set_exception(source.exception())
+        else:
+            dest.set_result(source.result())
+    source.add_done_callback(done)
+
 
 class _ServerProtocol(asyncio.Protocol, _IPC):
     """IPC Server Protocol
 
     1. The server is initalized with a handler callback function for evaluating
-    incoming queries and a log.
+    incoming queries and a log. One protocol instance serves one connection.
+    The first frame the client sends lists the codecs it can use; the server
+    answers with the first one it knows, or closes the connection if there
+    is none.
 
-    2. Once the connection is made, the server initializes a data store for
+    2. Once the connection is made, the server initializes a buffer for
     incoming data.
 
-    3. The client sends all its data to the server, which is stored.
+    3. As data arrives, every complete frame is unpacked and run through the
+    handler, and the result is written back tagged with the request id of the
+    query.
 
-    4. The client signals that all data is sent by sending an EOF, at which
-    point the server then unpacks the data and runs it through the handler.
-    The result is returned to the client and the connection is closed.
+    4. The connection stays open until the client closes it, so a client can
+    issue any number of queries over it.
+
+    If the handler returns a Chunked, the first part of it is sent right
+    away and the others one per turn of the event loop, so other work isn't
+    held up by a long reply, and not at all while the transport's write
+    buffer is full.
+
+    5. A "subscribe" query is passed to the subscribe callback along with a
+    new Subscription, which the callback can keep to push messages to the
+    client for as long as the connection lasts. A callback that refuses the
+    subscription closes it before answering.
+
+    6. A query that isn't shaped like (selectors, name, args, kwargs), or
+    that the handler raises an exception on, is answered with the reply the
+    error callback returns for a description of the problem.
     """
-    def __init__(self, handler, log):
+    def __init__(self, handler, log, subscribe=None, loop=None, error=None):
         asyncio.Protocol.__init__(self)
         self.handler = handler
+        self.subscribe = subscribe
+        self.error = error or (lambda message: message)
         self.log = log
+        self.loop = loop or asyncio.get_event_loop()
 
     def connection_made(self, transport):
         self.transport = transport
         self.log.info('Connection made to server')
-        self.data = b''
+        # Connections stay open between commands, so don't let them leak
+        # into the process qtile exec()s on restart, which would never
+        # read them; their clients get EOF and reconnect instead.
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            flags = fcntl.fcntl(sock, fcntl.F_GETFD)
+            fcntl.fcntl(sock, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        self.data = bytearray()
+        self.subscriptions = []
+        self.chunked = collections.deque()
+        self.sending = False
+        self.paused = False
 
-    def data_received(self, recv):
-        self.log.info('Data recieved by server')
-        self.data += recv
+    def push(self, msg, msgid):
+        self.transport.write(self._pack(msg, msgid))
 
-    def eof_received(self):
-        self.log.info('EOF recieved by server')
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        for subscription in self.subscriptions:
+            subscription.flush()
+        self._schedule_parts()
+
+    def data_received(self, recv):
+        self.data.extend(recv)
         try:
-            req = self._unpack(self.data)
-        except IPCError:
-            self.log.info('Invalid data received, closing connection')
+            for msgid, flags, body in self._frames(self.data):
+                if self.codec is None:
+                    self._negotiate(msgid, body)
+                else:
+                    self._handle(msgid, self._unpack_body(body))
+        except IPCError as e:
+            self.log.info('Invalid data received (%s), closing connection' % e)
             self.transport.close()
+
+    def _negotiate(self, msgid, body):
+        if msgid != HELLO_ID:
+            raise IPCError("no codec negotiation")
+        names = body.decode("ascii", "replace").split()
+        for name in names:
+            if name in CODECS:
+                self.codec = CODECS[name]
+                self.transport.write(_frame(name.encode("ascii"), HELLO_ID))
+                return
+        self.transport.write(_frame(b"", HELLO_ID))
+        raise IPCError("no common codec in %s" % names)
+
+    def _handle(self, msgid, req):
+        if not _valid_request(req):
+            self.log.info('Invalid request: %r' % (req,))
+            self.push(self.error("Invalid request"), msgid)
             return
-        finally:
-            self.data = None
 
         if req[1] == 'restart':
+            # We are about to exec(), so let the client know there won't
+            # be a reply.
             self.log.info('Closing connection on restart')
             self.transport.write_eof()
+            try:
+                self.handler(req)
+            except Exception:
+                self.log.exception('Error handling restart')
+            return
 
-        rep = self.handler(req)
-        result = self._pack(rep)
-        self.log.info('Sending result on receive EOF')
-        self.transport.write(result)
+        try:
+            if req[1] == 'subscribe' and self.subscribe is not None:
+                subscription = Subscription(self, msgid)
+                try:
+                    rep = self.subscribe(req, subscription)
+                except Exception:
+                    subscription.close()
+                    raise
+                # The callback closes the subscription if it refuses it
+                if not subscription.closed:
+                    self.subscriptions.append(subscription)
+            else:
+                rep = self.handler(req)
+        except Exception:
+            self.log.exception('Error handling request %r' % (req,))
+            rep = self.error("Error handling request")
+        if isinstance(rep, Chunked):
+            self.chunked.append((msgid, rep))
+            if len(self.chunked) == 1 and not self.paused:
+                # A short reply is over without waiting for the event loop
+                self._send_part()
+            else:
+                self._schedule_parts()
+            return
+        try:
+            self.push(rep, msgid)
+        except TypeError:
+            self.log.exception('Could not encode the reply to %r' % (req,))
+            self.push(self.error("Could not encode the reply"), msgid)
+
+    def _schedule_parts(self):
+        if self.chunked and not self.sending and not self.paused:
+            self.sending = True
+            self.loop.call_soon(self._send_part)
+
+    def _send_part(self):
+        """
+            Send the next part of the oldest chunked reply, taking turns
+            between replies if there are several.
+        """
+        self.sending = False
+        if self.paused or not self.chunked:
+            return
+        msgid, chunked = self.chunked.popleft()
+        items = []
+        size = 0
+        done = True
+        try:
+            try:
+                while size < chunked.part_size:
+                    item = self.codec.encode(next(chunked.parts))
+                    items.append(item)
+                    size += len(item)
+                done = False
+            except StopIteration:
+                reply = chunked.end()
+            except Exception as e:
+                # Called while e is being handled, so that error() can
+                # format its traceback
+                reply = chunked.error(e)
+            if items:
+                body = self.codec.join(items)
+                self.transport.write(_frame(body, msgid, FLAG_MORE))
+            if done:
+                self.push(reply, msgid)
+        except Exception:
+            self.log.exception('Error in chunked reply, closing connection')
+            self.transport.close()
+            return
+        if not done:
+            self.chunked.append((msgid, chunked))
+        self._schedule_parts()
+
+    def eof_received(self):
         self.log.info('Closing connection on receive EOF')
-        self.transport.write_eof()
+
+    def connection_lost(self, exc):
+        self.data = None
+        for msgid, chunked in self.chunked:
+            if hasattr(chunked.parts, "close"):
+                chunked.parts.close()
+        self.chunked.clear()
+        for subscription in self.subscriptions:
+            subscription.close()
+        self.subscriptions = []
+
+
+class Subscription(object):
+    """
+        The server end of a subscription. Messages pushed while the client
+        keeps up are written out immediately. Once the connection's write
+        buffer fills up, they are held in a queue of at most maxlen messages
+        instead: a queued message is replaced by a newer one with the same
+        key, and when the queue is full the oldest message is dropped.
+    """
+    def __init__(self, proto, msgid, maxlen=100):
+        self.proto = proto
+        self.msgid = msgid
+        self.maxlen = maxlen
+        self.queue = collections.OrderedDict()
+        self.dropped = 0
+        self.closed = False
+        self.close_callbacks = []
+
+    def push(self, msg, key=None):
+        if self.closed:
+            return
+        if not self.proto.paused and not self.queue:
+            self.proto.push(msg, self.msgid)
+            return
+
+        if key is None:
+            key = object()
+        self.queue.pop(key, None)
+        self.queue[key] = msg
+        while len(self.queue) > self.maxlen:
+            self.queue.popitem(last=False)
+            self.dropped += 1
+
+    def flush(self):
+        # Writing may pause the protocol again, so check before every message
+        while self.queue and not self.proto.paused:
+            _, msg = self.queue.popitem(last=False)
+            self.proto.push(msg, self.msgid)
+
+    def add_close_callback(self, func):
+        self.close_callbacks.append(func)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        for func in self.close_callbacks:
+            func()
 
 
 class Server(object):
-    def __init__(self, fname, handler, loop):
+    def __init__(self, fname, handler, loop, subscribe=None, error=None):
         self.log = logging.getLogger('qtile')
         self.fname = fname
         self.handler = handler
+        self.subscribe = subscribe
+        self.error = error
         self.loop = loop
 
         if os.path.exists(fname):
@@ -207,15 +1126,29 @@ class Server(object):
         flags = fcntl.fcntl(self.sock, fcntl.F_GETFD)
         fcntl.fcntl(self.sock, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
         self.sock.bind(self.fname)
+        # The open connections, which are closed with the server
+        self.connections = weakref.WeakSet()
 
     def close(self):
         self.log.info('Stopping server on server close')
         self.server.close()
+        for proto in list(self.connections):
+            proto.transport.close()
         self.sock.close()
 
+    def _protocol(self):
+        proto = _ServerProtocol(
+            self.handler, self.log, self.subscribe, self.loop, self.error
+        )
+        self.connections.add(proto)
+        return proto
+
     def start(self):
-        serverprotocol = _ServerProtocol(self.handler, self.log)
-        server_coroutine = self.loop.create_unix_server(lambda: serverprotocol, sock=self.sock, backlog=5)
+        server_coroutine = self.loop.create_unix_server(
+            self._protocol,
+            sock=self.sock,
+            backlog=5
+        )
 
         self.log.info('Starting server')
         self.server = self.loop.run_until_complete(server_coroutine)
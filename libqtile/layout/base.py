@@ -41,6 +41,10 @@ class Layout(command.CommandObject, configurable.Configurable):
         " (usually the class' name in lowercase, e.g. 'max')"
     )]
 
+    # Attributes kept across restarts by QtileState; their values must be
+    # JSON serializable.
+    state_attributes = ()
+
     def __init__(self, **config):
         # name is a little odd; we can't resolve it until the class is defined
         # (i.e., we can't figure it out to define it in Layout.defaults), so
@@ -71,6 +75,18 @@ class Layout(command.CommandObject, configurable.Configurable):
         c.group = group
         return c
 
+    def get_state(self):
+        """
+            Returns the layout's state_attributes, to be given back to
+            set_state() after a restart.
+        """
+        return dict((i, getattr(self, i)) for i in self.state_attributes)
+
+    def set_state(self, state):
+        for i in self.state_attributes:
+            if i in state:
+                setattr(self, i, state[i])
+
     def _items(self, name):
         if name == "screen":
             return (True, None)
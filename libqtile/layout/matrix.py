@@ -37,6 +37,7 @@ class Matrix(Layout):
         and places one window in each cell. The number of columns is
         configurable and can also be changed interactively.
     """
+    state_attributes = ("columns",)
     defaults = [
         ("border_focus", "#0000ff", "Border colour for the focused window."),
         ("border_normal", "#000000", "Border colour for un-focused winows."),
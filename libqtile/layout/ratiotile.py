@@ -217,6 +217,7 @@ class RatioTile(Layout):
     """
     Tries to tile all windows in the width/height ratio passed in
     """
+    state_attributes = ("ratio",)
     defaults = [
         ("border_focus", "#0000ff", "Border colour for the focused window."),
         ("border_normal", "#000000", "Border colour for un-focused winows."),
@@ -35,6 +35,7 @@ from .. import utils
 
 
 class Tile(Layout):
+    state_attributes = ("ratio", "master")
     defaults = [
         ("border_focus", "#0000ff", "Border colour for the focused window."),
         ("border_normal", "#000000", "Border colour for un-focused winows."),
@@ -258,6 +258,7 @@ class TreeTab(SingleWindow):
     too.
     """
 
+    state_attributes = ("panel_width",)
     defaults = [
         ("bg_color", "000000", "Background color of tabs"),
         ("active_bg", "000080", "Background color of active tab"),
@@ -378,6 +379,11 @@ class TreeTab(SingleWindow):
         self.draw_panel()
 
     def draw_panel(self):
+        if not self._panel:
+            return
+        self.group.qtile.schedule_draw(self._draw_panel)
+
+    def _draw_panel(self):
         if not self._panel:
             return
         self._drawer.clear(self.bg_color)
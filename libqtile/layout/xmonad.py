@@ -151,6 +151,7 @@ class MonadTall(SingleWindow):
     _med_ratio = .5
     _max_ratio = .75
 
+    state_attributes = ("ratio", "align", "relative_sizes")
     defaults = [
         ("border_focus", "#ff0000", "Border colour for the focused window."),
         ("border_normal", "#000000", "Border colour for un-focused winows."),
@@ -232,6 +233,12 @@ class MonadTall(SingleWindow):
         if self.clients:
             return self.clients[self.focused]
 
+    def set_state(self, state):
+        SingleWindow.set_state(self, state)
+        # The sizes only apply to as many secondary clients as they had
+        if len(self.relative_sizes) == len(self.clients) - 1:
+            self.do_normalize = False
+
     def cmd_normalize(self, redraw=True):
         "Evenly distribute screen-space among secondary clients"
         n = len(self.clients) - 1  # exclude main client, 0
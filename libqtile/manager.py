@@ -29,12 +29,14 @@ except ImportError:
 from libqtile.log_utils import init_log
 from libqtile.dgroups import DGroups
 from xcffib.xproto import EventMask, WindowError, AccessError, DrawableError
+import collections
 import logging
 import os
 import pickle
 import shlex
 import signal
 import sys
+import tempfile
 import traceback
 import xcffib
 import xcffib.xinerama
@@ -74,6 +76,28 @@ else:
         return module
 
 
+_configureFields = (
+    (xcffib.xproto.ConfigWindow.X, "x"),
+    (xcffib.xproto.ConfigWindow.Y, "y"),
+    (xcffib.xproto.ConfigWindow.Width, "width"),
+    (xcffib.xproto.ConfigWindow.Height, "height"),
+    (xcffib.xproto.ConfigWindow.BorderWidth, "border_width"),
+    (xcffib.xproto.ConfigWindow.Sibling, "sibling"),
+    (xcffib.xproto.ConfigWindow.StackMode, "stack_mode"),
+)
+
+
+def _mergeConfigureRequest(earlier, later):
+    """
+        Copy the values set by the ConfigureRequest earlier that the later
+        one leaves alone into later, so that later has the effect of both.
+    """
+    for flag, field in _configureFields:
+        if earlier.value_mask & flag and not later.value_mask & flag:
+            setattr(later, field, getattr(earlier, field))
+            later.value_mask |= flag
+
+
 class Qtile(command.CommandObject):
     """
         This object is the __root__ of the command graph.
@@ -81,7 +105,7 @@ class Qtile(command.CommandObject):
 
     def __init__(self, config,
                  displayName=None, fname=None, no_spawn=False, log=None,
-                 state=None):
+                 state=None, state_file=None):
         logkwargs = {}
         if hasattr(config, "log_level"):
             logkwargs["log_level"] = config.log_level
@@ -112,16 +136,12 @@ class Qtile(command.CommandObject):
         self.fname = fname
         hook.init(self)
 
-        self.windowMap = {}
-        self.widgetMap = {}
-        self.groupMap = {}
-        self.groups = []
-        self.keyMap = {}
+        self._init_bookkeeping()
+        self.selectCache = {}
+        for i in self.selectCacheHooks:
+            hook.subscribe._subscribe(i, self.clear_select_cache)
 
-        # Find the modifier mask for the numlock key, if there is one:
-        nc = self.conn.keysym_to_keycode(xcbq.keysyms["Num_Lock"])
-        self.numlockMask = xcbq.ModMasks[self.conn.get_modifier(nc)]
-        self.validMask = ~(self.numlockMask | xcbq.ModMasks["lock"])
+        self.updateLockMasks()
 
         # Because we only do Xinerama multi-screening,
         # we can assume that the first
@@ -202,8 +222,7 @@ class Qtile(command.CommandObject):
         self._xpoll()
 
         # Map and Grab keys
-        for key in self.config.keys:
-            self.mapKey(key)
+        self.mapKeys(self.config.keys)
 
         # It fixes problems with focus when clicking windows of some specific clients like xterm
         def noop(qtile):
@@ -234,6 +253,18 @@ class Qtile(command.CommandObject):
                 st.apply(self)
             except:
                 log.exception("failed restoring state")
+        if state_file:
+            try:
+                with open(state_file) as f:
+                    st = QtileState.load(f)
+                st.apply(self)
+            except Exception:
+                self.log.exception("failed restoring state")
+            finally:
+                try:
+                    os.unlink(state_file)
+                except OSError:
+                    pass
 
         self.selection = {
             "PRIMARY": {"owner": None, "selection": ""},
@@ -241,6 +272,36 @@ class Qtile(command.CommandObject):
         }
         self.setup_selection()
 
+    def _init_bookkeeping(self):
+        """
+            Set up the maps and schedulers that don't need an X server, for
+            self.config.
+        """
+        self.windowMap = {}
+        self.widgetMap = {}
+        self.groupMap = {}
+        self.groups = []
+        self.keyMap = {}
+        # (keycode, state) -> Key, for every state a KeyPress for the key
+        # can have: its modifiers with or without numlock and capslock.
+        self.keyDispatch = {}
+        # keyMap index -> (keycode grabbed, keycodes in keyDispatch)
+        self.keyCodes = {}
+        # Groups waiting to be laid out, mapped to whether to warp the
+        # pointer; see schedule_layout.
+        self.dirtyGroups = collections.OrderedDict()
+        self._layoutScheduled = False
+        # Paint functions waiting for the next frame; see schedule_draw.
+        self.pendingDraws = collections.OrderedDict()
+        self.frameInterval = 1.0 / getattr(self.config, "frame_rate", 60)
+        self._frameScheduled = False
+        self._lastFrame = None
+        # Counts of the X requests made and skipped by _Window.place
+        self.placeStats = collections.Counter()
+        self.iconCache = window.IconCache()
+        # Set while scan() manages the existing windows
+        self.scanning = False
+
     def setup_selection(self):
         PRIMARY = self.conn.atoms["PRIMARY"]
         CLIPBOARD = self.conn.atoms["CLIPBOARD"]
@@ -406,47 +467,101 @@ class Qtile(command.CommandObject):
             )
             self.screens.append(s)
 
-    def mapKey(self, key):
-        self.keyMap[(key.keysym, key.modmask & self.validMask)] = key
-        code = self.conn.keysym_to_keycode(key.keysym)
-        self.root.grab_key(
-            code,
-            key.modmask,
-            True,
-            xcffib.xproto.GrabMode.Async,
-            xcffib.xproto.GrabMode.Async,
-        )
+    def updateLockMasks(self):
+        # Find the modifier mask for the numlock key, if there is one:
+        nc = self.conn.keysym_to_keycode(xcbq.keysyms["Num_Lock"])
+        self.numlockMask = xcbq.ModMasks[self.conn.get_modifier(nc)]
+        self.validMask = ~(self.numlockMask | xcbq.ModMasks["lock"])
+        # The lock modifiers that may be added to a key's modifiers
+        lock = xcbq.ModMasks["lock"]
+        self.lockVariants = [0, lock]
         if self.numlockMask:
+            self.lockVariants += [self.numlockMask, self.numlockMask | lock]
+
+    def grabModifiers(self, modmask):
+        """
+            The modifiers to grab for a binding on modmask, so that it works
+            with numlock and capslock on too.
+        """
+        if not self.numlockMask:
+            return [modmask]
+        return [
+            modmask,
+            modmask | self.numlockMask,
+            modmask | self.numlockMask | xcbq.ModMasks["lock"],
+        ]
+
+    def mapKey(self, key):
+        code = self._dispatchKey(key)
+        for modifiers in self.grabModifiers(key.modmask):
             self.root.grab_key(
                 code,
-                key.modmask | self.numlockMask,
-                True,
-                xcffib.xproto.GrabMode.Async,
-                xcffib.xproto.GrabMode.Async,
-            )
-            self.root.grab_key(
-                code,
-                key.modmask | self.numlockMask | xcbq.ModMasks["lock"],
+                modifiers,
                 True,
                 xcffib.xproto.GrabMode.Async,
                 xcffib.xproto.GrabMode.Async,
             )
 
+    def mapKeys(self, keys):
+        """
+            Map several keys, grabbing them all at once.
+        """
+        for key in keys:
+            self._dispatchKey(key)
+        self.root.set_key_grabs(self._keyGrabs())
+
     def unmapKey(self, key):
         key_index = (key.keysym, key.modmask & self.validMask)
         if key_index not in self.keyMap:
             return
 
-        code = self.conn.keysym_to_keycode(key.keysym)
-        self.root.ungrab_key(code, key.modmask)
-        if self.numlockMask:
-            self.root.ungrab_key(code, key.modmask | self.numlockMask)
-            self.root.ungrab_key(
-                code,
-                key.modmask | self.numlockMask | xcbq.ModMasks["lock"]
-            )
+        code = self._undispatchKey(key_index)
+        for modifiers in self.grabModifiers(key.modmask):
+            self.root.ungrab_key(code, modifiers)
         del(self.keyMap[key_index])
 
+    def _dispatchKey(self, key):
+        """
+            Add a key to keyMap and keyDispatch, returning the keycode to
+            grab for it.
+        """
+        key_index = (key.keysym, key.modmask & self.validMask)
+        if key_index in self.keyCodes:
+            self._undispatchKey(key_index)
+        self.keyMap[key_index] = key
+        code = self.conn.keysym_to_keycode(key.keysym)
+        codes = self.conn.keysym_to_keycodes(key.keysym)
+        for c in codes:
+            for variant in self.lockVariants:
+                self.keyDispatch[(c, key_index[1] | variant)] = key
+        self.keyCodes[key_index] = (code, codes)
+        return code
+
+    def _keyGrabs(self):
+        """
+            The key grabs the keys in keyMap need, for set_key_grabs().
+        """
+        grabs = {}
+        args = (
+            True, xcffib.xproto.GrabMode.Async, xcffib.xproto.GrabMode.Async
+        )
+        for key_index, key in self.keyMap.items():
+            code = self.keyCodes[key_index][0]
+            for modifiers in self.grabModifiers(key.modmask):
+                grabs[(code, modifiers)] = args
+        return grabs
+
+    def _undispatchKey(self, key_index):
+        """
+            Remove a key's entries from keyDispatch, returning the keycode
+            that was grabbed for it.
+        """
+        code, codes = self.keyCodes.pop(key_index)
+        for c in codes:
+            for variant in self.lockVariants:
+                self.keyDispatch.pop((c, key_index[1] | variant), None)
+        return code
+
     def update_net_desktops(self):
         try:
             index = self.groups.index(self.currentGroup)
@@ -536,25 +651,65 @@ class Qtile(command.CommandObject):
     def currentWindow(self):
         return self.currentScreen.group.currentWindow
 
+    # The properties read while managing a window, which manage() and scan()
+    # request all at once up front; see xcbq.Window.prefetch.
+    manageProperties = (
+        "QTILE_INTERNAL",
+        ("WM_HINTS", xcffib.xproto.GetPropertyType.Any),
+        ("WM_NORMAL_HINTS", xcffib.xproto.GetPropertyType.Any),
+        ("_NET_WM_VISIBLE_NAME", "UTF8_STRING"),
+        ("_NET_WM_NAME", "UTF8_STRING"),
+        (xcffib.xproto.Atom.WM_NAME, xcffib.xproto.GetPropertyType.Any),
+        ("_NET_WM_DESKTOP", "CARDINAL"),
+        ("_NET_WM_WINDOW_TYPE", "ATOM"),
+        ("_NET_WM_STATE", "ATOM"),
+        ("_NET_WM_ICON", "CARDINAL"),
+        ("WM_CLASS", "STRING"),
+        ("WM_WINDOW_ROLE", "STRING"),
+        ("WM_PROTOCOLS", "ATOM"),
+        ("WM_TRANSIENT_FOR", "WINDOW"),
+        "_NET_WM_PID",
+    )
+
     def scan(self):
         _, _, children = self.root.query_tree()
+        for item in children:
+            item.prefetch([("WM_STATE", xcffib.xproto.GetPropertyType.Any)],
+                          attributes=True)
+        manageable = []
         for item in children:
             try:
                 attrs = item.get_attributes()
                 state = item.get_wm_state()
             except (xcffib.xproto.WindowError, xcffib.xproto.AccessError):
+                item.discard_prefetched()
                 continue
 
             if attrs and attrs.map_state == xcffib.xproto.MapState.Unmapped:
                 continue
             if state and state[0] == window.WithdrawnState:
                 continue
-            self.manage(item)
+            manageable.append(item)
+
+        for item in manageable:
+            item.prefetch(self.manageProperties, attributes=True, geometry=True)
+        # The client list is published, and the groups laid out, once
+        # all the windows are managed rather than after each of them
+        self.scanning = True
+        try:
+            for item in manageable:
+                self.manage(item)
+        finally:
+            self.scanning = False
+        self.update_client_list()
+        self.flush_layout()
+        self.conn.flush()
 
     def unmanage(self, win):
         c = self.windowMap.get(win)
         if c:
             hook.fire("client_killed", c)
+            self.iconCache.invalidate(win)
             self.reset_gaps(c)
             if getattr(c, "group", None):
                 c.group.remove(c)
@@ -591,6 +746,15 @@ class Qtile(command.CommandObject):
         self.currentScreen.resize()
 
     def manage(self, w):
+        if w.wid in self.windowMap:
+            return self.windowMap[w.wid]
+        w.prefetch(self.manageProperties, attributes=True, geometry=True)
+        try:
+            return self._manage(w)
+        finally:
+            w.discard_prefetched()
+
+    def _manage(self, w):
         try:
             attrs = w.get_attributes()
             internal = w.get_property("QTILE_INTERNAL")
@@ -638,13 +802,15 @@ class Qtile(command.CommandObject):
         and drag and drop of tabs in chrome
         """
 
+        if self.scanning:
+            return
         windows = [wid for wid, c in self.windowMap.items() if c.group]
         self.root.set_property("_NET_CLIENT_LIST", windows)
         # TODO: check stack order
         self.root.set_property("_NET_CLIENT_LIST_STACKING", windows)
 
     def grabMouse(self):
-        self.root.ungrab_button(None, None)
+        grabs = {}
         for i in self.config.mouse:
             if isinstance(i, Click) and i.focus:
                 # Make a freezing grab on mouse button to gain focus
@@ -655,36 +821,25 @@ class Qtile(command.CommandObject):
             eventmask = EventMask.ButtonPress
             if isinstance(i, Drag):
                 eventmask |= EventMask.ButtonRelease
-            self.root.grab_button(
-                i.button_code,
-                i.modmask,
-                True,
-                eventmask,
-                grabmode,
-                xcffib.xproto.GrabMode.Async,
-            )
-            if self.numlockMask:
-                self.root.grab_button(
-                    i.button_code,
-                    i.modmask | self.numlockMask,
-                    True,
-                    eventmask,
-                    grabmode,
-                    xcffib.xproto.GrabMode.Async,
-                )
-                self.root.grab_button(
-                    i.button_code,
-                    i.modmask | self.numlockMask | xcbq.ModMasks["lock"],
+            for modifiers in self.grabModifiers(i.modmask):
+                grabs[(i.button_code, modifiers)] = (
                     True,
                     eventmask,
                     grabmode,
                     xcffib.xproto.GrabMode.Async,
                 )
+        self.root.set_button_grabs(grabs)
 
     def grabKeys(self):
-        self.root.ungrab_key(None, None)
-        for key in self.keyMap.values():
-            self.mapKey(key)
+        """
+            Grab the keys in keyMap again, for a new keyboard or modifier
+            mapping; only the grabs that change are made or removed.
+        """
+        keys = list(self.keyMap.values())
+        self.keyMap.clear()
+        self.keyDispatch.clear()
+        self.keyCodes.clear()
+        self.mapKeys(keys)
 
     def get_target_chain(self, ename, e):
         """
@@ -718,45 +873,165 @@ class Qtile(command.CommandObject):
         return chain
 
     def _xpoll(self):
+        """
+            Handle all pending X events. The queue is drained before any of
+            them are handled, so that events made redundant by later ones can
+            be dropped (see _coalesceEvents). Groups that the handlers lay out
+            are laid out once, after the whole batch (see schedule_layout).
+            Atom names the previous batch asked for are picked up first.
+        """
+        self.conn.atoms.resolve_pending()
+        while True:
+            events = self._readEvents()
+            if not events:
+                break
+            for e in self._coalesceEvents(events):
+                if not self._handleEvent(e):
+                    return
+        self.conn.flush()
+
+    def _readEvents(self):
+        """
+            Return the list of events waiting in the X connection's queue, or
+            None if the connection is broken.
+        """
+        events = []
         while True:
             try:
                 e = self.conn.conn.poll_for_event()
-                if not e:
-                    break
-
-                ename = e.__class__.__name__
-
-                if ename.endswith("Event"):
-                    ename = ename[:-5]
-                if e.__class__ not in self.ignoreEvents:
-                    self.log.debug(ename)
-                    for h in self.get_target_chain(ename, e):
-                        self.log.info("Handling: %s" % ename)
-                        r = h(e)
-                        if not r:
-                            break
-            # Catch some bad X exceptions. Since X is event based, race
-            # conditions can occur almost anywhere in the code. For
-            # example, if a window is created and then immediately
-            # destroyed (before the event handler is evoked), when the
-            # event handler tries to examine the window properties, it
-            # will throw a WindowError exception. We can essentially
-            # ignore it, since the window is already dead and we've got
-            # another event in the queue notifying us to clean it up.
             except (WindowError, AccessError, DrawableError):
-                pass
+                continue
+            except Exception:
+                if not self._pollException():
+                    return None
+                continue
+            if not e:
+                return events
+            events.append(e)
+
+    def _coalesceEvents(self, events):
+        """
+            Drop the events whose effect is superseded by a later one in the
+            same batch:
+
+                - a PropertyNotify for a window and atom that changes again;
+                - a MotionNotify directly followed by another one on the same
+                  window;
+                - a ConfigureRequest from a managed window that asks again;
+                  the values it sets that the later request doesn't are
+                  merged into the later one.
+
+            Everything else is kept in order.
+        """
+        kept = []
+        latest = {}
+        for e in events:
+            cls = e.__class__
+            if cls is xcffib.xproto.MotionNotifyEvent:
+                if kept and kept[-1] is not None and \
+                        kept[-1].__class__ is cls and kept[-1].event == e.event:
+                    kept[-1] = e
+                    continue
+                key = None
+            elif cls is xcffib.xproto.PropertyNotifyEvent:
+                key = (cls, e.window, e.atom)
+            elif cls is xcffib.xproto.ConfigureRequestEvent and \
+                    e.window in self.windowMap:
+                key = (cls, e.window)
+            else:
+                key = None
 
-            except Exception as e:
-                error_code = self.conn.conn.has_error()
-                if error_code:
-                    error_string = xcbq.XCB_CONN_ERRORS[error_code]
-                    self.log.exception("Shutting down due to X connection error %s (%s)" %
-                        (error_string, error_code))
-                    self.stop()
-                    break
+            if key is not None:
+                index = latest.get(key)
+                if index is not None:
+                    if cls is xcffib.xproto.ConfigureRequestEvent:
+                        _mergeConfigureRequest(kept[index], e)
+                    kept[index] = None
+                latest[key] = len(kept)
+            kept.append(e)
+        return [e for e in kept if e is not None]
 
-                self.log.exception("Got an exception in poll loop")
-        self.conn.flush()
+    def _handleEvent(self, e):
+        """
+            Run the handlers for an event. Returns False if the X connection
+            is broken.
+        """
+        try:
+            ename = e.__class__.__name__
+
+            if ename.endswith("Event"):
+                ename = ename[:-5]
+            if e.__class__ not in self.ignoreEvents:
+                self.log.debug(ename)
+                for h in self.get_target_chain(ename, e):
+                    self.log.info("Handling: %s" % ename)
+                    r = h(e)
+                    if not r:
+                        break
+        # Catch some bad X exceptions. Since X is event based, race
+        # conditions can occur almost anywhere in the code. For
+        # example, if a window is created and then immediately
+        # destroyed (before the event handler is evoked), when the
+        # event handler tries to examine the window properties, it
+        # will throw a WindowError exception. We can essentially
+        # ignore it, since the window is already dead and we've got
+        # another event in the queue notifying us to clean it up.
+        except (WindowError, AccessError, DrawableError):
+            pass
+        except Exception:
+            return self._pollException()
+        return True
+
+    def _pollException(self):
+        """
+            Log the exception being handled. If it was caused by the X
+            connection breaking, shut down and return False.
+        """
+        error_code = self.conn.conn.has_error()
+        if error_code:
+            error_string = xcbq.XCB_CONN_ERRORS[error_code]
+            self.log.exception("Shutting down due to X connection error %s (%s)" %
+                (error_string, error_code))
+            self.stop()
+            return False
+
+        self.log.exception("Got an exception in poll loop")
+        return True
+
+    def schedule_layout(self, group, warp=False):
+        """
+            Mark group as needing to be laid out. All groups marked dirty are
+            laid out in a single pass on the next iteration of the event
+            loop, so a group is laid out once however many times it was asked
+            for in the meantime.
+        """
+        self.dirtyGroups[group] = self.dirtyGroups.get(group, False) or warp
+        if not self._layoutScheduled:
+            self._layoutScheduled = True
+            self.call_soon(self._layoutDirtyGroups)
+
+    def _layoutDirtyGroups(self):
+        self._layoutScheduled = False
+        self.flush_layout()
+
+    def flush_layout(self, group=None):
+        """
+            Lay out the dirty groups right away, or only group if it is
+            given and dirty.
+        """
+        if group is not None:
+            if group in self.dirtyGroups:
+                group._layoutAll(self.dirtyGroups.pop(group))
+            return
+        # Groups dirtied while laying out are left for the next pass
+        dirty, self.dirtyGroups = self.dirtyGroups, collections.OrderedDict()
+        for group, warp in dirty.items():
+            try:
+                group._layoutAll(warp)
+            except (WindowError, AccessError, DrawableError):
+                pass
+            except Exception:
+                self.log.exception("Exception laying out group %s" % group.name)
 
     def stop(self):
         self.log.info('Stopping eventloop')
@@ -860,7 +1135,7 @@ class Qtile(command.CommandObject):
                                              xcffib.CurrentTime)
 
     def handle_PropertyNotify(self, e):
-        name = self.conn.atoms.get_name(e.atom)
+        name = self.conn.atoms.get_name(e.atom, wait=False)
         # it's the selection property
         if name in ("PRIMARY", "CLIPBOARD"):
             assert e.window == self.selection_window.wid
@@ -895,12 +1170,9 @@ class Qtile(command.CommandObject):
                 self.log.info("Invalid Desktop Index: %s" % index)
 
     def handle_KeyPress(self, e):
-        keysym = self.conn.code_to_syms[e.detail][0]
-        state = e.state
-        if self.numlockMask:
-            state = e.state | self.numlockMask
-        k = self.keyMap.get((keysym, state & self.validMask))
+        k = self.keyDispatch.get((e.detail, e.state))
         if not k:
+            keysym = self.conn.code_to_syms[e.detail][0]
             self.log.info("Ignoring unknown keysym: %s" % keysym)
             return
         for i in k.commands:
@@ -1048,8 +1320,16 @@ class Qtile(command.CommandObject):
         w.configure(**args)
 
     def handle_MappingNotify(self, e):
-        self.conn.refresh_keymap()
         if e.request == xcffib.xproto.Mapping.Keyboard:
+            # Only the keys whose keycodes moved are grabbed again
+            changed = self.conn.refresh_keymap(e.first_keycode, e.count)
+            for key in list(self.keyMap.values()):
+                if key.keysym in changed:
+                    self._dispatchKey(key)
+            self.root.set_key_grabs(self._keyGrabs())
+        elif e.request == xcffib.xproto.Mapping.Modifier:
+            self.conn.refresh_modmap()
+            self.updateLockMasks()
             self.grabKeys()
 
     def handle_MapRequest(self, e):
@@ -1057,6 +1337,9 @@ class Qtile(command.CommandObject):
         c = self.manage(w)
         if c and (not c.group or not c.group.screen):
             return
+        if c:
+            # Put the window in place before it is shown
+            self.flush_layout(c.group)
         w.map()
 
     def handle_DestroyNotify(self, e):
@@ -1140,14 +1423,85 @@ class Qtile(command.CommandObject):
             else:
                 return utils.lget(self.screens, sel)
 
+    # Objects selected by these names can be cached by select(), since a
+    # selector for them always means the same object, unlike, for instance,
+    # layout[0], which is the first layout of whichever group has focus.
+    selectCacheRoots = ("group", "window", "screen", "widget")
+
+    # The hooks fired when windows or groups come and go, or windows move to
+    # another group or screen, which may change what a cached selector path
+    # resolves to.
+    selectCacheHooks = (
+        "client_managed", "client_killed", "addgroup", "delgroup",
+        "group_window_add", "setgroup", "screen_change",
+    )
+
+    def select(self, selectors):
+        """
+            Resolve selectors as CommandObject.select does, caching the result
+            for paths that give every step's selector explicitly and start
+            from an object that doesn't depend on focus, like
+            group["a"].layout[1] or window[wid].
+        """
+        if not selectors or selectors[0][0] not in self.selectCacheRoots:
+            return command.CommandObject.select(self, selectors)
+        key = tuple((name, sel) for name, sel in selectors)
+        if any(sel is None for name, sel in key):
+            return command.CommandObject.select(self, selectors)
+        try:
+            obj = self.selectCache.get(key)
+        except TypeError:
+            # An unhashable selector; it won't select anything anyway
+            return command.CommandObject.select(self, selectors)
+        if obj is None:
+            obj = command.CommandObject.select(self, selectors)
+            self.selectCache[key] = obj
+        return obj
+
+    def clear_select_cache(self, *args):
+        self.selectCache.clear()
+
     def listWID(self):
         return [i.window.wid for i in self.windowMap.values()]
 
+    def schedule_draw(self, func, now=False):
+        """
+            Call func, which paints a bar or an internal window, in the next
+            frame. Frames are at least 1 / config.frame_rate seconds apart,
+            and func is called once per frame however many times it was
+            scheduled. With now, func is called right away instead, for
+            paints the user is waiting for, such as typing in the prompt.
+        """
+        if now:
+            self.pendingDraws.pop(func, None)
+            func()
+            return
+        self.pendingDraws[func] = None
+        if not self._frameScheduled:
+            self._frameScheduled = True
+            delay = 0
+            if self._lastFrame is not None:
+                delay = max(
+                    self._lastFrame + self.frameInterval -
+                    self._eventloop.time(),
+                    0
+                )
+            self.call_later(delay, self._drawFrame)
+
+    def _drawFrame(self):
+        self._frameScheduled = False
+        self._lastFrame = self._eventloop.time()
+        # Paints scheduled while drawing are left for the next frame
+        pending, self.pendingDraws = \
+            self.pendingDraws, collections.OrderedDict()
+        for func in pending:
+            try:
+                func()
+            except Exception:
+                self.log.exception("Exception while drawing:")
+
     def clientFromWID(self, wid):
-        for i in self.windowMap.values():
-            if i.window.wid == wid:
-                return i
-        return None
+        return self.windowMap.get(wid)
 
     def call_soon(self, func, *args):
         """ A wrapper for the event loop's call_soon which also flushes the X
@@ -1216,6 +1570,21 @@ class Qtile(command.CommandObject):
         """
         return dict((i.name, i.info()) for i in self.groups)
 
+    def cmd_flush_layout(self):
+        """
+            Lay out any groups that are waiting to be laid out right away,
+            rather than on the next iteration of the event loop.
+        """
+        self.flush_layout()
+
+    def cmd_place_stats(self):
+        """
+            Return how many configure, synthetic ConfigureNotify and border
+            colour requests placing windows has sent to X, and how many it
+            skipped because they wouldn't have changed anything.
+        """
+        return dict(self.placeStats)
+
     def cmd_get_info(self):
         x = {}
         for i in self.groups:
@@ -1303,7 +1672,7 @@ class Qtile(command.CommandObject):
         keysym = xcbq.keysyms.get(key)
         if keysym is None:
             raise command.CommandError("Unknown key: %s" % key)
-        keycode = self.conn.first_sym_to_code[keysym]
+        keycode = self.conn.keysym_to_keycode(keysym)
 
         class DummyEv(object):
             pass
@@ -1331,13 +1700,26 @@ class Qtile(command.CommandObject):
         if '--no-spawn' not in argv:
             argv.append('--no-spawn')
 
-        buf = six.BytesIO()
+        argv = [
+            s for s in argv
+            if not s.startswith(('--with-state', '--state-file'))
+        ]
+        path = None
         try:
-            pickle.dump(QtileState(self), buf, protocol=0)
-        except:
-            self.log.error("Unable to pickle qtile state")
-        argv = [s for s in argv if not s.startswith('--with-state')]
-        argv.append('--with-state=' + buf.getvalue().decode())
+            fd, path = tempfile.mkstemp(
+                prefix="qtile-state-", dir=get_cache_dir()
+            )
+            with os.fdopen(fd, "w") as f:
+                QtileState(self).dump(f)
+        except Exception:
+            self.log.exception("Unable to save qtile state")
+            if path is not None:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        else:
+            argv.append('--state-file=' + path)
 
         self.cmd_execute(sys.executable, argv)
 
@@ -1454,6 +1836,7 @@ class Qtile(command.CommandObject):
             (self.screens.index(self.currentScreen) - 1) % len(self.screens)
         )
 
+    @command.chunked
     def cmd_windows(self):
         """
             Return info for each client window.
@@ -1463,6 +1846,7 @@ class Qtile(command.CommandObject):
             if not isinstance(i, window.Internal)
         ]
 
+    @command.chunked
     def cmd_internal_windows(self):
         """
             Return info for each internal window (bars, for example).
@@ -19,38 +19,128 @@
 # SOFTWARE.
 
 
+import json
+
+
 class QtileState(object):
     """
         Represents the state of the qtile object. Primarily used for restoring
         state across restarts; any additional state which doesn't fit nicely
         into X atoms can go here.
+
+        Restarts save it with dump() and read it back with load(); it can
+        still be pickled, as cmd_get_state does.
     """
+    # Version of the format written by dump()
+    version = 2
+
     def __init__(self, qtile):
         # Note: window state is saved and restored via _NET_WM_STATE, so
         # the only thing we need to restore here is the layout and screen
-        # configurations.
+        # configurations, where the windows are and which had focus.
         self.groups = {}
         self.screens = {}
         self.current_screen = 0
+        # group name -> [[layout name, layout state], ...] in group.layouts
+        # order; a group may use the same layout class more than once
+        self.layouts = {}
+        # wid -> group name
+        self.windows = {}
+        # group name -> wids, as in focusHistory
+        self.focus = {}
 
         for group in qtile.groups:
             self.groups[group.name] = group.layout.name
+            self.layouts[group.name] = [
+                [layout.name, layout.get_state()] for layout in group.layouts
+            ]
+            self.focus[group.name] = [
+                c.window.wid for c in group.focusHistory
+            ]
+            for c in group.windows:
+                self.windows[c.window.wid] = group.name
         for index, screen in enumerate(qtile.screens):
             self.screens[index] = screen.group.name
             if screen == qtile.currentScreen:
                 self.current_screen = index
 
+    def dump(self, f):
+        """
+            Write the state to the text file f.
+        """
+        json.dump(
+            dict(
+                version=self.version,
+                groups=self.groups,
+                screens=sorted(self.screens.items()),
+                current_screen=self.current_screen,
+                layouts=self.layouts,
+                windows=sorted(self.windows.items()),
+                focus=self.focus,
+            ),
+            f,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def load(cls, f):
+        """
+            Read a state written by dump() from the text file f.
+        """
+        data = json.load(f)
+        if data.get("version") != cls.version:
+            raise ValueError("Unknown state version: %r" % data.get("version"))
+        self = cls.__new__(cls)
+        self.groups = data["groups"]
+        self.screens = dict(data["screens"])
+        self.current_screen = data["current_screen"]
+        self.layouts = data["layouts"]
+        self.windows = dict(data["windows"])
+        self.focus = data["focus"]
+        return self
+
     def apply(self, qtile):
         """
             Rearrange the windows in the specified Qtile object according to
             this QtileState.
         """
+        # States pickled by older versions lack these
+        layouts = getattr(self, "layouts", {})
+        windows = getattr(self, "windows", {})
+        focus = getattr(self, "focus", {})
+
+        for (group, states) in layouts.items():
+            if group in qtile.groupMap:
+                for layout, (name, state) in zip(
+                        qtile.groupMap[group].layouts, states):
+                    # Skip layouts which changed in the config since
+                    if layout.name == name:
+                        layout.set_state(state)
+
+        for (wid, group) in windows.items():
+            c = qtile.windowMap.get(wid)
+            if c is not None and getattr(c, "group", None) and \
+                    c.group.name != group and group in qtile.groupMap:
+                c.togroup(group)
+
         for (group, layout) in self.groups.items():
             try:
                 qtile.groupMap[group].layout = layout
             except KeyError:
                 pass  # group missing
 
+        for (group, wids) in focus.items():
+            group = qtile.groupMap.get(group)
+            if group is None:
+                continue
+            history = [qtile.windowMap.get(wid) for wid in wids]
+            history = [c for c in history if c in group.windows]
+            if history:
+                group.focusHistory = [
+                    c for c in group.focusHistory if c not in history
+                ] + history
+                group.focus(history[-1], False)
+
         for (screen, group) in self.screens.items():
             try:
                 group = qtile.groupMap[group]
@@ -170,11 +170,12 @@ class _Widget(command.CommandObject, configurable.Configurable):
     def _configure(self, qtile, bar):
         self.qtile = qtile
         self.bar = bar
+        # The bar resizes the drawer once the widget's length is known
         self.drawer = drawer.Drawer(
             qtile,
             self.win.wid,
-            self.bar.width,
-            self.bar.height
+            self.bar.size,
+            self.bar.size
         )
         if not self.configured:
             self.configured = True
@@ -187,8 +188,7 @@ class _Widget(command.CommandObject, configurable.Configurable):
 
     def clear(self):
         self.drawer.set_source_rgb(self.bar.background)
-        self.drawer.fillrect(self.offsetx, self.offsety, self.width,
-                             self.height)
+        self.drawer.fillrect(0, 0, self.width, self.height)
 
     def info(self):
         return dict(
@@ -232,7 +232,7 @@ class _Widget(command.CommandObject, configurable.Configurable):
         """
             Method that draws the widget. You may call this explicitly to
             redraw the widget, but only if the length of the widget hasn't
-            changed. If it has, you must call bar.draw instead.
+            changed. If it has, you must call self.bar.draw(self) instead.
         """
         raise NotImplementedError
 
@@ -391,7 +391,7 @@ class _TextBox(_Widget):
             self.fontsize = fontsize
         if fontshadow is not UNSPECIFIED:
             self.fontshadow = fontshadow
-        self.bar.draw()
+        self.bar.draw(self)
 
     def info(self):
         d = _Widget.info(self)
@@ -447,15 +447,11 @@ class InLoopPollText(_TextBox):
         self.update(text)
 
     def update(self, text):
-        old_width = self.layout.width
         if self.text != text:
             self.text = text
-            # If our width hasn't changed, we just draw ourselves. Otherwise,
-            # we draw the whole bar.
-            if self.layout.width == old_width:
-                self.draw()
-            else:
-                self.bar.draw()
+            # The bar repaints us in its next frame, and the widgets after us
+            # too if our width changed.
+            self.bar.draw(self)
 
 
 class ThreadedPollText(InLoopPollText):
@@ -521,16 +517,11 @@ class ThreadPoolText(_TextBox):
         future.add_done_callback(on_done)
 
     def update(self, text):
-        old_width = self.layout.width
         if self.text == text:
             return
 
         self.text = text
-
-        if self.layout.width == old_width:
-            self.draw()
-        else:
-            self.bar.draw()
+        self.bar.draw(self)
 
     def poll(self):
         pass
@@ -234,7 +234,7 @@ class Battery(_Battery):
         ntext = self._get_text()
         if ntext != self.text:
             self.text = ntext
-            self.bar.draw()
+            self.bar.draw(self)
 
 
 class BatteryIcon(_Battery):
@@ -303,7 +303,7 @@ class BatteryIcon(_Battery):
         icon = self._get_icon_key()
         if icon != self.current_icon:
             self.current_icon = icon
-            self.draw()
+            self.bar.draw(self)
 
     def draw(self):
         if self.theme_path:
@@ -58,7 +58,7 @@ class Clipboard(base._TextBox):
 
     def clear(self, *args):
         self.text = ""
-        self.bar.draw()
+        self.bar.draw(self)
 
     def is_blacklisted(self, owner_id):
         if not self.blacklist:
@@ -97,7 +97,7 @@ class Clipboard(base._TextBox):
 
             if self.timeout:
                 self.timeout_id = self.timeout_add(self.timeout, self.clear)
-            self.bar.draw()
+            self.bar.draw(self)
 
         def hook_notify(name, selection):
             if name != self.selection:
@@ -100,17 +100,12 @@ class Cmus(base.ThreadPoolText):
 
     def update(self, text):
         """Update the text box."""
-        old_width = self.layout.width
         if not self.status:
             return
         if len(text) > self.max_chars > 0:
             text = text[:self.max_chars] + "…"
         self.text = text
-
-        if self.layout.width == old_width:
-            self.draw()
-        else:
-            self.bar.draw()
+        self.bar.draw(self)
 
     def poll(self):
         """Poll content for the text box."""
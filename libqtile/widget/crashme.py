@@ -59,4 +59,4 @@ class _CrashMe(base._TextBox):
             1 / 0
         elif button == 3:
             self.text = '<span>\xC3GError'
-            self.bar.draw()
+            self.bar.draw(self)
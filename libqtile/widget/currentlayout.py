@@ -50,7 +50,7 @@ class CurrentLayout(base._TextBox):
         def hook_response(layout, group):
             if group.screen is not None and group.screen == self.bar.screen:
                 self.text = layout.name
-                self.bar.draw()
+                self.bar.draw(self)
         hook.subscribe.layout_change(hook_response)
 
     def button_press(self, x, y, button):
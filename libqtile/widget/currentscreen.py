@@ -50,7 +50,7 @@ class CurrentScreen(base._TextBox):
     def setup_hooks(self):
         def hook_response():
             self.update_text()
-            self.bar.draw()
+            self.bar.draw(self)
 
         hook.subscribe.current_screen_change(hook_response)
 
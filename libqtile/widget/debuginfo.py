@@ -41,8 +41,6 @@ class DebugInfo(base._TextBox):
         hook.subscribe.float_change(self.update)
 
     def update(self, *args):
-        old_layout_width = self.layout.width
-
         w = self.bar.screen.group.currentWindow
 
         if isinstance(w.group.layout, layout.Stack):
@@ -66,7 +64,4 @@ class DebugInfo(base._TextBox):
                                                                   sectionIdx,
                                                                   nodeIdx)
 
-        if self.layout.width != old_layout_width:
-            self.bar.draw()
-        else:
-            self.draw()
+        self.bar.draw(self)
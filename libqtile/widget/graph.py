@@ -31,6 +31,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import array
+import collections
 import cairocffi
 
 from . import base
@@ -48,6 +50,62 @@ __all__ = [
 ]
 
 
+class _Samples(object):
+    """
+        The last size samples pushed, newest first, in a ring buffer. Their
+        maximum is kept up to date as samples come and go.
+    """
+    def __init__(self, size, value=0):
+        self.size = size
+        self.fill(value)
+
+    def fill(self, value):
+        self._ring = array.array('d', [value] * self.size)
+        # index of the newest sample in _ring
+        self._head = 0
+        self._pushed = self.size
+        # (number, value) of the samples which can still become the
+        # maximum: the newest one and every older one larger than all
+        # those after it, oldest first
+        self._maxima = collections.deque([(self._pushed, value)])
+
+    def push(self, value):
+        self._head = (self._head - 1) % self.size
+        self._ring[self._head] = value
+        self._pushed += 1
+        maxima = self._maxima
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        maxima.append((self._pushed, value))
+        if maxima[0][0] <= self._pushed - self.size:
+            maxima.popleft()
+
+    def max(self):
+        return self._maxima[0][1]
+
+    def oldest(self, start, stop):
+        """
+            The samples from start to stop, counting from the oldest one.
+        """
+        last = self._head + self.size - 1
+        return [self._ring[(last - i) % self.size] for i in range(start, stop)]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not -self.size <= index < self.size:
+            raise IndexError(index)
+        return self._ring[(self._head + index) % self.size]
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def __reversed__(self):
+        return iter(self.oldest(0, self.size))
+
+
 class _Graph(base._Widget):
     fixed_upper_bound = False
     defaults = [
@@ -67,8 +125,15 @@ class _Graph(base._Widget):
     def __init__(self, width=100, **config):
         base._Widget.__init__(self, width, **config)
         self.add_defaults(_Graph.defaults)
-        self.values = [0] * self.samples
+        self.values = _Samples(self.samples)
         self.maxvalue = 0
+        # What the pixmap holds a drawing of, see scroll()
+        self._drawn = None
+        # How far right of their nominal place the samples are drawn, in
+        # [0, 1) pixels, so that scrolling always moves whole pixels
+        self._phase = 0
+        # Samples pushed since the graph was last painted
+        self._pushed = 0
         self.oldtime = time.time()
         self.lag_cycles = 0
 
@@ -83,8 +148,19 @@ class _Graph(base._Widget):
     def graphheight(self):
         return self.bar.height - self.margin_y * 2 - self.border_width * 2
 
+    @property
+    def step(self):
+        """
+            The distance between two samples.
+        """
+        if self.type == "box":
+            return self.graphwidth / float(self.samples)
+        elif self.type == "line":
+            return self.graphwidth / float(self.samples - 1)
+        return self.graphwidth / float(self.samples - 2)
+
     def draw_box(self, x, y, values):
-        step = self.graphwidth / float(self.samples)
+        step = self.step
         self.drawer.set_source_rgb(self.graph_color)
         for val in values:
             val = self.val(val)
@@ -92,7 +168,7 @@ class _Graph(base._Widget):
             x += step
 
     def draw_line(self, x, y, values):
-        step = self.graphwidth / float(self.samples - 1)
+        step = self.step
         self.drawer.ctx.set_line_join(cairocffi.LINE_JOIN_ROUND)
         self.drawer.set_source_rgb(self.graph_color)
         self.drawer.ctx.set_line_width(self.line_width)
@@ -102,7 +178,7 @@ class _Graph(base._Widget):
         self.drawer.ctx.stroke()
 
     def draw_linefill(self, x, y, values):
-        step = self.graphwidth / float(self.samples - 2)
+        step = self.step
         self.drawer.ctx.set_line_join(cairocffi.LINE_JOIN_ROUND)
         self.drawer.set_source_rgb(self.graph_color)
         self.drawer.ctx.set_line_width(self.line_width)
@@ -126,6 +202,16 @@ class _Graph(base._Widget):
             raise ValueError("Unknown starting position: %s." % self.start_pos)
 
     def draw(self):
+        self._pushed = 0
+        self._draw_background()
+        self._draw_samples(0, self.samples)
+        self.drawer.draw(offsetx=self.offset, width=self.width)
+        self._drawn = self._drawing()
+
+    def _drawing(self):
+        return (self.maxvalue, self.width, self.bar.height)
+
+    def _draw_background(self):
         self.drawer.clear(self.background or self.bar.background)
         if self.border_width:
             self.drawer.set_source_rgb(self.border_color)
@@ -137,14 +223,23 @@ class _Graph(base._Widget):
                 self.bar.height - self.margin_y * 2 - self.border_width,
             )
             self.drawer.ctx.stroke()
-        x = self.margin_x + self.border_width
+
+    def _draw_samples(self, start, stop):
+        """
+            Draw the samples from start to stop, counting from the oldest.
+        """
+        x = self.margin_x + self.border_width + self._phase + \
+            start * self.step
         y = self.margin_y + self.border_width
         if self.start_pos == 'bottom':
             y += self.graphheight
         elif not self.start_pos == 'top':
             raise ValueError("Unknown starting position: %s." % self.start_pos)
         k = 1.0 / (self.maxvalue or 1)
-        scaled = [self.graphheight * val * k for val in reversed(self.values)]
+        scaled = [
+            self.graphheight * val * k
+            for val in self.values.oldest(start, stop)
+        ]
 
         if self.type == "box":
             self.draw_box(x, y, scaled)
@@ -155,7 +250,55 @@ class _Graph(base._Widget):
         else:
             raise ValueError("Unknown graph type: %s." % self.type)
 
+    def _redraw(self, start, end):
+        """
+            Draw the part of the widget from x = start to end again.
+        """
+        ctx = self.drawer.ctx
+        ctx.save()
+        ctx.rectangle(start, 0, end - start, self.bar.height)
+        ctx.clip()
+        self._draw_background()
+        # The samples whose lines can reach into the area
+        step = self.step
+        x = self.margin_x + self.border_width + self._phase
+        reach = step + self.line_width
+        self._draw_samples(
+            max(int((start - x - reach) // step), 0),
+            min(int((end - x + reach) // step) + 2, self.samples)
+        )
+        ctx.restore()
+
+    def scroll(self, count):
+        """
+            Move the graph last drawn left by count samples and draw only
+            the newest ones and the edges, instead of the whole graph. The
+            samples are moved by whole pixels and the fraction left over is
+            carried in _phase, so this gives the same picture as draw()
+            whatever the step. It returns False, drawing nothing, when the
+            scale has changed or nothing of the old graph would be left.
+        """
+        if self.offsetx is None or self._drawn != self._drawing():
+            return False
+        moved = self._phase + self.step * count
+        shift = int(moved)
+        if shift >= self.graphwidth:
+            return False
+        self._phase = moved - shift
+        x = self.margin_x + self.border_width
+        width = self.graphwidth - shift
+        if shift:
+            self.drawer.scroll(x + shift, 0, width, self.bar.height, -shift, 0)
+        reach = int(self.step + self.line_width) + 2
+        self._redraw(0, x + reach)
+        self._redraw(x + width - reach, self.width)
         self.drawer.draw(offsetx=self.offset, width=self.width)
+        return True
+
+    def _paint(self):
+        count, self._pushed = self._pushed, 0
+        if count and not self.scroll(count):
+            self.draw()
 
     def push(self, value):
         if self.lag_cycles > self.samples:
@@ -163,12 +306,14 @@ class _Graph(base._Widget):
             # the graph samples limit
             self.lag_cycles = 1
 
-        self.values = ([value] * min(self.samples, self.lag_cycles)) + self.values
-        self.values = self.values[:self.samples]
+        count = min(self.samples, self.lag_cycles)
+        for i in range(count):
+            self.values.push(value)
 
         if not self.fixed_upper_bound:
-            self.maxvalue = max(self.values)
-        self.draw()
+            self.maxvalue = self.values.max()
+        self._pushed += count
+        self.qtile.schedule_draw(self._paint)
 
     def update(self):
         # lag detection
@@ -180,7 +325,8 @@ class _Graph(base._Widget):
         self.timeout_add(self.frequency, self.update)
 
     def fullfill(self, value):
-        self.values = [value] * len(self.values)
+        self.values.fill(value)
+        self._drawn = None
 
 
 class CPUGraph(_Graph):
@@ -189,7 +189,7 @@ class LaunchBar(base._Widget):
                     exec(cmd[4:].lstrip())
                 else:
                     self.qtile.cmd_spawn(cmd)
-            self.draw()
+            self.bar.draw(self)
 
     def draw(self):
         """ Draw the icons in the widget. """
@@ -122,12 +122,12 @@ class Mpris2(base._TextBox):
             return
         if self.text != self.displaytext:
             self.text = self.displaytext
-            self.bar.draw()
+            self.bar.draw(self)
 
     def scroll_text(self):
         if self.text != self.scrolltext[:self.scroll_chars]:
             self.text = self.scrolltext[:self.scroll_chars]
-            self.bar.draw()
+            self.bar.draw(self)
         if self.scroll_counter:
             self.scroll_counter -= 1
             if self.scroll_counter:
@@ -140,7 +140,7 @@ class Mpris2(base._TextBox):
             self.timeout_add(self.scroll_interval, self.scroll_text)
             return
         self.text = ''
-        self.bar.draw()
+        self.bar.draw(self)
 
     def cmd_info(self):
         '''What's the current state of the widget?'''
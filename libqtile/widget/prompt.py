@@ -482,7 +482,7 @@ class Prompt(base._TextBox):
             self.text = self.display + self.text
         else:
             self.text = ""
-        self.bar.draw()
+        self.bar.draw(self, now=True)
 
     def _trigger_complete(self):
         # Trigger the autocompletion in user input
@@ -72,11 +72,11 @@ class Icon(window._Window):
         return False
 
     def handle_PropertyNotify(self, e):
-        name = self.qtile.conn.atoms.get_name(e.atom)
+        name = self.qtile.conn.atoms.get_name(e.atom, wait=False)
         if name == "_XEMBED_INFO":
             info = self.window.get_property('_XEMBED_INFO', unpack=int)
             if info and info[1]:
-                self.systray.bar.draw()
+                self.systray.bar.draw(self.systray)
 
         return False
 
@@ -84,7 +84,7 @@ class Icon(window._Window):
         wid = event.window
         del(self.qtile.windowMap[wid])
         del(self.systray.icons[wid])
-        self.systray.bar.draw()
+        self.systray.bar.draw(self.systray)
         return False
 
     handle_UnmapNotify = handle_DestroyNotify
@@ -173,11 +173,11 @@ class Systray(window._Window, base._Widget):
             info = icon.window.get_property('_XEMBED_INFO', unpack=int)
 
             if not info:
-                self.bar.draw()
+                self.bar.draw(self)
                 return False
 
             if info[1]:
-                self.bar.draw()
+                self.bar.draw(self)
 
         return False
 
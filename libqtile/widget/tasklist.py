@@ -25,7 +25,6 @@
 
 from __future__ import division
 
-import cairocffi
 from .. import bar, hook
 from . import base
 
@@ -70,7 +69,6 @@ class TaskList(base._Widget, base.PaddingMixin, base.MarginMixin):
         self.add_defaults(TaskList.defaults)
         self.add_defaults(base.PaddingMixin.defaults)
         self.add_defaults(base.MarginMixin.defaults)
-        self._icons_cache = {}
 
     def box_width(self, text):
         width, _ = self.drawer.max_layout_size(
@@ -105,16 +103,7 @@ class TaskList(base._Widget, base.PaddingMixin, base.MarginMixin):
     def update(self, window=None):
         group = self.bar.screen.group
         if not window or window and window.group is group:
-            self.bar.draw()
-
-    def remove_icon_cache(self, window):
-        wid = window.window.wid
-        if wid in self._icons_cache:
-            self._icons_cache.pop(wid)
-
-    def invalidate_cache(self, window):
-        self.remove_icon_cache(window)
-        self.update(window)
+            self.bar.draw(self)
 
     def setup_hooks(self):
         hook.subscribe.window_name_change(self.update)
@@ -122,8 +111,7 @@ class TaskList(base._Widget, base.PaddingMixin, base.MarginMixin):
         hook.subscribe.float_change(self.update)
         hook.subscribe.client_urgent_hint_changed(self.update)
 
-        hook.subscribe.net_wm_icon_change(self.invalidate_cache)
-        hook.subscribe.client_killed(self.remove_icon_cache)
+        hook.subscribe.net_wm_icon_change(self.update)
 
     def drawtext(self, text, textcolor, width):
         self.layout.text = text
@@ -179,39 +167,7 @@ class TaskList(base._Widget, base.PaddingMixin, base.MarginMixin):
                 window.cmd_bring_to_front()
 
     def get_window_icon(self, window):
-        if not window.icons:
-            return None
-
-        cache = self._icons_cache.get(window.window.wid)
-        if cache:
-            return cache
-
-        icons = sorted(
-            iter(window.icons.items()),
-            key=lambda x: abs(self.icon_size - int(x[0].split("x")[0]))
-        )
-        icon = icons[0]
-        width, height = map(int, icon[0].split("x"))
-
-        img = cairocffi.ImageSurface.create_for_data(
-            icon[1],
-            cairocffi.FORMAT_ARGB32,
-            width,
-            height
-        )
-
-        surface = cairocffi.SurfacePattern(img)
-
-        scaler = cairocffi.Matrix()
-
-        if height != self.icon_size:
-            sp = height / self.icon_size
-            height = self.icon_size
-            width = width / sp
-            scaler.scale(sp, sp)
-        surface.set_matrix(scaler)
-        self._icons_cache[window.window.wid] = surface
-        return surface
+        return self.qtile.iconCache.get(window, self.icon_size)
 
     def draw_icon(self, surface, offset):
         if not surface:
@@ -222,7 +178,7 @@ class TaskList(base._Widget, base.PaddingMixin, base.MarginMixin):
 
         self.drawer.ctx.save()
         self.drawer.ctx.translate(x, y)
-        self.drawer.ctx.set_source(surface)
+        self.drawer.ctx.set_source_surface(surface)
         self.drawer.ctx.paint()
         self.drawer.ctx.restore()
 
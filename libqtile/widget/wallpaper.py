@@ -79,4 +79,4 @@ class Wallpaper(base._TextBox):
             self.index += 1
             self.index %= len(self.images)
             self.set_wallpaper()
-            self.draw()
+            self.bar.draw(self)
@@ -51,7 +51,7 @@ class WindowName(base._TextBox):
         def on_client_killed(window):
             if window == self.bar.screen.group.currentWindow:
                 self.text = ""
-                self.bar.draw()
+                self.bar.draw(self)
 
     def update(self):
         w = self.bar.screen.group.currentWindow
@@ -64,4 +64,4 @@ class WindowName(base._TextBox):
             elif w.floating:
                 state = 'V '
         self.text = "%s%s" % (state, w.name if w and w.name else " ")
-        self.bar.draw()
+        self.bar.draw(self)
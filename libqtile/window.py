@@ -21,9 +21,13 @@
 from __future__ import division
 
 import array
+import collections
 import contextlib
 import inspect
+import struct
+import sys
 import traceback
+import cairocffi
 from xcffib.xproto import EventMask, StackMode, SetMode
 import xcffib.xproto
 
@@ -108,12 +112,127 @@ _NET_WM_STATE_ADD = 1
 _NET_WM_STATE_TOGGLE = 2
 
 
+def _icon_surface(pixels, width, height):
+    """
+        Make an ARGB32 ImageSurface of the _NET_WM_ICON pixels, whose alpha
+        isn't premultiplied. Instead of multiplying every pixel here, the
+        colours are painted through a mask made of the alpha channel, and
+        cairo does the arithmetic.
+    """
+    if sys.byteorder == "little":
+        alpha = pixels[3::4]
+    else:
+        alpha = pixels[0::4]
+    if alpha.count(b"\xff") == len(alpha):
+        # Opaque, so there is nothing to multiply
+        return cairocffi.ImageSurface.create_for_data(
+            pixels, cairocffi.FORMAT_ARGB32, width, height, width * 4
+        )
+
+    colours = cairocffi.ImageSurface.create_for_data(
+        pixels, cairocffi.FORMAT_RGB24, width, height, width * 4
+    )
+    stride = cairocffi.ImageSurface.format_stride_for_width(
+        cairocffi.FORMAT_A8, width
+    )
+    if stride != width:
+        padding = bytearray(stride - width)
+        alpha = bytearray().join(
+            alpha[row:row + width] + padding
+            for row in range(0, len(alpha), width)
+        )
+    mask = cairocffi.ImageSurface.create_for_data(
+        alpha, cairocffi.FORMAT_A8, width, height, stride
+    )
+    surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, width, height)
+    ctx = cairocffi.Context(surface)
+    ctx.set_source_surface(colours)
+    ctx.mask_surface(mask)
+    surface.flush()
+    return surface
+
+
+class IconCache(object):
+    """
+        Window icons scaled to a height, as ImageSurfaces, shared by
+        everything that draws them. Entries are dropped when the window's
+        icon changes or it goes away, and the least recently used ones when
+        they take up more than max_bytes.
+    """
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # (wid, height) -> surface, least recently used first
+        self.surfaces = collections.OrderedDict()
+        # wid -> heights cached
+        self.heights = {}
+
+    def get(self, win, height):
+        """
+            Return the icon of the client win scaled to height, or None if
+            it has no icon.
+        """
+        key = (win.window.wid, height)
+        surface = self.surfaces.pop(key, None)
+        if surface is None:
+            surface = self._scale(win.get_icon(height), height)
+            if surface is None:
+                return None
+            self.size += self._bytes(surface)
+            self.heights.setdefault(key[0], set()).add(height)
+        self.surfaces[key] = surface
+        while self.size > self.max_bytes and len(self.surfaces) > 1:
+            self._drop(next(iter(self.surfaces)))
+        return surface
+
+    def invalidate(self, wid):
+        """
+            Drop the icons of the window wid.
+        """
+        for height in list(self.heights.get(wid, ())):
+            self._drop((wid, height))
+
+    def _drop(self, key):
+        surface = self.surfaces.pop(key)
+        self.size -= self._bytes(surface)
+        heights = self.heights[key[0]]
+        heights.discard(key[1])
+        if not heights:
+            del self.heights[key[0]]
+
+    @staticmethod
+    def _bytes(surface):
+        return surface.get_stride() * surface.get_height()
+
+    @staticmethod
+    def _scale(icon, height):
+        if icon is None or icon.get_height() == height:
+            return icon
+        scale = height / icon.get_height()
+        width = max(int(round(icon.get_width() * scale)), 1)
+        surface = cairocffi.ImageSurface(
+            cairocffi.FORMAT_ARGB32, width, height
+        )
+        ctx = cairocffi.Context(surface)
+        ctx.scale(scale, scale)
+        ctx.set_source_surface(icon)
+        ctx.paint()
+        surface.flush()
+        return surface
+
+
 class _Window(command.CommandObject):
     def __init__(self, window, qtile):
         self.window, self.qtile = window, qtile
         self.hidden = True
         self.group = None
-        self.icons = {}
+        # The raw _NET_WM_ICON, the (width, height, offset) of each icon in
+        # it, the (size, surface) get_icon() last decoded, and the arrays
+        # of icons, once it has been read.
+        self._icon_data = None
+        self._icon_sizes = []
+        self._icon = None
+        self._icons = None
         window.set_attribute(eventmask=self._windowMask)
         try:
             g = self.window.get_geometry()
@@ -139,6 +258,10 @@ class _Window(command.CommandObject):
             self._float_info = None
         self.borderwidth = 0
         self.bordercolor = None
+        # What place() last sent to X: (x, y, width, height, borderwidth),
+        # and the border pixel.
+        self._placed = None
+        self._borderpixel = None
         self.name = "<no name>"
         self.strut = None
         self.state = NormalState
@@ -402,26 +525,18 @@ class _Window(command.CommandObject):
         )
 
     def place(self, x, y, width, height, borderwidth, bordercolor,
-              above=False, force=False, margin=None):
+              above=False, force=False, margin=None, respond=False):
         """
             Places the window at the specified location with the given size.
 
             if force is false, than it tries to obey hints
-        """
 
-        # TODO: self.x/y/height/width are updated BEFORE
-        # place is called, so there's no way to know if only
-        # the position is changed, so we are sending
-        # the ConfigureNotify every time place is called
-        #
-        # # if position change and size don't
-        # # send a configure notify. See ICCCM 4.2.3
-        # send_notify = False
-        # if (self.x != x or self.y != y) and \
-        #    (self.width == width and self.height == height):
-        #       send_notify = True
-        # #for now, we just:
-        send_notify = True
+            Only the requests that change something are sent to X; the
+            number of those made and skipped is kept in qtile.placeStats.
+            respond is set when answering a ConfigureRequest, which is
+            owed a ConfigureNotify even if the window stays as it is.
+        """
+        stats = self.qtile.placeStats
 
         # Adjust the placement to account for layout margins, if there are any.
         if margin is not None:
@@ -452,13 +567,34 @@ class _Window(command.CommandObject):
         if above:
             kwarg['stackmode'] = StackMode.Above
 
-        self.window.configure(**kwarg)
+        # self.x etc. may have been updated before we were called, so
+        # compare with what was last sent instead.
+        geometry = (x, y, width, height, borderwidth)
+        previous = self._placed
+        if above or geometry != previous:
+            self.window.configure(**kwarg)
+            self._placed = geometry
+            stats["configure"] += 1
+            # X sends a ConfigureNotify when the size changes; if the window
+            # only moves, send one ourselves. See ICCCM 4.1.5
+            send_notify = previous is None or previous[2:4] == geometry[2:4]
+        else:
+            stats["configure_skipped"] += 1
+            send_notify = respond
 
         if send_notify:
             self.send_configure_notify(x, y, width, height)
+            stats["notify"] += 1
+        else:
+            stats["notify_skipped"] += 1
 
         if bordercolor is not None:
-            self.window.set_attribute(borderpixel=bordercolor)
+            if bordercolor != self._borderpixel:
+                self.window.set_attribute(borderpixel=bordercolor)
+                self._borderpixel = bordercolor
+                stats["borderpixel"] += 1
+            else:
+                stats["borderpixel_skipped"] += 1
 
     def send_configure_notify(self, x, y, width, height):
         """
@@ -644,6 +780,7 @@ class Static(_Window):
     def __init__(self, win, qtile, screen,
                  x=None, y=None, width=None, height=None):
         _Window.__init__(self, win, qtile)
+        win.enable_property_cache()
         self.updateName()
         self.conf_x = x
         self.conf_y = y
@@ -675,7 +812,8 @@ class Static(_Window):
             self.width,
             self.height,
             self.borderwidth,
-            self.bordercolor
+            self.bordercolor,
+            respond=True,
         )
         return False
 
@@ -693,7 +831,8 @@ class Static(_Window):
         self.strut = strut
 
     def handle_PropertyNotify(self, e):
-        name = self.qtile.conn.atoms.get_name(e.atom)
+        self.window.property_changed(e.atom)
+        name = self.qtile.conn.atoms.get_name(e.atom, wait=False)
         if name in ("_NET_WM_STRUT_PARTIAL", "_NET_WM_STRUT"):
             self.update_strut()
 
@@ -711,6 +850,9 @@ class Window(_Window):
 
     def __init__(self, window, qtile):
         _Window.__init__(self, window, qtile)
+        # PropertyChange is selected now, and handle_PropertyNotify keeps
+        # the cache up to date
+        window.enable_property_cache()
         self._group = None
         self.updateName()
         # add to group by position according to _NET_WM_DESKTOP property
@@ -1051,46 +1193,80 @@ class Window(_Window):
                 x, y,
                 width, height,
                 self.borderwidth, self.bordercolor,
+                respond=True,
             )
         self.updateState()
         return False
 
     def update_wm_net_icon(self):
         """
-            Set a dict with the icons of the window
+            Read the window's _NET_WM_ICON. Only the sizes of the icons are
+            looked at here; get_icon() decodes the one that is asked for.
         """
 
         icon = self.window.get_property('_NET_WM_ICON', 'CARDINAL')
         if not icon:
             return
-        icon = list(map(ord, icon.value))
-
-        icons = {}
-        while True:
-            if not icon:
-                break
-            size = icon[:8]
-            if len(size) != 8 or not size[0] or not size[4]:
+        value = icon.value
+        data = value.buf() if hasattr(value, "buf") else b"".join(value)
+
+        sizes = []
+        offset = 0
+        while offset + 8 <= len(data):
+            width, height = struct.unpack_from("=II", data, offset)
+            end = offset + 8 + width * height * 4
+            if not width or not height or end > len(data):
                 break
+            sizes.append((width, height, offset + 8))
+            offset = end
+        self._icon_data = data
+        self._icon_sizes = sizes
+        self._icon = None
+        self._icons = None
+        self.qtile.iconCache.invalidate(self.window.wid)
+        hook.fire("net_wm_icon_change", self)
 
-            icon = icon[8:]
-
-            width = size[0]
-            height = size[4]
-
-            next_pix = width * height * 4
-            data = icon[:next_pix]
+    def get_icon(self, size):
+        """
+            Return the window's icon that best fits a size x size square, as
+            a cairo ImageSurface, or None if it has no icon. That is the
+            smallest icon at least as large as the square, or the largest
+            one if none is. Only the last icon asked for is kept.
+        """
+        if not self._icon_sizes:
+            return None
+        if self._icon and self._icon[0] == size:
+            return self._icon[1]
+        large = [i for i in self._icon_sizes if min(i[:2]) >= size]
+        if large:
+            width, height, offset = min(large, key=lambda i: i[0] * i[1])
+        else:
+            width, height, offset = max(
+                self._icon_sizes, key=lambda i: i[0] * i[1]
+            )
+        view = memoryview(self._icon_data)[offset:offset + width * height * 4]
+        surface = _icon_surface(bytearray(view), width, height)
+        self._icon = (size, surface)
+        return surface
 
-            arr = array.array("B", data)
-            for i in range(0, len(arr), 4):
-                mult = arr[i + 3] / 255.
-                arr[i + 0] = int(arr[i + 0] * mult)
-                arr[i + 1] = int(arr[i + 1] * mult)
-                arr[i + 2] = int(arr[i + 2] * mult)
-            icon = icon[next_pix:]
-            icons["%sx%s" % (width, height)] = arr
-        self.icons = icons
-        hook.fire("net_wm_icon_change", self)
+    @property
+    def icons(self):
+        """
+            All the window's icons by "WIDTHxHEIGHT", each an array of bytes
+            with the alpha premultiplied, as this attribute always held.
+            cairo premultiplies them as it does for get_icon(), and they are
+            kept until _NET_WM_ICON changes.
+        """
+        if self._icons is None:
+            self._icons = {}
+            for width, height, offset in self._icon_sizes:
+                view = memoryview(self._icon_data)[
+                    offset:offset + width * height * 4
+                ]
+                surface = _icon_surface(bytearray(view), width, height)
+                self._icons["%sx%s" % (width, height)] = \
+                    array.array("B", surface.get_data()[:])
+        return self._icons
 
     def handle_ClientMessage(self, event):
         atoms = self.qtile.conn.atoms
@@ -1132,7 +1308,8 @@ class Window(_Window):
             self.window.set_property('_NET_WM_STATE', list(current_state))
 
     def handle_PropertyNotify(self, e):
-        name = self.qtile.conn.atoms.get_name(e.atom)
+        self.window.property_changed(e.atom)
+        name = self.qtile.conn.atoms.get_name(e.atom, wait=False)
         self.qtile.log.debug("PropertyNotifyEvent: %s" % name)
         if name == "WM_TRANSIENT_FOR":
             pass
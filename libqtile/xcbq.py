@@ -36,6 +36,8 @@
 """
 from __future__ import print_function, division
 
+import bisect
+import functools
 import six
 import logging
 
@@ -193,6 +195,26 @@ SUPPORTED_ATOMS = [
 SUPPORTED_ATOMS.extend(WindowTypes.keys())
 SUPPORTED_ATOMS.extend(key for key in WindowStates.keys() if key)
 
+# Every atom qtile refers to by name; AtomCache interns them all up front.
+PRELOAD_ATOMS = set(SUPPORTED_ATOMS)
+PRELOAD_ATOMS.update(PropertyMap.keys())
+PRELOAD_ATOMS.update(type for type, _ in PropertyMap.values())
+PRELOAD_ATOMS.update([
+    "UTF8_STRING",
+    "CLIPBOARD",
+    "MANAGER",
+    "WM_PROTOCOLS",
+    "WM_DELETE_WINDOW",
+    "WM_TAKE_FOCUS",
+    "WM_WINDOW_ROLE",
+    "ZOOM",
+    "_NET_WM_ICON",
+    "_NET_WM_USER_TIME",
+    "_NET_SYSTEM_TRAY_OPCODE",
+    "_XEMBED",
+    "_XEMBED_EMBEDDED_NOTIFY",
+])
+
 XCB_CONN_ERRORS = {
     1: 'XCB_CONN_ERROR',
     2: 'XCB_CONN_CLOSED_EXT_NOTSUPPORTED',
@@ -247,14 +269,25 @@ class AtomCache(object):
         self.conn = conn
         self.atoms = {}
         self.reverse = {}
-
-        # We can change the pre-loads not to wait for a return
-        for name in WindowTypes.keys():
-            self.insert(name=name)
+        # GetAtomName cookies of atoms looked up with get_name(wait=False)
+        self.pending = {}
 
         for i in dir(xcffib.xproto.Atom):
             if not i.startswith("_"):
                 self.insert(name=i, atom=getattr(xcffib.xproto.Atom, i))
+        self.insert_many(PRELOAD_ATOMS)
+
+    def insert_many(self, names):
+        """
+            Intern several atoms in one round trip.
+        """
+        core = self.conn.conn.core
+        cookies = [
+            (name, core.InternAtom(False, len(name), name))
+            for name in names if name not in self.atoms
+        ]
+        for name, c in cookies:
+            self.insert(name=name, atom=c.reply().atom)
 
     def insert(self, name=None, atom=None):
         assert name or atom
@@ -267,11 +300,35 @@ class AtomCache(object):
         self.atoms[name] = atom
         self.reverse[atom] = name
 
-    def get_name(self, atom):
+    def get_name(self, atom, wait=True):
+        """
+            Return the name of an atom. If it isn't known yet and wait is
+            False, None is returned straight away and the name is asked for
+            in the background; resolve_pending() then picks it up. Since all
+            the atoms in PRELOAD_ATOMS are known, an event handler comparing
+            the name against those can use wait=False.
+        """
         if atom not in self.reverse:
-            self.insert(atom=atom)
+            c = self.pending.pop(atom, None)
+            if c is None:
+                if not wait:
+                    self.pending[atom] = self.conn.conn.core.GetAtomName(atom)
+                    return None
+                c = self.conn.conn.core.GetAtomName(atom)
+            self.insert(name=c.reply().name.to_string(), atom=atom)
         return self.reverse[atom]
 
+    def resolve_pending(self):
+        """
+            Read the replies to the name requests made by get_name(wait=False).
+        """
+        while self.pending:
+            atom, c = self.pending.popitem()
+            try:
+                self.insert(name=c.reply().name.to_string(), atom=atom)
+            except xcffib.xproto.AtomError:
+                pass
+
     def __getitem__(self, key):
         if key not in self.atoms:
             self.insert(name=key)
@@ -391,10 +448,124 @@ class GC(object):
         self.conn.conn.core.ChangeGC(self.gid, mask, values)
 
 
+def _cached_property(prop, type=None):
+    """
+        Decorates a Window getter that decodes the property prop, so that
+        its result is kept in the window's property cache (see
+        Window.enable_property_cache).
+    """
+    def decorator(getter):
+        @functools.wraps(getter)
+        def wrapper(self):
+            return self._cached(prop, type, getter)
+        return wrapper
+    return decorator
+
+
+def _forget_grabs(grabs, code, modifiers):
+    """
+        Remove the entries an ungrab of code and modifiers, either of which
+        may be None for any, undoes from a dict of grabs.
+    """
+    for k in list(grabs):
+        if code in (None, k[0]) and modifiers in (None, k[1]):
+            del grabs[k]
+
+
 class Window(object):
     def __init__(self, conn, wid):
         self.conn = conn
         self.wid = wid
+        # Cookies of requests sent by prefetch() whose replies haven't been
+        # used yet
+        self._prefetched = {}
+        # Decoded property values by (property, type) atoms, or None when
+        # caching is off; see enable_property_cache()
+        self._property_cache = None
+        # Prefetched requests made before the cache was enabled
+        self._uncacheable = set()
+        # The grabs made on the window, see set_key_grabs() and
+        # set_button_grabs()
+        self._key_grabs = {}
+        self._button_grabs = {}
+
+    def enable_property_cache(self):
+        """
+            Keep the results of the getters of properties which rarely
+            change (WM_CLASS, WM_WINDOW_ROLE, WM_PROTOCOLS,
+            _NET_WM_WINDOW_TYPE and _NET_WM_PID) until property_changed() is
+            called for them. This must only be enabled once PropertyChange
+            events are selected on the window, and every PropertyNotify
+            event for it must then be passed on to property_changed().
+        """
+        if self._property_cache is None:
+            self._property_cache = {}
+            # Their replies may predate the event mask, so a change made
+            # in between would go unnoticed
+            self._uncacheable = set(self._prefetched)
+
+    def property_changed(self, atom):
+        """
+            Forget the cached value of the property atom.
+        """
+        if self._property_cache:
+            for key in list(self._property_cache):
+                if key[0] == atom:
+                    del self._property_cache[key]
+
+    def _cached(self, prop, type, getter):
+        if self._property_cache is None:
+            return getter(self)
+        key = self._property_key(prop, type)
+        try:
+            return self._property_cache[key]
+        except KeyError:
+            pass
+        cacheable = key not in self._uncacheable or key not in self._prefetched
+        value = getter(self)
+        if cacheable:
+            self._property_cache[key] = value
+        return value
+
+    def prefetch(self, properties=(), attributes=False, geometry=False):
+        """
+            Send the requests for the given properties, and optionally the
+            window's attributes and geometry, without waiting for the
+            replies. The next get_property(), get_attributes() or
+            get_geometry() call for each of them (including those made by
+            the other get_* methods) then uses the reply to the prefetched
+            request instead of making one of its own, so that reading all of
+            them takes a single round trip rather than one each. Doing this
+            for many windows before reading any of them makes it a single
+            round trip for all of them.
+
+            properties: property names, or (name, type) tuples for
+            properties that aren't in PropertyMap or are read with another
+            type.
+        """
+        core = self.conn.conn.core
+        if attributes and "attributes" not in self._prefetched:
+            self._prefetched["attributes"] = core.GetWindowAttributes(self.wid)
+        if geometry and "geometry" not in self._prefetched:
+            self._prefetched["geometry"] = core.GetGeometry(self.wid)
+        for prop in properties:
+            if isinstance(prop, tuple):
+                key = self._property_key(*prop)
+            else:
+                key = self._property_key(prop)
+            if key not in self._prefetched:
+                self._prefetched[key] = core.GetProperty(
+                    False, self.wid, key[0], key[1], 0, (2 ** 32) - 1
+                )
+
+    def discard_prefetched(self):
+        """
+            Drop the replies to prefetched requests that haven't been used.
+        """
+        for cookie in self._prefetched.values():
+            cookie.discard_reply()
+        self._prefetched.clear()
+        self._uncacheable.clear()
 
     def _propertyString(self, r):
         """
@@ -492,6 +663,7 @@ class Window(object):
                 win_gravity=l[9 + 4],
             )
 
+    @_cached_property("WM_PROTOCOLS", "ATOM")
     def get_wm_protocols(self):
         l = self.get_property("WM_PROTOCOLS", "ATOM", unpack=int)
         if l is not None:
@@ -501,6 +673,7 @@ class Window(object):
     def get_wm_state(self):
         return self.get_property("WM_STATE", xcffib.xproto.GetPropertyType.Any, unpack=int)
 
+    @_cached_property("WM_CLASS", "STRING")
     def get_wm_class(self):
         """
             Return an (instance, class) tuple if WM_CLASS exists, or None.
@@ -510,6 +683,7 @@ class Window(object):
             s = self._propertyString(r)
             return tuple(s.strip("\0").split("\0"))
 
+    @_cached_property("WM_WINDOW_ROLE", "STRING")
     def get_wm_window_role(self):
         r = self.get_property("WM_WINDOW_ROLE", "STRING")
         if r:
@@ -536,7 +710,9 @@ class Window(object):
             return self._propertyUTF8(r)
 
     def get_geometry(self):
-        q = self.conn.conn.core.GetGeometry(self.wid)
+        q = self._prefetched.pop("geometry", None)
+        if q is None:
+            q = self.conn.conn.core.GetGeometry(self.wid)
         return q.reply()
 
     def get_wm_desktop(self):
@@ -545,6 +721,7 @@ class Window(object):
         if r:
             return r[0]
 
+    @_cached_property("_NET_WM_WINDOW_TYPE", "ATOM")
     def get_wm_type(self):
         """
         http://standards.freedesktop.org/wm-spec/wm-spec-latest.html#id2551529
@@ -561,6 +738,7 @@ class Window(object):
             return [WindowStates.get(n, n) for n in names]
         return []
 
+    @_cached_property("_NET_WM_PID")
     def get_net_wm_pid(self):
         r = self.get_property("_NET_WM_PID", unpack=int)
         if r:
@@ -641,6 +819,7 @@ class Window(object):
             logging.getLogger('qtile').warning(
                 'X error in SetProperty (wid=%r, prop=%r), ignoring',
                 self.wid, name)
+        self.property_changed(self.conn.atoms[name])
 
     def get_property(self, prop, type=None, unpack=None):
         """
@@ -648,25 +827,14 @@ class Window(object):
             is specified, a tuple of values is returned.  The type to unpack,
             either `str` or `int` must be specified.
         """
-        if type is None:
-            if prop not in PropertyMap:
-                raise ValueError(
-                    "Must specify type for unknown property."
-                )
-            else:
-                type, _ = PropertyMap[prop]
-
+        key = self._property_key(prop, type)
         try:
-            r = self.conn.conn.core.GetProperty(
-                False, self.wid,
-                self.conn.atoms[prop]
-                if isinstance(prop, six.string_types)
-                else prop,
-                self.conn.atoms[type]
-                if isinstance(type, six.string_types)
-                else type,
-                0, (2 ** 32) - 1
-            ).reply()
+            cookie = self._prefetched.pop(key, None)
+            if cookie is None:
+                cookie = self.conn.conn.core.GetProperty(
+                    False, self.wid, key[0], key[1], 0, (2 ** 32) - 1
+                )
+            r = cookie.reply()
         except (xcffib.xproto.WindowError, xcffib.xproto.AccessError):
             logging.getLogger('qtile').warning(
                 'X error in GetProperty (wid=%r, prop=%r), ignoring',
@@ -688,6 +856,27 @@ class Window(object):
         else:
             return r
 
+    def _property_key(self, prop, type=None):
+        """
+            Return the (property, type) atoms for a property and type given
+            by name or atom.
+        """
+        if type is None:
+            if prop not in PropertyMap:
+                raise ValueError(
+                    "Must specify type for unknown property."
+                )
+            else:
+                type, _ = PropertyMap[prop]
+        return (
+            self.conn.atoms[prop]
+            if isinstance(prop, six.string_types)
+            else prop,
+            self.conn.atoms[type]
+            if isinstance(type, six.string_types)
+            else type,
+        )
+
     def list_properties(self):
         r = self.conn.conn.core.ListProperties(self.wid).reply()
         return [self.conn.atoms.get_name(i) for i in r.atoms]
@@ -699,7 +888,10 @@ class Window(object):
         self.conn.conn.core.UnmapWindowChecked(self.wid).check()
 
     def get_attributes(self):
-        return self.conn.conn.core.GetWindowAttributes(self.wid).reply()
+        q = self._prefetched.pop("attributes", None)
+        if q is None:
+            q = self.conn.conn.core.GetWindowAttributes(self.wid)
+        return q.reply()
 
     def create_gc(self, **kwargs):
         gid = self.conn.conn.generate_id()
@@ -711,6 +903,7 @@ class Window(object):
         """
             Passing None means any key, or any modifier.
         """
+        _forget_grabs(self._key_grabs, key, modifiers)
         if key is None:
             key = xcffib.xproto.Atom.Any
         if modifiers is None:
@@ -719,6 +912,8 @@ class Window(object):
 
     def grab_key(self, key, modifiers, owner_events,
                  pointer_mode, keyboard_mode):
+        self._key_grabs[(key, modifiers)] = \
+            (owner_events, pointer_mode, keyboard_mode)
         self.conn.conn.core.GrabKey(
             owner_events,
             self.wid,
@@ -728,18 +923,51 @@ class Window(object):
             keyboard_mode
         )
 
+    def set_key_grabs(self, grabs):
+        """
+            Make the window's key grabs exactly grabs, a dict mapping (key,
+            modifiers) to (owner_events, pointer_mode, keyboard_mode), the
+            remaining arguments of grab_key(). Only the grabs that differ
+            from the current ones are made or removed, and the requests are
+            sent together.
+        """
+        current = self._key_grabs
+        for k in [k for k in current if grabs.get(k) != current[k]]:
+            self.ungrab_key(*k)
+        for k, args in grabs.items():
+            if current.get(k) != args:
+                self.grab_key(*(k + args))
+        self.conn.flush()
+
     def ungrab_button(self, button, modifiers):
         """
             Passing None means any key, or any modifier.
         """
+        _forget_grabs(self._button_grabs, button, modifiers)
         if button is None:
             button = xcffib.xproto.Atom.Any
         if modifiers is None:
             modifiers = xcffib.xproto.ModMask.Any
         self.conn.conn.core.UngrabButton(button, self.wid, modifiers)
 
+    def set_button_grabs(self, grabs):
+        """
+            Like set_key_grabs(), for buttons: grabs maps (button,
+            modifiers) to (owner_events, event_mask, pointer_mode,
+            keyboard_mode).
+        """
+        current = self._button_grabs
+        for k in [k for k in current if grabs.get(k) != current[k]]:
+            self.ungrab_button(*k)
+        for k, args in grabs.items():
+            if current.get(k) != args:
+                self.grab_button(*(k + args))
+        self.conn.flush()
+
     def grab_button(self, button, modifiers, owner_events,
                     event_mask, pointer_mode, keyboard_mode):
+        self._button_grabs[(button, modifiers)] = \
+            (owner_events, event_mask, pointer_mode, keyboard_mode)
         self.conn.conn.core.GrabButton(
             owner_events,
             self.wid,
@@ -838,10 +1066,12 @@ class Connection(object):
         self.atoms = AtomCache(self)
 
         self.code_to_syms = {}
-        self.first_sym_to_code = None
+        # The keycodes whose first keysym is a keysym, lowest first
+        self.sym_to_codes = {}
         self.refresh_keymap()
 
         self.modmap = None
+        self.code_to_modifier = {}
         self.refresh_modmap()
 
     def finalize(self):
@@ -849,42 +1079,64 @@ class Connection(object):
         self.disconnect()
 
     def refresh_keymap(self, first=None, count=None):
+        """
+            Reread the keysyms of count keycodes from first, or of all of
+            them. Returns the set of first keysyms whose keycodes changed.
+        """
         if first is None:
             first = self.setup.min_keycode
             count = self.setup.max_keycode - self.setup.min_keycode + 1
         q = self.conn.core.GetKeyboardMapping(first, count).reply()
 
         assert len(q.keysyms) % q.keysyms_per_keycode == 0
-        for i in range(len(q.keysyms) // q.keysyms_per_keycode):
-            self.code_to_syms[first + i] = \
-                q.keysyms[i * q.keysyms_per_keycode:(i + 1) * q.keysyms_per_keycode]
-
-        first_sym_to_code = {}
-        for k, s in self.code_to_syms.items():
-            if s[0] and not s[0] in first_sym_to_code:
-                first_sym_to_code[s[0]] = k
-
-        self.first_sym_to_code = first_sym_to_code
+        per_code = q.keysyms_per_keycode
+        keysyms = list(q.keysyms)
+        changed = set()
+        for i in range(len(keysyms) // per_code):
+            code = first + i
+            syms = keysyms[i * per_code:(i + 1) * per_code]
+            old = self.code_to_syms.get(code)
+            self.code_to_syms[code] = syms
+            old_sym = old[0] if old else 0
+            if old_sym == syms[0]:
+                continue
+            if old_sym:
+                codes = self.sym_to_codes[old_sym]
+                codes.remove(code)
+                if not codes:
+                    del self.sym_to_codes[old_sym]
+                changed.add(old_sym)
+            if syms[0]:
+                bisect.insort(self.sym_to_codes.setdefault(syms[0], []), code)
+                changed.add(syms[0])
+        return changed
 
     def refresh_modmap(self):
         q = self.conn.core.GetModifierMapping().reply()
         modmap = {}
+        code_to_modifier = {}
         for i, k in enumerate(q.keycodes):
-            l = modmap.setdefault(ModMapOrder[i // q.keycodes_per_modifier], [])
-            l.append(k)
+            name = ModMapOrder[i // q.keycodes_per_modifier]
+            modmap.setdefault(name, []).append(k)
+            code_to_modifier.setdefault(k, name)
         self.modmap = modmap
+        self.code_to_modifier = code_to_modifier
 
     def get_modifier(self, keycode):
         """
             Return the modifier matching keycode.
         """
-        for n, l in self.modmap.items():
-            if keycode in l:
-                return n
-        return None
+        return self.code_to_modifier.get(keycode)
 
     def keysym_to_keycode(self, keysym):
-        return self.first_sym_to_code.get(keysym, 0)
+        codes = self.sym_to_codes.get(keysym)
+        return codes[0] if codes else 0
+
+    def keysym_to_keycodes(self, keysym):
+        """
+            Return all the keycodes whose first keysym is keysym.
+        """
+        return list(self.sym_to_codes.get(keysym, ()))
 
     def keycode_to_keysym(self, keycode, modifier):
         if keycode >= len(self.code_to_syms) or \
@@ -0,0 +1,257 @@
+# Copyright (c) 2026 The Qtile developers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Fakes shared by the tests that run without an X server.
+"""
+
+import logging
+
+import xcffib.xproto
+
+import libqtile.command
+import libqtile.config
+import libqtile.manager
+from libqtile import xcbq
+
+
+class FakeReply(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def reply(self):
+        return self
+
+
+class FakeCookie(object):
+    """
+        The cookie of a request to a fake X server. Reading or discarding
+        its reply is recorded in the requests of core, after the request.
+    """
+    def __init__(self, core, request, reply):
+        self.core = core
+        self.request = request
+        self._reply = reply
+
+    def reply(self):
+        self.core.requests.append(("reply",) + self.request)
+        return self._reply
+
+    def discard_reply(self):
+        self.core.requests.append(("discard",) + self.request)
+
+
+class FakeValue(object):
+    """
+        The value of a property: a string, or a list of numbers.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def to_string(self):
+        return self.data
+
+    to_utf8 = to_string
+
+    def to_atoms(self):
+        return tuple(self.data)
+
+
+class FakeCore(object):
+    """
+        The requests of a connection's core that are tested here; the
+        others are recorded, with their arguments, in requests.
+    """
+    def __init__(self, keymap):
+        # keycode -> keysyms, two per keycode
+        self.keymap = keymap
+        self.requests = []
+        # name -> atom, for the atoms interned so far
+        self.atoms = {}
+        # (window, property atom) -> data of a FakeValue
+        self.properties = {}
+
+    def _cookie(self, request, **reply):
+        self.requests.append(request)
+        return FakeCookie(self, request, FakeReply(**reply))
+
+    def GetKeyboardMapping(self, first, count):
+        self.requests.append(("GetKeyboardMapping", first, count))
+        keysyms = []
+        for code in range(first, first + count):
+            keysyms += self.keymap.get(code, [0, 0])
+        return FakeReply(keysyms=keysyms, keysyms_per_keycode=2)
+
+    def InternAtom(self, only_if_exists, length, name):
+        # Above the predefined atoms
+        atom = self.atoms.setdefault(name, 100 + len(self.atoms))
+        return self._cookie(("InternAtom", name), atom=atom)
+
+    def GetAtomName(self, atom):
+        names = dict((a, name) for name, a in self.atoms.items())
+        return self._cookie(
+            ("GetAtomName", atom), name=FakeValue(names[atom])
+        )
+
+    def GetProperty(self, delete, wid, prop, type, offset, length):
+        data = self.properties.get((wid, prop), [])
+        return self._cookie(
+            ("GetProperty", wid, prop), value=FakeValue(data),
+            value_len=len(data)
+        )
+
+    def GetWindowAttributes(self, wid):
+        return self._cookie(
+            ("GetWindowAttributes", wid), override_redirect=False,
+            map_state=xcffib.xproto.MapState.Viewable
+        )
+
+    def GetGeometry(self, wid):
+        return self._cookie(
+            ("GetGeometry", wid), x=0, y=0, width=100, height=100
+        )
+
+    def __getattr__(self, name):
+        return lambda *args: self.requests.append((name,) + args)
+
+
+class FakeConn(object):
+    def __init__(self, keymap):
+        self.core = FakeCore(keymap)
+
+    def flush(self):
+        pass
+
+
+def connection(keymap):
+    """
+        A Connection to a fake X server with the keymap keymap, which may be
+        changed, for keycodes 8 to 15.
+    """
+    conn = xcbq.Connection.__new__(xcbq.Connection)
+    conn.conn = FakeConn(keymap)
+    conn._connected = True
+    conn.setup = FakeReply(min_keycode=8, max_keycode=15)
+    conn.code_to_syms = {}
+    conn.sym_to_codes = {}
+    conn.code_to_modifier = {}
+    conn.refresh_keymap()
+    return conn
+
+
+def window_connection():
+    """
+        A Connection to a fake X server, with the predefined atoms and those
+        of PRELOAD_ATOMS interned, for windows whose properties are set in
+        conn.conn.core.properties.
+    """
+    conn = xcbq.Connection.__new__(xcbq.Connection)
+    conn.conn = FakeConn({})
+    conn._connected = True
+    conn.atoms = xcbq.AtomCache(conn)
+    return conn
+
+
+class FakeConfig(object):
+    def __init__(self, **options):
+        self.__dict__.update(options)
+
+
+def bare_qtile(**config):
+    """
+        A Qtile without an X server or an event loop, with only what
+        Qtile.__init__ sets up before it connects, for a config with the
+        options config.
+    """
+    qtile = libqtile.manager.Qtile.__new__(libqtile.manager.Qtile)
+    qtile.log = logging.getLogger("qtile")
+    qtile.config = FakeConfig(**config)
+    qtile._init_bookkeeping()
+    return qtile
+
+
+class FrameLoop(object):
+    def __init__(self):
+        self.now = 0
+        self.later = []
+
+    def time(self):
+        return self.now
+
+
+def frame_qtile():
+    # Just enough of a Qtile for the frame scheduler, without an X server
+    qtile = bare_qtile(frame_rate=10)
+    qtile._eventloop = FrameLoop()
+    qtile.call_later = \
+        lambda delay, func: qtile._eventloop.later.append((delay, func))
+    return qtile
+
+
+class LayoutGroup(object):
+    def __init__(self, name):
+        self.name = name
+        self.layouts = []
+
+    def _layoutAll(self, warp=False):
+        self.layouts.append(warp)
+
+
+def layout_qtile():
+    # Just enough of a Qtile for the layout scheduler, without an X server
+    qtile = bare_qtile()
+    qtile.soon = []
+    qtile.call_soon = lambda func: qtile.soon.append(func)
+    return qtile
+
+
+def event(cls, **fields):
+    e = cls.__new__(cls)
+    e.__dict__.update(fields)
+    return e
+
+
+class KeyServer(object):
+    def __init__(self):
+        self.calls = []
+
+    def call(self, msg):
+        self.calls.append(msg[1])
+        return (libqtile.command.SUCCESS, None)
+
+
+def key_qtile(keymap):
+    """
+        A Qtile with just what key bindings need, on a fake X server with
+        the keymap keymap and numlock on mod2.
+    """
+    qtile = bare_qtile()
+    qtile.conn = connection(keymap)
+    qtile.conn.code_to_modifier = {8: "mod2"}
+    qtile.root = xcbq.Window(qtile.conn, 1)
+    qtile.server = KeyServer()
+    qtile.updateLockMasks()
+    return qtile
+
+
+def key(modifiers, keysym, name):
+    return libqtile.config.Key(
+        modifiers, keysym, libqtile.command._Call([], name)
+    )
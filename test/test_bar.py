@@ -284,6 +284,74 @@ def test_resize(self):
         assert off(l) == [0, 10, 90]
 
 
+class DrawDrawer:
+    def resize(self, width, height):
+        self.width, self.height = width, height
+
+
+class DrawWidget(DWidget):
+    def __init__(self, length, length_type):
+        DWidget.__init__(self, length, length_type)
+        self.drawer = DrawDrawer()
+        self.draws = 0
+
+    @property
+    def offset(self):
+        return self.offsetx
+
+    @property
+    def width(self):
+        return self.length
+
+    @property
+    def height(self):
+        return 10
+
+    def draw(self):
+        self.draws += 1
+
+
+class DrawQtile:
+    def schedule_draw(self, func, now=False):
+        pass
+
+
+def test_damage():
+    b = DBarH([], 100)
+    b.qtile = DrawQtile()
+    b.length = 100
+    b.widgets = [
+        DrawWidget(10, libqtile.bar.CALCULATED),
+        DrawWidget(20, libqtile.bar.CALCULATED),
+        DrawWidget(None, libqtile.bar.STRETCH),
+        DrawWidget(10, libqtile.bar.CALCULATED),
+    ]
+
+    def draws():
+        return [i.draws for i in b.widgets]
+
+    b.draw()
+    b._actual_draw()
+    assert draws() == [1, 1, 1, 1]
+
+    # a widget that kept its length is the only one repainted
+    b.draw(b.widgets[1])
+    b._actual_draw()
+    assert draws() == [1, 2, 1, 1]
+
+    # one that grew moves the stretch widget, which shrinks
+    b.widgets[1].length = 25
+    b.draw(b.widgets[1])
+    b._actual_draw()
+    assert draws() == [1, 3, 2, 1]
+    assert b.widgets[2].drawer.width == 55
+
+    b.draw(b.widgets[0])
+    b.draw()
+    b._actual_draw()
+    assert draws() == [2, 4, 3, 2]
+
+
 class TestWidget(libqtile.widget.base._Widget):
     orientations = libqtile.widget.base.ORIENTATION_HORIZONTAL
 
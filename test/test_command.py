@@ -21,6 +21,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import logging
+
 import libqtile
 import libqtile.confreader
 import libqtile.manager
@@ -30,6 +32,7 @@ import libqtile.bar
 import libqtile.widget
 from .utils import Xephyr
 from nose.tools import assert_raises
+from six.moves import asyncio
 
 
 class CallConfig(object):
@@ -112,6 +115,22 @@ def test_command():
     assert not c.command("nonexistent")
 
 
+class MoreCommands(TestCommands):
+    def cmd_one_self(self):
+        return "overridden"
+
+    def cmd_four(self):
+        pass
+
+
+def test_command_subclass():
+    c = MoreCommands()
+    assert c.command("one_self")() == "overridden"
+    assert c.command("one")
+    assert "four" in c.commands()
+    assert "four" not in TestCommands().commands()
+
+
 class TestCmdRoot(libqtile.command._CommandRoot):
     def call(self, *args):
         return args
@@ -241,6 +260,23 @@ def test_select_qtile(self):
     assert_raises(libqtile.command.CommandError, self.c.screen["foo"].info)
 
 
+@Xephyr(True, ServerConfig())
+def test_select_cache(self):
+    proc = self.testWindow("one")
+    wid = self.c.window.info()["id"]
+    assert self.c.window[wid].info()["id"] == wid
+    assert self.c.group["a"].window[wid].info()["id"] == wid
+
+    # Moving the window must not leave it selectable in its old group
+    self.c.window[wid].togroup("b")
+    assert_raises(
+        libqtile.command.CommandError, self.c.group["a"].window[wid].info)
+    assert self.c.group["b"].window[wid].info()["id"] == wid
+
+    self.kill(proc)
+    assert_raises(libqtile.command.CommandError, self.c.window[wid].info)
+
+
 @Xephyr(True, ServerConfig())
 def test_items_group(self):
     g = self.c.group
@@ -367,3 +403,214 @@ def test_select_widget(self):
     w = self.c.widget["one"]
     assert w.bar.info()["position"] == "bottom"
     assert_raises(libqtile.command.CommandError, w.bar["bottom"].info)
+
+
+@Xephyr(True, ServerConfig())
+def test_batch(self):
+    lazy = libqtile.command.lazy
+    info = self.c.batch([
+        lazy.group["b"].info(),
+        ([("screen", 1)], "info", (), {}),
+    ])
+    assert info[0]["name"] == "b"
+    assert info[1]["index"] == 1
+
+    self.c.batch([lazy.to_screen(1), lazy.group["c"].toscreen()])
+    assert self.c.screen.info()["index"] == 1
+    assert self.c.group.info()["name"] == "c"
+
+    assert_raises(
+        libqtile.command.CommandError,
+        self.c.batch, [lazy.status(), lazy.nonexistent()]
+    )
+    assert self.c.batch([]) == []
+
+
+@Xephyr(True, ServerConfig())
+def test_iterate(self):
+    self.testXeyes()
+    self.testXeyes()
+    lazy = libqtile.command.lazy
+    windows = list(self.c.iterate(lazy.windows()))
+    assert windows == self.c.windows()
+    assert len(windows) == 2
+    assert self.c.batch([lazy.windows()]) == [windows]
+    # Commands that don't produce their results piecemeal work too
+    assert sorted(self.c.iterate(lazy.list_widgets())) == ["one", "two"]
+
+
+@Xephyr(True, ServerConfig())
+def test_async_client(self):
+    loop = asyncio.new_event_loop()
+    try:
+        c = libqtile.command.AsyncClient(self.sockfile, loop)
+        status, screen = loop.run_until_complete(asyncio.gather(
+            c.status(),
+            c.screen[1].info(),
+        ))
+        assert status == "OK"
+        assert screen["index"] == 1
+
+        info = loop.run_until_complete(
+            c.batch([libqtile.command.lazy.group["b"].info()])
+        )
+        assert info[0]["name"] == "b"
+
+        assert_raises(
+            libqtile.command.CommandError,
+            loop.run_until_complete, c.nonexistent()
+        )
+        c.client.close()
+    finally:
+        loop.close()
+
+
+@Xephyr(True, ServerConfig())
+def test_subscribe(self):
+    events = self.c.subscribe(["setgroup", "client_focus"])
+    self.c.group["c"].toscreen()
+    assert next(events) == ("setgroup", [])
+
+    self.testWindow("one")
+    wid = self.c.window.info()["id"]
+    for event, args in events:
+        if event == "client_focus":
+            assert args[0]["id"] == wid
+            break
+
+    assert_raises(libqtile.command.CommandError, self.c.subscribe, ["foo"])
+    # The refused subscription is forgotten
+    assert self.c.client.proto.streams == {}
+
+
+class ChunkedCommands(libqtile.command.CommandObject):
+    def _items(self, name):
+        return None
+
+    def _select(self, name, sel):
+        return None
+
+    def cmd_small(self):
+        return [1, 2, 3]
+
+    @libqtile.command.chunked
+    def cmd_long(self):
+        return [1, 2, 3]
+
+    def cmd_produce(self):
+        for i in range(3):
+            yield i
+
+    def cmd_fail(self):
+        yield 0
+        raise ValueError("no more items")
+
+
+class ChunkedConn(object):
+    flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+class ChunkedQtile(object):
+    def __init__(self):
+        self.conn = ChunkedConn()
+        self.log = logging.getLogger("qtile")
+        self.root = ChunkedCommands()
+
+    def select(self, selectors):
+        return self.root
+
+
+def test_chunked_commands():
+    server = libqtile.command._Server.__new__(libqtile.command._Server)
+    server.qtile = qtile = ChunkedQtile()
+
+    # Plain lists are a single reply, whatever asks for them
+    assert server.call(([], "small", (), {}), chunked=True) == \
+        (libqtile.command.SUCCESS, [1, 2, 3])
+    assert qtile.conn.flushes == 1
+
+    for name, items in (("long", [1, 2, 3]), ("produce", [0, 1, 2])):
+        before = qtile.conn.flushes
+        reply = server.call(([], name, (), {}), chunked=True)
+        assert isinstance(reply, libqtile.ipc.Chunked)
+        assert list(reply.parts) == items
+        # X is flushed once all the items have been produced
+        assert qtile.conn.flushes == before
+        assert reply.end() == (libqtile.command.SUCCESS, None)
+        assert qtile.conn.flushes == before + 1
+
+        # Without chunked, as for commands run by qtile itself, the result
+        # is a list
+        assert server.call(([], name, (), {})) == \
+            (libqtile.command.SUCCESS, items)
+
+    # A command that fails part way is answered with its traceback, formatted
+    # while the exception is handled, as the IPC server does
+    reply = server.call(([], "fail", (), {}), chunked=True)
+    parts = iter(reply.parts)
+    assert next(parts) == 0
+    try:
+        next(parts)
+    except ValueError as e:
+        state, value = reply.error(e)
+    assert state == libqtile.command.EXCEPTION
+    assert "ValueError: no more items" in value
+
+
+def test_batch_errors():
+    server = libqtile.command._Server.__new__(libqtile.command._Server)
+    server.qtile = qtile = ChunkedQtile()
+
+    # The single argument must be a list of commands
+    for args in ((), ([], []), ("small",)):
+        state, message = server.call(([], "batch", args, {}))
+        assert state == libqtile.command.ERROR
+
+    # A malformed command fails on its own, the others still run
+    state, results = server.call(([], "batch", ([
+        ([], "small", (), {}),
+        ("small",),
+        ([], "nonexistent", (), {}),
+        ([], "small", (), {}),
+    ],), {}))
+    assert state == libqtile.command.SUCCESS
+    assert [r[0] for r in results] == [
+        libqtile.command.SUCCESS, libqtile.command.ERROR,
+        libqtile.command.ERROR, libqtile.command.SUCCESS,
+    ]
+    assert results[3][1] == [1, 2, 3]
+    assert qtile.conn.flushes == 1
+
+    assert server.call(([], "batch", ([],), {})) == \
+        (libqtile.command.SUCCESS, [])
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def get_extra_info(self, name):
+        return None
+
+
+def test_subscribe_unknown_event():
+    server = libqtile.command._Server.__new__(libqtile.command._Server)
+    server.qtile = ChunkedQtile()
+    proto = libqtile.ipc._ServerProtocol(
+        None, logging.getLogger("qtile"), subscribe=server.subscribe
+    )
+    proto.connection_made(FakeTransport())
+    proto.codec = libqtile.ipc.CODECS["binary/1"]
+    proto._handle(1, ([], "subscribe", (["nonexistent"],), {}))
+    state, message = proto.codec.decode(
+        proto.transport.written[0][libqtile.ipc.HDRLEN:]
+    )
+    assert state == libqtile.command.ERROR
+    assert "nonexistent" in message
+    assert proto.subscriptions == []
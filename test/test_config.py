@@ -25,6 +25,7 @@ from libqtile import config, utils
 from nose.tools import raises, assert_raises
 
 import os
+import re
 tests_dir = os.path.dirname(os.path.realpath(__file__))
 
 @raises(confreader.ConfigError)
@@ -79,3 +80,85 @@ def test_ezclick_ezdrag():
     btn = config.EzDrag('A-2', cmd)
     assert btn.button == 'Button2'
     assert btn.modifiers == [config.EzClick.modifier_keys['A']]
+
+
+class FakeWindow(object):
+    def __init__(self, wm_class=None, role=None, wm_type=None, pid=None):
+        self.wm_class = wm_class
+        self.role = role
+        self.wm_type = wm_type
+        self.pid = pid
+
+    def get_wm_class(self):
+        return self.wm_class
+
+    def get_wm_window_role(self):
+        return self.role
+
+    def get_wm_type(self):
+        return self.wm_type
+
+    def get_net_wm_pid(self):
+        return self.pid
+
+
+class FakeClient(object):
+    def __init__(self, name, **kwargs):
+        self.name = name
+        self.window = FakeWindow(**kwargs)
+
+
+def test_match_index():
+    matches = [
+        config.Match(wm_class=["Firefox"]),
+        config.Match(title=[re.compile("mutt")]),
+        config.Match(wm_instance_class=["navigator"], role=["browser"]),
+        config.Match(net_wm_pid=[42]),
+        config.Match(wm_type=["dialog"]),
+        config.Match(title=["x" * 100]),
+    ]
+    index = config.MatchIndex(matches)
+    clients = [
+        FakeClient("mutt", wm_class=("navigator", "Firefox")),
+        FakeClient("a mutt", wm_class=("fire", "fox"), pid=42),
+        FakeClient("xxx", role="browser", wm_type="dialog"),
+        FakeClient("other", wm_class=("Navigator", "Firef")),
+        FakeClient("", wm_class=("", "")),
+    ]
+    for client in clients:
+        expected = [i for i, m in enumerate(matches) if m.compare(client)]
+        assert index.matching(client) == expected
+    assert index.matching(clients[0]) == [0, 1, 2]
+    assert index.matching(clients[2]) == [2, 4, 5]
+
+
+def test_match_index_long_rules():
+    long_title = "".join(chr(ord("a") + i % 26) for i in range(5000))
+    matches = [
+        config.Match(title=[long_title]),
+        config.Match(title=["x" * 5000]),
+        config.Match(title=["yxy"]),
+    ]
+    index = config.MatchIndex(matches)
+    # Only the short substrings of the rules are indexed, so the table
+    # grows linearly with their length
+    entries = sum(len(v) for v in index.grams["title"].values())
+    assert entries <= config.MatchIndex.gram_length * (5000 + 5000 + 3)
+
+    clients = [
+        FakeClient(long_title),
+        FakeClient(long_title[1000:2000]),
+        FakeClient(long_title[1000:2000] + "a"),
+        FakeClient("x" * 3000),
+        FakeClient("xy"),
+        FakeClient("xyx"),
+        FakeClient("xyxy"),
+        FakeClient("hij"),
+    ]
+    for client in clients:
+        expected = [i for i, m in enumerate(matches) if m.compare(client)]
+        assert index.matching(client) == expected
+    assert index.matching(clients[1]) == [0]
+    assert index.matching(clients[3]) == [1]
+    assert index.matching(clients[4]) == [0, 2]
+    assert index.matching(clients[6]) == []
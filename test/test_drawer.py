@@ -0,0 +1,176 @@
+# Copyright (c) 2026 The Qtile developers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import libqtile.drawer
+from libqtile.drawer import TextLayout, TextSizeCache
+
+
+class FakeFontDescription(object):
+    @classmethod
+    def from_string(cls, string):
+        return cls()
+
+    def set_absolute_size(self, size):
+        pass
+
+    def set_size(self, size):
+        pass
+
+
+class FakePango(object):
+    """
+        The parts of pangocffi TextLayout uses.
+    """
+    ALIGN_CENTER = 0
+    ELLIPSIZE_END = 0
+    FontDescription = FakeFontDescription
+
+    @staticmethod
+    def units_from_double(value):
+        return value
+
+    @staticmethod
+    def parse_markup(value):
+        return (None, value.replace("<b>", "").replace("</b>", ""), None)
+
+
+class FakeLayout(object):
+    def __init__(self, calls):
+        self.calls = calls
+        self.font = FakeFontDescription()
+        self.pango_text = None
+
+    def set_text(self, text):
+        self.calls.append(("set_text", text))
+        self.pango_text = text
+
+    def get_text(self):
+        return self.pango_text
+
+    def get_pixel_size(self):
+        self.calls.append(("get_pixel_size", self.pango_text))
+        return (len(self.pango_text) * 10, 12)
+
+    def get_font_description(self):
+        return self.font
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class FakeContext(object):
+    def __init__(self, calls):
+        self.calls = calls
+
+    def create_layout(self):
+        return FakeLayout(self.calls)
+
+    def show_layout(self, layout):
+        self.calls.append(("show_layout", layout.pango_text))
+
+    def move_to(self, x, y):
+        pass
+
+
+class FakeDrawer(object):
+    def __init__(self):
+        self.calls = []
+        self.ctx = FakeContext(self.calls)
+
+    def set_source_rgb(self, colour):
+        pass
+
+
+def with_fake_pango(test):
+    def wrapper():
+        pango = libqtile.drawer.pangocffi
+        text_sizes = libqtile.drawer.text_sizes
+        libqtile.drawer.pangocffi = FakePango
+        libqtile.drawer.text_sizes = TextSizeCache()
+        try:
+            test()
+        finally:
+            libqtile.drawer.pangocffi = pango
+            libqtile.drawer.text_sizes = text_sizes
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+def test_text_size_cache():
+    cache = TextSizeCache(max_entries=2)
+    cache.put("a", (1, 1))
+    cache.put("b", (2, 1))
+    assert cache.get("a") == (1, 1)
+    # "b" is now the least recently used
+    cache.put("c", (3, 1))
+    assert cache.get("b") is None
+    assert cache.get("a") == (1, 1)
+    assert cache.get("c") == (3, 1)
+    assert len(cache.sizes) == 2
+
+
+@with_fake_pango
+def test_text_layout_sizes():
+    drawer = FakeDrawer()
+    calls = drawer.calls
+    layout = TextLayout(drawer, "abc", "ffffff", "sans", 12, None)
+    layout.text = "hello"
+    layout.text = "hello!"
+    # Setting text doesn't touch pango
+    assert calls == []
+
+    # Measuring new text gives it to pango first
+    assert layout.width == 60
+    assert layout.height == 12
+    assert calls == [("set_text", "hello!"), ("get_pixel_size", "hello!")]
+
+    # The same text in the same font is measured once
+    del calls[:]
+    other = TextLayout(drawer, "hello!", "ffffff", "sans", 12, None)
+    assert other.width == 60
+    assert calls == []
+    # but drawn with the right text
+    other.draw(0, 0)
+    assert calls == [("set_text", "hello!"), ("show_layout", "hello!")]
+
+    # A different font size is measured again
+    del calls[:]
+    other.font_size = 14
+    assert other.width == 60
+    assert calls == [("get_pixel_size", "hello!")]
+
+    del calls[:]
+    layout.text = "bye"
+    layout.draw(0, 0)
+    assert calls == [("set_text", "bye"), ("show_layout", "bye")]
+    assert layout.text == "bye"
+    assert layout.width == 30
+
+
+@with_fake_pango
+def test_text_layout_markup():
+    drawer = FakeDrawer()
+    layout = TextLayout(
+        drawer, "<b>bold</b>", "ffffff", "sans", 12, None, markup=True
+    )
+    assert layout.width == 40
+    assert drawer.calls[0] == ("set_text", "bold")
+    assert layout.text == "bold"
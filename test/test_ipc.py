@@ -0,0 +1,443 @@
+# Copyright (c) 2026 The Qtile developers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+
+import libqtile.ipc
+from six.moves import asyncio
+from nose.tools import assert_raises
+
+
+class Count(libqtile.ipc.Chunked):
+    """
+        Sends the numbers up to n, failing at "fail" if it is given, in parts
+        of part_size bytes. With "unencodable" set, fails by yielding an
+        object the codecs can't encode instead.
+    """
+    def __init__(self, n, fail=None, part_size=None, unencodable=False):
+        def parts():
+            for i in range(n):
+                if i == fail:
+                    if unencodable:
+                        yield object()
+                    raise ValueError(i)
+                yield i
+        libqtile.ipc.Chunked.__init__(self, parts())
+        if part_size is not None:
+            self.part_size = part_size
+
+    def end(self):
+        return "done"
+
+    def error(self, exc):
+        # error() is called while exc is being handled, so that it can
+        # format the traceback
+        assert sys.exc_info()[1] is exc
+        return "failed at %s" % exc
+
+
+class IPCServer(object):
+    """
+        Runs an ipc.Server with a trivial echo handler on a fresh event loop.
+        The client shares that loop, so no extra thread is needed: the server
+        is serviced while the client waits for its replies.
+    """
+    def __init__(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, "qtilesocket")
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.subscriptions = []
+        self.server = libqtile.ipc.Server(
+            self.fname, self.handler, self.loop, subscribe=self.subscribe
+        )
+        self.server.start()
+
+    def handler(self, req):
+        selectors, name, args, kwargs = req
+        if name == "count":
+            return Count(*args)
+        if name == "raise":
+            raise ValueError(name)
+        return (name, args)
+
+    def subscribe(self, req, subscription):
+        if "unknown" in req[2]:
+            subscription.close()
+            return "refused"
+        self.subscriptions.append(subscription)
+        subscription.add_close_callback(
+            lambda: self.subscriptions.remove(subscription)
+        )
+        return "subscribed"
+
+    def restart(self):
+        self.server.close()
+        self.server = libqtile.ipc.Server(
+            self.fname, self.handler, self.loop, subscribe=self.subscribe
+        )
+        self.server.start()
+
+    def close(self):
+        self.server.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.tmpdir)
+
+
+def test_roundtrip():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        assert client.call(([], "status", (), {})) == ("status", ())
+        assert client.call(([], "echo", (1, "two"), {})) == ("echo", (1, "two"))
+        client.close()
+    finally:
+        s.close()
+
+
+def test_connection_is_reused():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        client.call(([], "one", (), {}))
+        proto = client.proto
+        client.call(([], "two", (), {}))
+        assert client.proto is proto
+        client.close()
+    finally:
+        s.close()
+
+
+def test_pipelining():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        msgs = [([], "echo", (i,), {}) for i in range(100)]
+        replies = client.send_many(msgs)
+        assert replies == [("echo", (i,)) for i in range(100)]
+        assert not client.proto.pending
+        client.close()
+    finally:
+        s.close()
+
+
+def test_connection_close_on_exec():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        assert client.call(([], "status", (), {})) == ("status", ())
+        proto, = s.server.connections
+        sock = proto.transport.get_extra_info('socket')
+        assert fcntl.fcntl(sock, fcntl.F_GETFD) & fcntl.FD_CLOEXEC
+        client.close()
+    finally:
+        s.close()
+
+
+def test_server_restart():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        assert client.call(([], "one", (), {})) == ("one", ())
+        proto = client.proto
+        s.restart()
+        assert client.call(([], "two", (), {})) == ("two", ())
+        assert client.proto is not proto
+        client.close()
+    finally:
+        s.close()
+
+
+def test_server_gone():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        client.call(([], "one", (), {}))
+        s.server.close()
+        assert_raises(
+            libqtile.ipc.IPCError, client.call, ([], "two", (), {})
+        )
+        client.close()
+    finally:
+        s.close()
+
+
+def test_no_server():
+    tmpdir = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        client = libqtile.ipc.Client(os.path.join(tmpdir, "nosocket"))
+        assert_raises(libqtile.ipc.IPCError, client.call, ([], "status", (), {}))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(tmpdir)
+
+
+def test_async_client():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.AsyncClient(s.fname, s.loop)
+        # These are all issued before the connection has been made, and
+        # must share it.
+        replies = [client.send(([], "echo", (i,), {})) for i in range(50)]
+        results = s.loop.run_until_complete(asyncio.gather(*replies))
+        assert results == [("echo", (i,)) for i in range(50)]
+        proto = client.proto
+        s.loop.run_until_complete(client.send(([], "status", (), {})))
+        assert client.proto is proto
+        client.close()
+    finally:
+        s.close()
+
+
+def test_async_client_no_server():
+    tmpdir = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    try:
+        client = libqtile.ipc.AsyncClient(os.path.join(tmpdir, "nosocket"), loop)
+        reply = client.send(([], "status", (), {}))
+        assert_raises(libqtile.ipc.IPCError, loop.run_until_complete, reply)
+    finally:
+        loop.close()
+        shutil.rmtree(tmpdir)
+
+
+def test_async_client_connect_error():
+    loop = asyncio.new_event_loop()
+    try:
+        # Without a path create_unix_connection fails with ValueError, which
+        # must still fail the pending requests rather than leave them hanging
+        client = libqtile.ipc.AsyncClient(None, loop)
+        replies = [client.send(([], "status", (), {})) for i in range(2)]
+        for reply in replies:
+            assert_raises(ValueError, loop.run_until_complete, reply)
+        reply = client.send(([], "status", (), {}))
+        assert_raises(ValueError, loop.run_until_complete, reply)
+    finally:
+        loop.close()
+
+
+def test_subscribe():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        stream = client.subscribe(([], "subscribe", (), {}))
+        assert next(stream) == "subscribed"
+        assert len(s.subscriptions) == 1
+
+        s.subscriptions[0].push("one")
+        s.subscriptions[0].push("two")
+        # Replies and pushed messages share the connection
+        assert client.call(([], "status", (), {})) == ("status", ())
+        assert next(stream) == "one"
+        assert next(stream) == "two"
+
+        client.close()
+        s.loop.run_until_complete(asyncio.sleep(0.01))
+        assert not s.subscriptions
+    finally:
+        s.close()
+
+
+def test_subscribe_refused():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        # Retrying a refused subscription doesn't pile up dead ones
+        for i in range(3):
+            stream = client.subscribe(([], "subscribe", ("unknown",), {}))
+            assert next(stream) == "refused"
+            stream.close()
+        assert client.proto.streams == {}
+        proto, = s.server.connections
+        assert proto.subscriptions == []
+        client.close()
+    finally:
+        s.close()
+
+
+class PausedProtocol(object):
+    paused = True
+
+    def __init__(self):
+        self.sent = []
+
+    def push(self, msg, msgid):
+        self.sent.append(msg)
+
+
+def test_subscription_queue():
+    proto = PausedProtocol()
+    sub = libqtile.ipc.Subscription(proto, 0, maxlen=3)
+    sub.push("a", key="a")
+    sub.push("b1", key="b")
+    sub.push("c", key="c")
+    sub.push("b2", key="b")
+    assert not proto.sent
+    # "b1" was coalesced into "b2", so nothing was dropped yet
+    assert sub.dropped == 0
+
+    sub.push("d", key="d")
+    assert sub.dropped == 1
+
+    proto.paused = False
+    sub.flush()
+    assert proto.sent == ["c", "b2", "d"]
+
+    sub.push("e")
+    assert proto.sent[-1] == "e"
+
+
+def test_binary_codec():
+    codec = libqtile.ipc.BinaryCodec()
+    msgs = [
+        None, True, False, 0, -1, 2 ** 40, 2 ** 70, -(2 ** 70), 1.5,
+        "", "text", u"☃", [], (), {},
+        ([("group", "a")], "info", (1, None), {"key": [1.0, (2,)]}),
+        {1: "one", "two": {"nested": [True]}},
+    ]
+    for msg in msgs:
+        assert codec.decode(codec.encode(msg)) == msg
+        assert type(codec.decode(codec.encode(msg))) is type(msg)
+
+    assert_raises(TypeError, codec.encode, object())
+    data = codec.encode(["one", "two"])
+    # The last one is a dict with a list as a key
+    for bad in (data[:-1], data + b"x", b"?", b"", b"\x34\x01\x30\x00\x00"):
+        assert_raises(ValueError, codec.decode, bad)
+
+
+def test_json_codec():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname, codecs=("json/1",))
+        assert client.call(([], "echo", (1, "two"), {})) == ["echo", [1, "two"]]
+        assert client.proto.codec.name == "json/1"
+        client.close()
+    finally:
+        s.close()
+
+
+def test_default_codec():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        # Tuples and non-string dict keys survive the trip
+        args = (True, [0, 1, 2], {1: "a"})
+        assert client.call(([], "echo", args, {})) == ("echo", args)
+        assert client.proto.codec.name == "binary/1"
+        client.close()
+    finally:
+        s.close()
+
+
+def test_invalid_request():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        for req in ("echo", ([], "echo"), ([], 1, (), {}), ([], "echo", (), 1)):
+            assert client.call(req) == "Invalid request"
+        assert client.call(([], "raise", (), {})) == "Error handling request"
+        # The connection survives
+        proto = client.proto
+        assert client.call(([], "echo", (), {})) == ("echo", ())
+        assert client.proto is proto
+        client.close()
+    finally:
+        s.close()
+
+
+def test_no_common_codec():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname, codecs=("nonexistent/1",))
+        assert_raises(libqtile.ipc.IPCError, client.call, ([], "echo", (), {}))
+    finally:
+        s.close()
+
+
+def test_chunked_reply():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        # Replies that aren't chunked can overtake a chunked one
+        replies = client.send_many([
+            ([], "count", (1000, None, 100), {}),
+            ([], "echo", (), {}),
+            ([], "count", (10, 5), {}),
+        ])
+        assert replies[0] == list(range(1000))
+        assert replies[0].end == "done"
+        assert replies[1] == ("echo", ())
+        assert replies[2] == list(range(5))
+        assert replies[2].end == "failed at 5"
+        assert not client.proto.chunks
+        client.close()
+    finally:
+        s.close()
+
+
+def test_chunked_part_size():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        proto = client.connect()
+        # Small items go together, up to part_size bytes per part
+        for args, several in (((1000,), False), ((1000, None, 100), True)):
+            parts = []
+            end = proto.send(([], "count", args, {}), parts.append)
+            client.loop.run_until_complete(end)
+            assert (len(parts) > 1) == several
+            assert sum(parts, []) == list(range(1000))
+            assert end.result() == "done"
+        client.close()
+    finally:
+        s.close()
+
+
+def test_send_chunked():
+    s = IPCServer()
+    try:
+        client = libqtile.ipc.Client(s.fname)
+        parts, end = client.send_chunked(([], "count", (100, None, 10), {}))
+        assert next(parts) == 0
+        # Only the first few parts have been sent so far
+        assert not end.done()
+        assert list(parts) == list(range(1, 100))
+        assert end.result() == "done"
+
+        # Encoding failures end the reply too
+        parts, end = client.send_chunked(([], "count", (10, 3, None, True), {}))
+        assert list(parts) == [0, 1, 2]
+        assert end.result().startswith("failed at")
+
+        parts, end = client.send_chunked(([], "echo", (), {}))
+        assert list(parts) == []
+        assert end.result() == ("echo", ())
+        client.close()
+    finally:
+        s.close()
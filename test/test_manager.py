@@ -27,6 +27,8 @@
 
 import time
 import subprocess
+import xcffib
+import xcffib.xproto
 import libqtile
 import libqtile.layout
 import libqtile.bar
@@ -36,12 +38,17 @@ import libqtile.manager
 import libqtile.config
 import libqtile.hook
 import libqtile.confreader
+import libqtile.xcbq
 
 from nose.tools import assert_raises
 from nose.plugins.attrib import attr
 
 from . import utils
 from .utils import Xephyr
+from .fakes import (
+    bare_qtile, event, frame_qtile, key, key_qtile, layout_qtile, LayoutGroup,
+    window_connection
+)
 
 class TestConfig:
     auto_fullscreen = True
@@ -216,6 +223,78 @@ def test_events(self):
     assert self.c.status() == "OK"
 
 
+def test_deferred_layout():
+    qtile = layout_qtile()
+    a, b = LayoutGroup("a"), LayoutGroup("b")
+
+    # However often a group is asked for, it is laid out once, on the next
+    # iteration of the event loop
+    for i in range(10):
+        qtile.schedule_layout(a)
+    qtile.schedule_layout(b, warp=True)
+    qtile.schedule_layout(a, warp=True)
+    assert a.layouts == b.layouts == []
+    assert len(qtile.soon) == 1
+    qtile.soon.pop()()
+    assert a.layouts == [True]
+    assert b.layouts == [True]
+    assert not qtile.dirtyGroups
+
+    # flush_layout lays out right away, and only the group it is given
+    qtile.schedule_layout(a)
+    qtile.schedule_layout(b)
+    qtile.flush_layout(a)
+    assert a.layouts == [True, False]
+    assert list(qtile.dirtyGroups) == [b]
+    qtile.flush_layout()
+    assert b.layouts == [True, False]
+
+    # The pass scheduled above finds nothing left to do
+    qtile.soon.pop()()
+    assert a.layouts == [True, False]
+    assert b.layouts == [True, False]
+
+
+@Xephyr(False, TestConfig())
+def test_place_skips_redundant_requests(self):
+    self.testWindow("one")
+    self.c.flush_layout()
+    before = self.c.place_stats()
+    self.c.eval("self.currentGroup.layoutAll()")
+    self.c.flush_layout()
+    after = self.c.place_stats()
+    assert after["configure"] == before["configure"]
+    assert after["configure_skipped"] > before.get("configure_skipped", 0)
+
+
+@Xephyr(False, TestConfig())
+def test_property_cache(self):
+    self.testWindow("one")
+    wid = self.c.window.info()["id"]
+    self.c.window.info()
+
+    # Change WM_CLASS behind qtile's back; the PropertyNotify has to reach
+    # its cache.
+    conn = xcffib.connect(self.display)
+    atoms = [
+        conn.core.InternAtom(False, len(name), name).reply().atom
+        for name in ("WM_CLASS", "STRING")
+    ]
+    value = b"other\0Other\0"
+    conn.core.ChangeProperty(
+        xcffib.xproto.PropMode.Replace, wid, atoms[0], atoms[1], 8,
+        len(value), value
+    )
+    conn.flush()
+    for i in range(20):
+        if list(self.c.window.info()["wm_class"]) == ["other", "Other"]:
+            break
+        time.sleep(0.1)
+    else:
+        raise AssertionError("WM_CLASS change not seen")
+    conn.disconnect()
+
+
 # FIXME: failing test disabled. For some reason we don't seem
 # to have a keymap in Xnest or Xephyr 99% of the time.
 @Xephyr(False, TestConfig())
@@ -946,3 +1025,292 @@ def test_minimal__(self):
 def test_colorPixel(self):
     # test for #394
     self.c.eval("self.colorPixel(\"ffffff\")")
+
+
+def test_schedule_draw():
+    qtile = frame_qtile()
+    loop = qtile._eventloop
+    calls = []
+
+    def paint(name):
+        def f():
+            calls.append(name)
+        return f
+    a, b = paint("a"), paint("b")
+
+    # Repeated paints are coalesced into one frame, in scheduling order
+    qtile.schedule_draw(a)
+    qtile.schedule_draw(b)
+    qtile.schedule_draw(a)
+    assert calls == []
+    assert len(loop.later) == 1
+    delay, frame = loop.later.pop()
+    assert delay == 0
+    frame()
+    assert calls == ["a", "b"]
+
+    # The next frame waits for the rest of the frame interval
+    loop.now = .03
+    qtile.schedule_draw(a)
+    assert len(loop.later) == 1
+    delay, frame = loop.later.pop()
+    assert abs(delay - .07) < 1e-9
+    loop.now = .1
+    frame()
+    assert calls == ["a", "b", "a"]
+
+    # A paint which is late already goes in the next loop iteration
+    loop.now = .5
+    qtile.schedule_draw(b)
+    delay, frame = loop.later.pop()
+    assert delay == 0
+    frame()
+    assert calls == ["a", "b", "a", "b"]
+
+
+def test_schedule_draw_now():
+    qtile = frame_qtile()
+    loop = qtile._eventloop
+    calls = []
+
+    def a():
+        calls.append("a")
+
+    def b():
+        calls.append("b")
+
+    # now paints right away and drops the pending paint of the same func
+    qtile.schedule_draw(a)
+    qtile.schedule_draw(b)
+    qtile.schedule_draw(a, now=True)
+    assert calls == ["a"]
+    delay, frame = loop.later.pop()
+    frame()
+    assert calls == ["a", "b"]
+
+    # and does not schedule a frame of its own
+    qtile.schedule_draw(a, now=True)
+    assert calls == ["a", "b", "a"]
+    assert loop.later == []
+    assert not qtile.pendingDraws
+
+
+def test_schedule_draw_in_frame():
+    qtile = frame_qtile()
+    loop = qtile._eventloop
+    calls = []
+
+    def a():
+        calls.append("a")
+        # Paints scheduled while drawing go in the next frame
+        qtile.schedule_draw(a)
+
+    def broken():
+        raise RuntimeError("broken paint")
+
+    qtile.schedule_draw(broken)
+    qtile.schedule_draw(a)
+    delay, frame = loop.later.pop()
+    frame()
+    assert calls == ["a"]
+    assert list(qtile.pendingDraws) == [a]
+    assert len(loop.later) == 1
+
+
+def test_coalesce_events():
+    qtile = bare_qtile()
+    qtile.windowMap.update({1: None, 2: None})
+    xproto = xcffib.xproto
+    ConfigWindow = xproto.ConfigWindow
+
+    name1 = event(xproto.PropertyNotifyEvent, window=1, atom=10)
+    icon1 = event(xproto.PropertyNotifyEvent, window=1, atom=11)
+    name2 = event(xproto.PropertyNotifyEvent, window=2, atom=10)
+    name1_again = event(xproto.PropertyNotifyEvent, window=1, atom=10)
+    key = event(xproto.KeyPressEvent, detail=38)
+    assert qtile._coalesceEvents(
+        [name1, icon1, key, name2, name1_again]
+    ) == [icon1, key, name2, name1_again]
+
+    # Only motion directly following motion on the same window is dropped
+    motion = [event(xproto.MotionNotifyEvent, event=w) for w in (1, 1, 2, 2)]
+    more = event(xproto.MotionNotifyEvent, event=2)
+    assert qtile._coalesceEvents(motion + [key, more]) == \
+        [motion[1], motion[3], key, more]
+
+    # A managed window's requests are merged into the last one
+    move = event(
+        xproto.ConfigureRequestEvent, window=1, x=10, y=20, width=0, height=0,
+        value_mask=ConfigWindow.X | ConfigWindow.Y
+    )
+    unmanaged = event(
+        xproto.ConfigureRequestEvent, window=3, x=0, y=0, width=30, height=0,
+        value_mask=ConfigWindow.Width
+    )
+    resize = event(
+        xproto.ConfigureRequestEvent, window=1, x=5, y=0, width=50, height=0,
+        value_mask=ConfigWindow.X | ConfigWindow.Width
+    )
+    unmanaged_again = event(
+        xproto.ConfigureRequestEvent, window=3, x=0, y=0, width=40, height=0,
+        value_mask=ConfigWindow.Width
+    )
+    assert qtile._coalesceEvents(
+        [move, unmanaged, name1, resize, unmanaged_again]
+    ) == [unmanaged, name1, resize, unmanaged_again]
+    assert resize.value_mask == \
+        ConfigWindow.X | ConfigWindow.Y | ConfigWindow.Width
+    assert (resize.x, resize.y, resize.width) == (5, 20, 50)
+    assert resize.height == 0
+
+
+def test_manage_prefetch():
+    qtile = bare_qtile()
+    qtile.conn = window_connection()
+    requests = qtile.conn.conn.core.requests
+    win = libqtile.xcbq.Window(qtile.conn, 1)
+    read = []
+
+    def manage(w):
+        read.append(list(requests))
+        w.get_attributes()
+        w.get_property("QTILE_INTERNAL")
+    qtile._manage = manage
+
+    del requests[:]
+    qtile.manage(win)
+    # Everything managing reads is asked for before any of it is read
+    asked = read[0]
+    assert len(asked) == len(qtile.manageProperties) + 2
+    assert all(r[0].startswith("Get") for r in asked)
+    # and the replies that weren't read are dropped afterwards
+    assert win._prefetched == {}
+    discarded = [r[1:] for r in requests if r[0] == "discard"]
+    assert len(discarded) == len(asked) - 2
+    assert ("GetWindowAttributes", 1) not in discarded
+
+
+class ScanRoot(object):
+    def __init__(self, children):
+        self.children = children
+        self.clientLists = []
+
+    def query_tree(self):
+        return None, None, self.children
+
+    def set_property(self, name, value):
+        if name == "_NET_CLIENT_LIST":
+            self.clientLists.append(value)
+
+
+class ScanClient(object):
+    def __init__(self, group):
+        self.group = group
+
+
+def test_scan():
+    qtile = layout_qtile()
+    qtile.conn = window_connection()
+    requests = qtile.conn.conn.core.requests
+    children = [libqtile.xcbq.Window(qtile.conn, wid) for wid in (1, 2, 3)]
+    qtile.root = ScanRoot(children)
+    # Window 3 is withdrawn
+    wm_state = qtile.conn.atoms["WM_STATE"]
+    qtile.conn.conn.core.properties[(3, wm_state)] = [0]
+    group = LayoutGroup("a")
+    managed = []
+
+    def manage(w):
+        if not managed:
+            managed.append(list(requests))
+        qtile.windowMap[w.wid] = ScanClient(group)
+        qtile.update_client_list()
+        qtile.schedule_layout(group)
+    qtile._manage = manage
+
+    del requests[:]
+    qtile.scan()
+    assert sorted(qtile.windowMap) == [1, 2]
+    # The state of every window is asked for before any is read
+    assert [r[0] for r in requests[:6]] == \
+        ["GetWindowAttributes", "GetProperty"] * 3
+    # and so is everything managing the windows reads
+    asked = [r for r in managed[0] if r[0] != "reply"]
+    assert len(asked) == 6 + 2 * (len(qtile.manageProperties) + 2)
+    # The client list is published and the group laid out once, at the end
+    assert qtile.root.clientLists == [[1, 2]]
+    assert group.layouts == [False]
+    assert not qtile.dirtyGroups
+    assert not qtile.scanning
+
+
+def test_key_dispatch():
+    keysyms = libqtile.xcbq.keysyms
+    keymap = {
+        8: [keysyms["Num_Lock"], 0],
+        9: [keysyms["a"], keysyms["A"]],
+        10: [keysyms["a"], keysyms["A"]],
+    }
+    qtile = key_qtile(keymap)
+    qtile.mapKeys([key(["mod4"], "a", "one"), key(["control"], "a", "two")])
+    ModMasks = libqtile.xcbq.ModMasks
+    mod4, lock, numlock = ModMasks["mod4"], ModMasks["lock"], ModMasks["mod2"]
+    assert qtile.numlockMask == numlock
+
+    def press(code, state):
+        e = event(xcffib.xproto.KeyPressEvent, detail=code, state=state)
+        qtile.handle_KeyPress(e)
+        return qtile.server.calls.pop() if qtile.server.calls else None
+
+    # Every keycode of the keysym works, with any lock on
+    for code in (9, 10):
+        for locks in (0, lock, numlock, lock | numlock):
+            assert press(code, mod4 | locks) == "one"
+            assert press(code, ModMasks["control"] | locks) == "two"
+    # but not with other modifiers
+    assert press(9, mod4 | ModMasks["shift"]) is None
+    assert press(9, 0) is None
+
+    # The keys are grabbed on their lowest keycode, with the locks
+    grabs = qtile.root._key_grabs
+    assert set(grabs) == set(
+        (9, mods | locks)
+        for mods in (mod4, ModMasks["control"])
+        for locks in (0, numlock, numlock | lock)
+    )
+
+
+def test_mapping_notify():
+    keysyms = libqtile.xcbq.keysyms
+    keymap = {
+        8: [keysyms["Num_Lock"], 0],
+        9: [keysyms["a"], 0],
+        10: [keysyms["b"], 0],
+    }
+    qtile = key_qtile(keymap)
+    qtile.mapKeys([key(["mod4"], "a", "one"), key(["mod4"], "b", "two")])
+    mod4 = libqtile.xcbq.ModMasks["mod4"]
+    requests = qtile.conn.conn.core.requests
+    b_grabs = dict(
+        (k, v) for k, v in qtile.root._key_grabs.items() if k[0] == 10
+    )
+
+    # "a" moves from keycode 9 to 11
+    keymap.update({9: [0, 0], 11: [keysyms["a"], 0]})
+    del requests[:]
+    qtile.handle_MappingNotify(event(
+        xcffib.xproto.MappingNotifyEvent,
+        request=xcffib.xproto.Mapping.Keyboard, first_keycode=9, count=3
+    ))
+    assert requests[0] == ("GetKeyboardMapping", 9, 3)
+    # Only the grabs of "a" change
+    assert all(r[0] in ("UngrabKey", "GrabKey") for r in requests[1:])
+    assert set(r[1] for r in requests if r[0] == "UngrabKey") == set([9])
+    assert set(r[4] for r in requests if r[0] == "GrabKey") == set([11])
+    assert set(k[0] for k in qtile.root._key_grabs) == set([10, 11])
+    for k, v in b_grabs.items():
+        assert qtile.root._key_grabs[k] == v
+
+    assert (9, mod4) not in qtile.keyDispatch
+    assert qtile.keyDispatch[(11, mod4)].key == "a"
+    assert qtile.keyDispatch[(10, mod4)].key == "b"
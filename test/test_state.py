@@ -0,0 +1,119 @@
+# Copyright (c) 2026 The Qtile developers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import six
+
+from libqtile.state import QtileState
+from nose.tools import assert_raises
+
+
+class FakeLayout(object):
+    def __init__(self, name, ratio):
+        self.name = name
+        self.ratio = ratio
+
+    def get_state(self):
+        return dict(ratio=self.ratio)
+
+    def set_state(self, state):
+        self.ratio = state["ratio"]
+
+
+class FakeClient(object):
+    def __init__(self, wid):
+        self.window = type("Window", (), dict(wid=wid))()
+        self.group = None
+
+    def togroup(self, name):
+        self.moved = name
+
+
+class FakeGroup(object):
+    def __init__(self, name, clients):
+        self.name = name
+        self.layouts = [
+            FakeLayout("max", None), FakeLayout("tile", .6),
+            FakeLayout("tile", .3)
+        ]
+        self.layout = self.layouts[1]
+        self.windows = set(clients)
+        self.focusHistory = list(clients)
+        for c in clients:
+            c.group = self
+
+    def focus(self, win, warp):
+        self.focused = win
+
+
+class FakeScreen(object):
+    def __init__(self, group):
+        self.group = group
+
+    def setGroup(self, group):
+        self.group = group
+
+
+class FakeQtile(object):
+    def __init__(self):
+        self.clients = [FakeClient(i) for i in range(4)]
+        self.groups = [
+            FakeGroup("a", self.clients[:3]), FakeGroup("b", self.clients[3:])
+        ]
+        self.groupMap = dict((g.name, g) for g in self.groups)
+        self.windowMap = dict((c.window.wid, c) for c in self.clients)
+        self.screens = [FakeScreen(self.groups[1])]
+        self.currentScreen = self.screens[0]
+
+    def toScreen(self, index):
+        self.current_screen = index
+
+
+def test_dump_load():
+    qtile = FakeQtile()
+    qtile.groups[0].focusHistory.reverse()
+    buf = six.StringIO()
+    QtileState(qtile).dump(buf)
+
+    buf.seek(0)
+    state = QtileState.load(buf)
+    assert state.windows == {0: "a", 1: "a", 2: "a", 3: "b"}
+    assert state.screens == {0: "b"}
+    assert state.layouts["a"][1] == ["tile", {"ratio": .6}]
+    assert state.layouts["a"][2] == ["tile", {"ratio": .3}]
+
+    restarted = FakeQtile()
+    restarted.groups[0].layouts[1].ratio = .5
+    restarted.groups[0].layouts[2].ratio = .5
+    restarted.groups[1].layouts[1].name = "columns"
+    restarted.groups[1].layouts[1].ratio = .5
+    state.apply(restarted)
+    a = restarted.groups[0]
+    # Layouts of the same class keep their own state
+    assert a.layouts[1].ratio == .6
+    assert a.layouts[2].ratio == .3
+    # A layout which is no longer at the same index is left alone
+    assert restarted.groups[1].layouts[1].ratio == .5
+    assert [c.window.wid for c in a.focusHistory] == [2, 1, 0]
+    assert a.focused is a.focusHistory[-1]
+    assert restarted.screens[0].group is restarted.groups[1]
+    assert restarted.current_screen == 0
+
+    buf = six.StringIO('{"version":0}')
+    assert_raises(ValueError, QtileState.load, buf)
@@ -24,6 +24,7 @@
 from libqtile.config import Screen
 from libqtile.bar import Bar
 from libqtile.widget import TextBox, ThermalSensor
+from libqtile.widget.graph import _Graph, _Samples
 
 
 from .utils import Xephyr
@@ -75,3 +76,124 @@ def test_thermalsensor_regex_compatibility():
     assert sensors_detected["Core 2"] == ("58.0", "°C")
     assert sensors_detected["Core 3"] == ("61.0", "°C")
     assert not ("Adapter" in sensors_detected.keys())
+
+
+def test_graph_samples():
+    samples = _Samples(4)
+    assert list(samples) == [0, 0, 0, 0]
+    pushed = [3, 1, 2, 0, 0, 5, 1, 1, 1, 1]
+    maxima = [3, 3, 3, 3, 2, 5, 5, 5, 5, 1]
+    for i, (value, maximum) in enumerate(zip(pushed, maxima)):
+        samples.push(value)
+        last = pushed[max(i - 3, 0):i + 1]
+        assert list(reversed(samples))[-len(last):] == last
+        assert samples[0] == value
+        assert samples.max() == maximum
+    assert samples.oldest(1, 3) == [1, 1]
+
+    samples.fill(7)
+    assert list(samples) == [7, 7, 7, 7]
+    samples.push(2)
+    assert samples.max() == 7
+    assert samples[-1] == 7
+
+
+class GraphContext(object):
+    def __init__(self):
+        self.points = []
+
+    def line_to(self, x, y):
+        self.points.append((round(x, 4), round(y, 4)))
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class GraphDrawer(object):
+    def __init__(self):
+        self.ctx = GraphContext()
+        self.scrolled = []
+
+    def clear(self, colour):
+        pass
+
+    def set_source_rgb(self, colour):
+        pass
+
+    def draw(self, offsetx, width):
+        pass
+
+    def scroll(self, x, y, width, height, dx, dy):
+        self.scrolled.append(dx)
+
+
+class GraphBar(object):
+    horizontal = True
+    size = height = 20
+    background = "000000"
+
+
+class GraphQtile(object):
+    def __init__(self):
+        self.pending = []
+
+    def schedule_draw(self, func, now=False):
+        if func not in self.pending:
+            self.pending.append(func)
+
+
+def test_graph_scroll():
+    # The default graph fits 100 samples in 90 pixels, so it moves by a
+    # fraction of a pixel per sample
+    widget = _Graph()
+    widget.bar = GraphBar()
+    widget.qtile = GraphQtile()
+    widget.drawer = GraphDrawer()
+    widget.offsetx = 0
+    widget.fixed_upper_bound = True
+    widget.maxvalue = 100
+    widget.lag_cycles = 1
+    assert widget.step != int(widget.step)
+    widget.draw()
+
+    def sample_points():
+        # line_to points of the samples, without those closing the fill
+        bottom = max(y for x, y in points)
+        return set(p for p in points if p[1] != bottom)
+
+    full = []
+    widget.draw = lambda: full.append(True)
+    points = widget.drawer.ctx.points
+    for i in range(1, 21):
+        del points[:]
+        _Graph.draw(widget)
+        before = sample_points()
+
+        widget.push(i * 4)
+        widget.push(i * 3)
+        # Pushes are painted once, in the next frame
+        assert widget.qtile.pending == [widget._paint]
+        scrolls = len(widget.drawer.scrolled)
+        del points[:]
+        widget.qtile.pending.pop()()
+        assert not full
+        redrawn = sample_points()
+        dx = sum(widget.drawer.scrolled[scrolls:])
+        moved = set((round(x + dx, 4), y) for x, y in before)
+
+        # Every sample is either where scrolling moved it or redrawn, at
+        # the place a full draw puts it
+        del points[:]
+        _Graph.draw(widget)
+        assert redrawn
+        assert sample_points() <= moved | redrawn
+
+    moved = 40 * widget.step
+    assert -sum(widget.drawer.scrolled) == int(moved)
+    assert abs(widget._phase - (moved - int(moved))) < 1e-9
+
+    # A new scale draws the whole graph
+    widget.maxvalue = 50
+    widget.push(10)
+    widget.qtile.pending.pop()()
+    assert full
@@ -0,0 +1,234 @@
+# Copyright (c) 2026 The Qtile developers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import array
+import logging
+import struct
+
+import libqtile.hook
+import libqtile.manager
+from libqtile.window import IconCache, Window, _icon_surface
+from nose.tools import with_setup
+
+
+def setup():
+    class Dummy:
+        pass
+
+    dummy = Dummy()
+    dummy.log = libqtile.manager.init_log(logging.CRITICAL)
+    libqtile.hook.init(dummy)
+
+
+def teardown():
+    libqtile.hook.clear()
+
+
+def pixels(*argb):
+    return bytearray(struct.pack("=%dI" % len(argb), *argb))
+
+
+def surface_pixels(surface):
+    surface.flush()
+    count = surface.get_width() * surface.get_height()
+    return list(struct.unpack_from("=%dI" % count, surface.get_data()))
+
+
+def test_icon_surface():
+    # _NET_WM_ICON colours aren't premultiplied by the alpha, cairo's are
+    surface = _icon_surface(
+        pixels(0xffff0000, 0x80ffffff, 0x0000ff00, 0x330000ff), 4, 1
+    )
+    assert surface_pixels(surface) == \
+        [0xffff0000, 0x80808080, 0x00000000, 0x33000033]
+
+    # Rows of the alpha mask are padded
+    surface = _icon_surface(pixels(*[0x80ffffff, 0xff00ff00] * 3), 3, 2)
+    assert surface_pixels(surface) == [0x80808080, 0xff00ff00] * 3
+
+    opaque = pixels(0xff123456, 0xff000000)
+    assert surface_pixels(_icon_surface(opaque, 2, 1)) == \
+        [0xff123456, 0xff000000]
+
+
+class FakeProperty(object):
+    def __init__(self, data):
+        self.value = [data]
+
+
+def icon_data(sizes):
+    """
+        A _NET_WM_ICON with icons of sizes, whose pixels are their width,
+        opaque.
+    """
+    data = b""
+    for width, height in sizes:
+        data += struct.pack("=II", width, height)
+        data += struct.pack("=I", 0xff000000 | width) * (width * height)
+    return data
+
+
+class FakeXWindow(object):
+    wid = 1
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_property(self, name, type):
+        return FakeProperty(self.data)
+
+
+class FakeQtile(object):
+    def __init__(self):
+        self.iconCache = IconCache()
+
+
+def icon_window(data):
+    win = Window.__new__(Window)
+    win.window = FakeXWindow(data)
+    win.qtile = FakeQtile()
+    win.update_wm_net_icon()
+    return win
+
+
+@with_setup(setup, teardown)
+def test_get_icon():
+    win = icon_window(icon_data([(16, 16), (48, 48), (32, 32), (64, 24)]))
+
+    def size(square):
+        icon = win.get_icon(square)
+        assert surface_pixels(icon)[0] == 0xff000000 | icon.get_width()
+        return (icon.get_width(), icon.get_height())
+
+    # The smallest icon covering the square
+    assert size(8) == (16, 16)
+    assert size(16) == (16, 16)
+    assert size(20) == (32, 32)
+    assert size(24) == (32, 32)
+    assert size(40) == (48, 48)
+    # or else the largest one
+    assert size(100) == (48, 48)
+
+    # The last icon asked for is kept
+    assert win.get_icon(100) is win.get_icon(100)
+
+    assert icon_window(b"").get_icon(16) is None
+
+
+@with_setup(setup, teardown)
+def test_icons():
+    # The pixels in byte order: blue, green, red, alpha
+    data = struct.pack("=II", 2, 1) + bytes(bytearray([
+        255, 255, 255, 128,
+        0, 255, 0, 255,
+    ])) + icon_data([(1, 1)])
+    win = icon_window(data)
+    icons = win.icons
+    assert sorted(icons) == ["1x1", "2x1"]
+    assert isinstance(icons["2x1"], array.array)
+    # Premultiplied, as they always were
+    assert icons["2x1"].tolist() == [
+        128, 128, 128, 128,
+        0, 255, 0, 255,
+    ]
+    assert len(icons["1x1"]) == 4
+
+    # They are kept until _NET_WM_ICON changes
+    assert win.icons is icons
+    win.window.data = icon_data([(3, 1)])
+    win.update_wm_net_icon()
+    assert sorted(win.icons) == ["3x1"]
+    assert win.icons["3x1"].tolist() == [3, 0, 0, 255] * 3
+
+
+class FakeSurface(object):
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+    def get_stride(self):
+        return self.width * 4
+
+
+class IconClient(object):
+    def __init__(self, wid, width=16):
+        self.window = type("Window", (), dict(wid=wid))()
+        self.width = width
+        self.requested = 0
+
+    def get_icon(self, size):
+        self.requested += 1
+        return FakeSurface(self.width, size)
+
+
+def test_icon_cache():
+    cache = IconCache(max_bytes=3 * 16 * 16 * 4)
+    a, b, c, d = [IconClient(wid) for wid in range(4)]
+    icon = cache.get(a, 16)
+    assert cache.get(a, 16) is icon
+    assert a.requested == 1
+    cache.get(b, 16)
+    cache.get(c, 16)
+    assert cache.size == 3 * 16 * 16 * 4
+
+    # The least recently used icon goes first
+    cache.get(a, 16)
+    cache.get(d, 16)
+    assert list(cache.surfaces) == [(2, 16), (0, 16), (3, 16)]
+    assert cache.size == 3 * 16 * 16 * 4
+    cache.get(b, 16)
+    assert b.requested == 2
+    assert list(cache.surfaces) == [(0, 16), (3, 16), (1, 16)]
+
+    cache.invalidate(0)
+    cache.invalidate(2)
+    assert list(cache.surfaces) == [(3, 16), (1, 16)]
+    assert cache.size == 2 * 16 * 16 * 4
+    assert sorted(cache.heights) == [1, 3]
+    cache.get(a, 16)
+    assert a.requested == 2
+
+    none = IconClient(5)
+    none.get_icon = lambda size: None
+    assert cache.get(none, 16) is None
+    assert (5, 16) not in cache.surfaces
+
+
+def test_icon_cache_cap():
+    cache = IconCache()
+    assert cache.max_bytes == 8 * 1024 * 1024
+    # 4 MiB each
+    icons = [IconClient(wid, 1024) for wid in range(3)]
+    for client in icons:
+        cache.get(client, 1024)
+        assert cache.size <= cache.max_bytes
+    assert list(cache.surfaces) == [(1, 1024), (2, 1024)]
+
+    # An icon larger than the cap is kept on its own
+    huge = IconClient(3, 2048)
+    cache.get(huge, 1100)
+    assert list(cache.surfaces) == [(3, 1100)]
+    assert cache.size == 2048 * 4 * 1100
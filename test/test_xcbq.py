@@ -0,0 +1,259 @@
+# Copyright (c) 2026 The Qtile developers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from libqtile import xcbq
+
+from .fakes import connection, window_connection
+
+
+def test_refresh_keymap():
+    a, b, c = xcbq.keysyms["a"], xcbq.keysyms["b"], xcbq.keysyms["c"]
+    A = xcbq.keysyms["A"]
+    keymap = {9: [a, A], 10: [b, 0], 12: [a, A]}
+    conn = connection(keymap)
+    assert conn.sym_to_codes == {a: [9, 12], b: [10]}
+    assert conn.keysym_to_keycode(a) == 9
+    assert conn.keysym_to_keycodes(a) == [9, 12]
+    before = dict(conn.code_to_syms)
+
+    # Only the keycodes in the range given are read again
+    keymap.update({9: [c, 0], 10: [b, A], 12: [b, 0]})
+    del conn.conn.core.requests[:]
+    assert conn.refresh_keymap(10, 3) == set([a, b])
+    assert conn.conn.core.requests == [("GetKeyboardMapping", 10, 3)]
+    assert conn.code_to_syms[9] is before[9]
+    assert conn.code_to_syms[10] == [b, A]
+    assert conn.code_to_syms[12] == [b, 0]
+    for code in (8, 13, 14, 15):
+        assert conn.code_to_syms[code] is before[code]
+    assert conn.sym_to_codes == {a: [9], b: [10, 12]}
+
+    # A keysym with no keycodes left is dropped
+    assert conn.refresh_keymap(9, 1) == set([a, c])
+    assert conn.sym_to_codes == {b: [10, 12], c: [9]}
+    assert conn.keysym_to_keycode(a) == 0
+    assert conn.keysym_to_keycodes(a) == []
+
+
+def test_set_key_grabs():
+    conn = connection({})
+    window = xcbq.Window(conn, 1)
+    requests = conn.conn.core.requests
+    del requests[:]
+    args = (True, 1, 1)
+    grabs = {(9, 0): args, (9, 16): args, (10, 0): args}
+    window.set_key_grabs(grabs)
+    assert sorted(r[4] for r in requests if r[0] == "GrabKey") == [9, 9, 10]
+    assert len(requests) == 3
+
+    # Unchanged grabs send nothing
+    del requests[:]
+    window.set_key_grabs(dict(grabs))
+    assert requests == []
+
+    # Removed and changed grabs are ungrabbed, new ones grabbed
+    del requests[:]
+    window.set_key_grabs({(9, 0): args, (10, 0): (False, 1, 1), (11, 0): args})
+    assert sorted(r for r in requests if r[0] == "UngrabKey") == [
+        ("UngrabKey", 9, 1, 16), ("UngrabKey", 10, 1, 0)
+    ]
+    assert sorted(r for r in requests if r[0] == "GrabKey") == [
+        ("GrabKey", False, 1, 0, 10, 1, 1), ("GrabKey", True, 1, 0, 11, 1, 1)
+    ]
+    assert len(requests) == 4
+    assert sorted(window._key_grabs) == [(9, 0), (10, 0), (11, 0)]
+
+    # Ungrabbing any key forgets all the grabs
+    window.ungrab_key(None, None)
+    assert window._key_grabs == {}
+
+
+def test_set_button_grabs():
+    conn = connection({})
+    window = xcbq.Window(conn, 1)
+    requests = conn.conn.core.requests
+    del requests[:]
+    args = (True, 4, 1, 1)
+    window.set_button_grabs({(1, 64): args, (3, 64): args})
+    assert sorted(r[8] for r in requests if r[0] == "GrabButton") == [1, 3]
+
+    del requests[:]
+    window.set_button_grabs({(1, 64): args, (3, 64): args})
+    assert requests == []
+
+    del requests[:]
+    window.set_button_grabs({(1, 64): args})
+    assert requests == [("UngrabButton", 3, 1, 64)]
+    assert list(window._button_grabs) == [(1, 64)]
+
+
+def test_prefetch():
+    conn = window_connection()
+    core = conn.conn.core
+    requests = core.requests
+    wm_class, wm_name = conn.atoms["WM_CLASS"], conn.atoms["WM_NAME"]
+    core.properties[(1, wm_class)] = "xterm\0XTerm\0"
+    window = xcbq.Window(conn, 1)
+    del requests[:]
+    window.prefetch([("WM_CLASS", "STRING"), ("WM_NAME", "STRING")],
+                    geometry=True)
+    assert requests == [
+        ("GetGeometry", 1),
+        ("GetProperty", 1, wm_class),
+        ("GetProperty", 1, wm_name),
+    ]
+
+    # Prefetching again sends nothing
+    del requests[:]
+    window.prefetch([("WM_CLASS", "STRING")], geometry=True)
+    assert requests == []
+
+    # The getters use the prefetched replies instead of asking again
+    assert window.get_wm_class() == ("xterm", "XTerm")
+    assert window.get_geometry().width == 100
+    assert requests == [
+        ("reply", "GetProperty", 1, wm_class),
+        ("reply", "GetGeometry", 1),
+    ]
+
+    # and the replies that weren't used are dropped
+    del requests[:]
+    window.discard_prefetched()
+    assert requests == [("discard", "GetProperty", 1, wm_name)]
+    del requests[:]
+    assert window.get_property("WM_NAME", "STRING") is None
+    assert requests == [
+        ("GetProperty", 1, wm_name), ("reply", "GetProperty", 1, wm_name)
+    ]
+
+
+def test_prefetch_before_property_cache():
+    conn = window_connection()
+    core = conn.conn.core
+    requests = core.requests
+    wm_class = conn.atoms["WM_CLASS"]
+    core.properties[(1, wm_class)] = "xterm\0XTerm\0"
+    window = xcbq.Window(conn, 1)
+    window.prefetch([("WM_CLASS", "STRING")])
+    window.enable_property_cache()
+
+    # The prefetched reply may predate the event mask, so the value read
+    # from it isn't kept and the next read asks again
+    del requests[:]
+    assert window.get_wm_class() == ("xterm", "XTerm")
+    assert requests == [("reply", "GetProperty", 1, wm_class)]
+    del requests[:]
+    core.properties[(1, wm_class)] = "urxvt\0URxvt\0"
+    assert window.get_wm_class() == ("urxvt", "URxvt")
+    assert requests[0] == ("GetProperty", 1, wm_class)
+
+    # Discarding forgets which prefetched properties can't be cached
+    window.prefetch([("WM_CLASS", "STRING")])
+    window.discard_prefetched()
+    assert window._prefetched == {}
+    assert window._uncacheable == set()
+
+
+def test_property_cache():
+    conn = window_connection()
+    core = conn.conn.core
+    requests = core.requests
+    wm_class = conn.atoms["WM_CLASS"]
+    core.properties[(1, wm_class)] = "xterm\0XTerm\0"
+    window = xcbq.Window(conn, 1)
+    window.enable_property_cache()
+
+    # The second read is a cache hit
+    assert window.get_wm_class() == ("xterm", "XTerm")
+    del requests[:]
+    core.properties[(1, wm_class)] = "urxvt\0URxvt\0"
+    assert window.get_wm_class() == ("xterm", "XTerm")
+    assert requests == []
+
+    # until a PropertyNotify for the property comes in
+    window.property_changed(conn.atoms["WM_NAME"])
+    assert window.get_wm_class() == ("xterm", "XTerm")
+    window.property_changed(wm_class)
+    assert window.get_wm_class() == ("urxvt", "URxvt")
+    assert requests[0] == ("GetProperty", 1, wm_class)
+
+
+def test_property_cache_skips_old_prefetch():
+    conn = window_connection()
+    core = conn.conn.core
+    pid = conn.atoms["_NET_WM_PID"]
+    core.properties[(1, pid)] = [42]
+    window = xcbq.Window(conn, 1)
+    window.prefetch(["_NET_WM_PID"])
+    window.enable_property_cache()
+
+    # A reply to a prefetch made before the cache was on isn't stored
+    assert window.get_net_wm_pid() == 42
+    assert window._property_cache == {}
+    assert window.get_net_wm_pid() == 42
+    assert list(window._property_cache.values()) == [42]
+
+
+def test_intern_atoms():
+    conn = window_connection()
+    requests = conn.conn.core.requests
+    # All the preloaded atoms are asked for before any reply is read
+    interned = [r[1] for r in requests if r[0] == "InternAtom"]
+    assert requests[:len(interned)] == [("InternAtom", i) for i in interned]
+    assert len(requests) == 2 * len(interned)
+    assert len(set(interned)) == len(interned)
+    for name in xcbq.PRELOAD_ATOMS:
+        assert conn.atoms.reverse[conn.atoms[name]] == name
+
+    # Known atoms aren't asked for again
+    del requests[:]
+    conn.atoms.insert_many(xcbq.PRELOAD_ATOMS | set(["NEW_ATOM"]))
+    assert requests == [
+        ("InternAtom", "NEW_ATOM"), ("reply", "InternAtom", "NEW_ATOM")
+    ]
+
+
+def test_atom_names():
+    conn = window_connection()
+    core = conn.conn.core
+    requests = core.requests
+    # Atoms some client interned
+    one = core.InternAtom(False, 3, "ONE").reply().atom
+    two = core.InternAtom(False, 3, "TWO").reply().atom
+    assert conn.atoms.get_name(conn.atoms["WM_CLASS"], wait=False) == \
+        "WM_CLASS"
+
+    # An unknown atom is asked for, but its name isn't waited for
+    del requests[:]
+    assert conn.atoms.get_name(one, wait=False) is None
+    assert conn.atoms.get_name(two, wait=False) is None
+    assert requests == [("GetAtomName", one), ("GetAtomName", two)]
+
+    # resolve_pending() then reads the names
+    conn.atoms.resolve_pending()
+    assert sorted(requests[2:]) == [
+        ("reply", "GetAtomName", one), ("reply", "GetAtomName", two)
+    ]
+    del requests[:]
+    assert conn.atoms.get_name(one, wait=False) == "ONE"
+    assert conn.atoms.get_name(two) == "TWO"
+    assert conn.atoms["ONE"] == one
+    assert requests == []